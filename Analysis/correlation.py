@@ -2,6 +2,7 @@ import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
 import matplotlib.pyplot as plt
 import seaborn as sns
+from feature_store import FeatureStore, collinearity, correlation_matrix, join_features
 FONT = 'Arial'
 FONT_SIZE = 8
 LINEWIDTH = 0.5
@@ -29,76 +30,44 @@ plt.rcParams.update({
     'ytick.minor.width': LINEWIDTH,
 })
 
-all_surp = []
-all_freq = []
-all_diss = []
-
+#parameters
 stories = ['2_D', '4_D', '5_D', '6_D', '9_D']
+FEATURES = ["surprisal", "Zipf_freq", "semantic_dissimilarity"]
+STORE_DIR = "path_to_features/feature_store"
 
+# word-level feature store keyed by (story, word index): built once, the feature files of each
+# story are aligned onto its spoken words (forced aligner) and joined on the word index
+store = FeatureStore(STORE_DIR)
 for story in stories:
-
-    # Surprisal 
-    df_surp = pd.read_csv(
-        "path_to_features/Surprisal0FF_St" + story + ".csv",
-        sep=";"
-    )
-    df_surp["surpr_norm"] = (
-        (df_surp["surprisal"] - df_surp["surprisal"].min()) /
-        (df_surp["surprisal"].max() - df_surp["surprisal"].min())
-    )
-    df_surp.dropna(inplace=True)
-    df_surp["story_id"] = story
-    all_surp.append(df_surp)
-
-    # Word frequency
-    df_freq = pd.read_csv(
-        "path_to_features/WordFreqOFF_St" + story + ".csv"
-    )
-    df_freq["Zipf_freq_norm"] = (
-        (df_freq["Zipf_freq"] - df_freq["Zipf_freq"].min()) /
-        (df_freq["Zipf_freq"].max() - df_freq["Zipf_freq"].min())
-    )
-    df_freq.dropna(inplace=True)
-    df_freq["story_id"] = story
-    all_freq.append(df_freq)
-
-    # Semantic dissimilarity
-    df_diss = pd.read_csv(
-        "path_to_features/SemanticsDissOFF_St" + story + ".csv"
-    )
-    df_diss["semantic_dissimilarity_norm"] = (
-        (df_diss["semantic_dissimilarity"] - df_diss["semantic_dissimilarity"].min()) /
-        (df_diss["semantic_dissimilarity"].max() - df_diss["semantic_dissimilarity"].min())
-    )
-    df_diss["story_id"] = story
-    all_diss.append(df_diss)
-
-# Concatenate
-df_surp_conc = pd.concat(all_surp, ignore_index=True)
-df_freq_conc = pd.concat(all_freq, ignore_index=True)
-df_diss_conc = pd.concat(all_diss, ignore_index=True)
-
-# Final dataframe
-df = pd.concat(
-    [df_surp_conc,
-     df_freq_conc["Zipf_freq"],
-     df_diss_conc["semantic_dissimilarity"]],
-    axis=1
-)
-
-df.drop(columns=["Unnamed: 0", "Column1"], errors="ignore", inplace=True)
-
-print(df.shape)
-
-
-
-# Normalizzazione tra 0 e 1 delle variabili numeriche
+    if story in store.stories:
+        continue
+    df_surp = pd.read_csv("path_to_features/Surprisal0FF_St" + story + ".csv", sep=";")
+    df_freq = pd.read_csv("path_to_features/WordFreqOFF_St" + story + ".csv")
+    df_diss = pd.read_csv("path_to_features/SemanticsDissOFF_St" + story + ".csv")
+    df_onset = pd.read_csv("path_to_features/WordOnsets_St" + story + ".csv")   # word, BEGIN, END of every spoken word
+    features = {"surprisal": (df_surp[["word", "surprisal"]], "word"),
+                "frequency": (df_freq[["tokens_no_punct", "Zipf_freq"]], "tokens_no_punct"),
+                "dissimilarity": (df_diss[["word", "semantic_dissimilarity"]], "word")}
+    joined, mismatches = join_features(df_onset, features, story)
+    store.add_story(story, joined)
+
+print(len(store), "words,", len(store.stories), "stories")
+
+# collinearity (streamed over the store; words with a missing feature are left out)
+print(correlation_matrix(store, FEATURES, "pearson", stories).round(3))
+print(correlation_matrix(store, FEATURES, "spearman", stories).round(3))
+stats = collinearity(store, FEATURES, "pearson", stories, unit="story")
+print(stats["r_low"].round(3))
+print(stats["r_high"].round(3))
+print(stats["vif"].round(3))
+
+# Normalizzazione tra 0 e 1 delle variabili numeriche (for the plots only; correlations are scale-free)
+df = pd.concat([store.frame(story, FEATURES).assign(story_id=story) for story in stories], ignore_index=True)
+df.dropna(subset=FEATURES, inplace=True)
 scaler = MinMaxScaler()
 
 df_norm = df.copy()
-df_norm[["surprisal", "semantic_dissimilarity", "Zipf_freq"]] = scaler.fit_transform(
-    df[["surprisal", "semantic_dissimilarity", "Zipf_freq"]]
-)
+df_norm[FEATURES] = scaler.fit_transform(df[FEATURES])
 
 # PLOTS
 
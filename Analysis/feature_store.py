@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)  # nlp_pipeline, for the word alignment
+from nlp_pipeline.alignment import WORD_COLUMN, story_events
+
+#parameters
+CHUNK_ROWS = 1 << 16          # words per streamed chunk
+N_BOOT = 1000                 # bootstrap replicates
+CI = 0.95                     # confidence level
+
+INDEX_FILE = "index.json"
+
+
+def join_features(onsets: pd.DataFrame,
+                  features: Dict[str, Tuple[pd.DataFrame, Optional[str]]],
+                  story: str = "",
+                  word_column: str = WORD_COLUMN,
+                  agg: Optional[Dict[str, str]] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Joins the feature tables of one story on the word index of its onset table (the spoken
+    words of the forced aligner).
+
+    The feature files rarely have one row per spoken word (Stanza tokens, LM-reconstructed
+    words): each table with a word column is first mapped onto the onset words with
+    `nlp_pipeline.alignment.story_events`; a table that already has a 'word_index' column (e.g.
+    an event table) is merged on it.
+
+    Parameters:
+        onsets (pd.DataFrame): One row per spoken word, with `word_column` and BEGIN/END.
+        features (dict): source name -> (table, word column), e.g.
+            {"surprisal": (surprisal CSV, "word"), "frequency": (processor output, "tokens_no_punct")};
+            word column None for tables keyed by 'word_index'. All other columns are features.
+        story (str): Story name (for messages and the mismatch report).
+        word_column (str): Word column of `onsets`.
+        agg (dict, optional): Aggregation of several source words mapped onto one onset word,
+            per column (see `story_events`).
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]:
+            - Indexed by word index: the onset table and all features (NaN for onset words
+              without a source word).
+            - Mismatch report of the aligned sources (see `nlp_pipeline.alignment.align_words`).
+
+    Raises:
+        ValueError: If two sources have a feature column of the same name, or a keyed table
+            has duplicate or unknown word indices.
+    """
+
+    aligned = {source: t for source, t in features.items() if t[1] is not None}
+    events, report = story_events(onsets, aligned, story, word_column=word_column, agg=agg)
+    for source, (table, _) in features.items():
+        if source in aligned:
+            continue
+        values = table.drop(columns=[c for c in ("story",) if c in table.columns])
+        clashes = [c for c in values.columns if c != "word_index" and c in events.columns]
+        if clashes:
+            raise ValueError(f"story {story!r}: feature columns of {source!r} already joined: {clashes}")
+        if values["word_index"].duplicated().any() or not values["word_index"].isin(events["word_index"]).all():
+            raise ValueError(f"story {story!r}: {source!r} has duplicate or unknown word indices")
+        events = events.merge(values, on="word_index", how="left")
+    return events.drop(columns="story").set_index("word_index"), report
+
+
+class FeatureStore:
+    """
+    Word-level feature table of many stories, keyed by (story, word index).
+
+    Each numeric feature is one flat binary file (`<column>.bin`, float64) holding the words of
+    all stories one after the other, memory-mapped for reading; index.json records the row
+    range of every story. Statistics read the columns in chunks of rows (see `iter_chunks`),
+    so no table of all words is ever built.
+
+    Parameters:
+        root (str): Directory of the store (created if needed).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        index_path = os.path.join(root, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"n_rows": 0, "columns": [], "stories": {}}
+        self._maps = {}
+
+    def save(self):
+        """
+        Writes the index (atomically).
+        """
+
+        path = os.path.join(self.root, INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def _bin_path(self, column: str) -> str:
+        return os.path.join(self.root, f"{column}.bin")
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.index["columns"])
+
+    @property
+    def stories(self) -> List[str]:
+        return list(self.index["stories"])
+
+    def __len__(self) -> int:
+        return self.index["n_rows"]
+
+    def add_story(self, story: str, table: pd.DataFrame):
+        """
+        Appends the words of one story (e.g. the joined table of `join_features`).
+
+        Numeric columns are stored; a column missing from this story is NaN for its words, and a
+        column new to the store is NaN for the stories added before.
+
+        Raises:
+            ValueError: If the story is already stored.
+        """
+
+        if story in self.index["stories"]:
+            raise ValueError(f"story {story!r} is already in the store")
+        table = table.select_dtypes("number")
+        n_rows, n_new = self.index["n_rows"], len(table)
+
+        for column in table.columns:
+            if column not in self.index["columns"]:
+                with open(self._bin_path(column), "wb") as f:
+                    f.write(np.full(n_rows, np.nan).tobytes())
+                self.index["columns"].append(column)
+        for column in self.index["columns"]:
+            values = table[column].to_numpy(dtype=np.float64) if column in table.columns else np.full(n_new, np.nan)
+            with open(self._bin_path(column), "ab") as f:
+                f.write(np.ascontiguousarray(values).tobytes())
+            self._maps.pop(column, None)
+
+        self.index["stories"][story] = [n_rows, n_rows + n_new]
+        self.index["n_rows"] = n_rows + n_new
+        self.save()
+
+    def column(self, column: str) -> np.memmap:
+        """
+        Returns one feature of all words as a read-only memory map.
+        """
+
+        if column not in self._maps:
+            self._maps[column] = np.memmap(self._bin_path(column), dtype=np.float64, mode="r",
+                                           shape=(self.index["n_rows"],))
+        return self._maps[column]
+
+    def frame(self, story: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        The features of one story as a DataFrame (indexed by word index).
+        """
+
+        start, stop = self.index["stories"][story]
+        columns = list(columns or self.columns)
+        df = pd.DataFrame({c: np.asarray(self.column(c)[start:stop]) for c in columns})
+        df.index.name = "word_index"
+        return df
+
+    def _ranges(self, stories: Optional[Sequence[str]] = None) -> List[Tuple[int, int, int]]:
+        #(story code, start, stop) row ranges, in store order for all stories
+        names = self.stories if stories is None else list(stories)
+        return [(k, *self.index["stories"][s]) for k, s in enumerate(names)]
+
+    def iter_chunks(self, columns: Sequence[str], stories: Optional[Sequence[str]] = None,
+                    chunk_rows: int = CHUNK_ROWS) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yields the selected features in chunks of at most `chunk_rows` words.
+
+        Yields:
+            Tuple[np.ndarray, np.ndarray]: story code of every word (position in `stories`, or
+            in the store order) and the (word, column) values.
+        """
+
+        maps = [self.column(c) for c in columns]
+        for code, start, stop in self._ranges(stories):
+            for a in range(start, stop, chunk_rows):
+                b = min(a + chunk_rows, stop)
+                yield np.full(b - a, code), np.column_stack([m[a:b] for m in maps])
+
+
+def _complete(chunks: Iterator[Tuple[np.ndarray, np.ndarray]]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    #drops the words with a missing value in any column (listwise deletion)
+    for codes, X in chunks:
+        keep = ~np.isnan(X).any(1)
+        yield codes[keep], X[keep]
+
+
+def _moments(chunks: Iterator[Tuple[np.ndarray, np.ndarray]]) -> Tuple[float, np.ndarray, np.ndarray]:
+    n, s, ss = 0.0, 0.0, 0.0
+    for _, X in chunks:
+        n += len(X)
+        s = s + X.sum(0)
+        ss = ss + X.T @ X
+    return n, s, ss
+
+
+def _correlation(n, s: np.ndarray, ss: np.ndarray) -> np.ndarray:
+    #correlation matrices from sums (works on stacks of (..., k) / (..., k, k) moments)
+    n = np.asarray(n, dtype=float)[..., None, None]
+    cov = ss - s[..., :, None] * s[..., None, :] / n
+    sd = np.sqrt(np.clip(np.diagonal(cov, axis1=-2, axis2=-1), 1e-300, None))
+    return cov / (sd[..., :, None] * sd[..., None, :])
+
+
+def vif(r: np.ndarray) -> np.ndarray:
+    """
+    Variance inflation factors from a correlation matrix (or a stack of them): diag(R⁻¹).
+    """
+
+    return np.diagonal(np.linalg.inv(r), axis1=-2, axis2=-1)
+
+
+def _rank_chunks(store: FeatureStore, columns: Sequence[str], stories: Optional[Sequence[str]],
+                 chunk_rows: int, tmp_dir: str) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    #ranks (ties averaged) of the complete words, one column at a time, in a temporary memory map
+    from scipy.stats import rankdata
+
+    ranges = store._ranges(stories)
+    complete = [(codes, ~np.isnan(X).any(1)) for codes, X in store.iter_chunks(columns, stories, chunk_rows)]
+    codes = np.concatenate([c[keep] for c, keep in complete] + [np.zeros(0, dtype=int)])
+    keep = np.concatenate([keep for _, keep in complete] + [np.zeros(0, dtype=bool)])
+    ranks = np.memmap(os.path.join(tmp_dir, "ranks.bin"), dtype=np.float64, mode="w+",
+                      shape=(max(len(codes), 1), len(columns)))
+    for j, column in enumerate(columns):
+        values = np.concatenate([np.asarray(store.column(column)[a:b]) for _, a, b in ranges] + [np.zeros(0)])
+        ranks[:len(codes), j] = rankdata(values[keep])
+    for a in range(0, len(codes), chunk_rows):
+        yield codes[a:a + chunk_rows], np.asarray(ranks[a:a + chunk_rows])
+
+
+def correlation_matrix(store: FeatureStore,
+                       columns: Sequence[str],
+                       method: str = "pearson",
+                       stories: Optional[Sequence[str]] = None,
+                       chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Pearson or Spearman correlation matrix of features over all words, streamed in chunks.
+
+    Words with a missing value in any of the columns are left out. Spearman correlations rank
+    each column separately (one column in memory at a time) into a temporary memory map.
+
+    Parameters:
+        store (FeatureStore): Feature store.
+        columns (Sequence[str]): Features.
+        method (str): 'pearson' or 'spearman'.
+        stories (Sequence[str], optional): Stories to include (default: all).
+        chunk_rows (int): Words per chunk.
+
+    Returns:
+        pd.DataFrame: (column x column) correlations.
+    """
+
+    if method not in {"pearson", "spearman"}:
+        raise ValueError("method must be 'pearson' or 'spearman'")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if method == "pearson":
+            chunks = _complete(store.iter_chunks(columns, stories, chunk_rows))
+        else:
+            chunks = _rank_chunks(store, columns, stories, chunk_rows, tmp_dir)
+        r = _correlation(*_moments(chunks))
+    return pd.DataFrame(r, index=list(columns), columns=list(columns))
+
+
+def collinearity(store: FeatureStore,
+                 columns: Sequence[str],
+                 method: str = "pearson",
+                 stories: Optional[Sequence[str]] = None,
+                 n_boot: int = N_BOOT,
+                 ci: float = CI,
+                 unit: str = "word",
+                 seed: int = 0,
+                 chunk_rows: int = CHUNK_ROWS) -> Dict[str, pd.DataFrame]:
+    """
+    Correlation matrix and VIFs of features, with bootstrap confidence intervals, in one
+    streamed pass over the words.
+
+    The bootstrap is a Poisson bootstrap: every replicate weights each word (or each story)
+    with a Poisson(1) count, so all replicates are accumulated together chunk by chunk, as one
+    matrix product of the (replicate x word) weights with the words' sums and cross-products,
+    instead of resampling the table `n_boot` times.
+
+    Parameters:
+        store (FeatureStore): Feature store.
+        columns (Sequence[str]): Features.
+        method (str): 'pearson' or 'spearman' (the ranks are computed once on all words and
+            not re-ranked within replicates).
+        stories (Sequence[str], optional): Stories to include (default: all).
+        n_boot (int): Bootstrap replicates.
+        ci (float): Confidence level of the percentile intervals.
+        unit (str): Resampled unit: 'word', or 'story' (words of a story share their weight, for
+            dependence within stories).
+        seed (int): Seed of the bootstrap weights.
+        chunk_rows (int): Words per chunk (memory ~ n_boot x chunk_rows weights).
+
+    Returns:
+        Dict[str, pd.DataFrame]: 'r', 'r_low', 'r_high' (column x column) and 'vif' (columns
+        'vif', 'low', 'high').
+    """
+
+    if unit not in {"word", "story"}:
+        raise ValueError("unit must be 'word' or 'story'")
+    if method not in {"pearson", "spearman"}:
+        raise ValueError("method must be 'pearson' or 'spearman'")
+    k = len(columns)
+    rng = np.random.default_rng(seed)
+    story_weights = rng.poisson(1.0, size=(n_boot, len(store._ranges(stories)))).astype(float) if unit == "story" else None
+
+    n, s, ss = 0.0, np.zeros(k), np.zeros((k, k))
+    bn, bs, bss = np.zeros(n_boot), np.zeros((n_boot, k)), np.zeros((n_boot, k * k))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if method == "pearson":
+            chunks = _complete(store.iter_chunks(columns, stories, chunk_rows))
+        else:
+            chunks = _rank_chunks(store, columns, stories, chunk_rows, tmp_dir)
+        for codes, X in chunks:
+            n += len(X)
+            s += X.sum(0)
+            ss += X.T @ X
+            W = story_weights[:, codes] if unit == "story" else rng.poisson(1.0, size=(n_boot, len(X))).astype(float)
+            bn += W.sum(1)
+            bs += W @ X
+            bss += W @ (X[:, :, None] * X[:, None, :]).reshape(len(X), k * k)
+
+    alpha = (1 - ci) / 2
+    r = _correlation(n, s, ss)
+    r_boot = _correlation(bn, bs, bss.reshape(n_boot, k, k))
+    vif_boot = vif(r_boot)
+    names = list(columns)
+    return {"r": pd.DataFrame(r, index=names, columns=names),
+            "r_low": pd.DataFrame(np.quantile(r_boot, alpha, axis=0), index=names, columns=names),
+            "r_high": pd.DataFrame(np.quantile(r_boot, 1 - alpha, axis=0), index=names, columns=names),
+            "vif": pd.DataFrame({"vif": vif(r), "low": np.quantile(vif_boot, alpha, axis=0),
+                                 "high": np.quantile(vif_boot, 1 - alpha, axis=0)}, index=names)}
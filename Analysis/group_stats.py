@@ -0,0 +1,318 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple, Union
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+#parameters
+MONTAGE = "GSN-HydroCel-65_1.0"
+N_PERM = 10000
+BATCH_SIZE = 256          # permutations per matrix product (bounds memory per worker)
+TFCE_STEP = 0.1           # threshold step, as eelbrain's tfce=True
+TFCE_E = 0.5              # extent exponent
+TFCE_H = 2.0              # height exponent
+
+
+def montage_edges(montage: Union[str, object] = MONTAGE) -> np.ndarray:
+    """
+    Sensor adjacency of a montage, as used by eelbrain's `testnd` for the same sensors.
+
+    Parameters:
+        montage (str or eelbrain.Sensor): Montage name, or the sensor dimension of the data
+            (e.g. `ndvar.sensor`), whose connectivity is then used as is.
+
+    Returns:
+        np.ndarray: (edge, 2) pairs of sensor indices (i < j), in the channel order of the montage.
+
+    Notes:
+        - For a montage name, the connectivity of eelbrain's `Sensor.from_montage` is used, or
+          without eelbrain, `mne.channels.find_ch_adjacency` on the same MNE montage.
+    """
+
+    sensor = montage
+    if isinstance(montage, str):
+        try:
+            import eelbrain as eel
+            sensor = eel.Sensor.from_montage(montage)
+        except ImportError:
+            sensor = None
+
+    if sensor is not None:
+        pairs = np.asarray(sensor.connectivity(), dtype=np.int64).reshape(-1, 2)
+    else:
+        import mne
+        from scipy.sparse import triu
+
+        info = mne.create_info(mne.channels.make_standard_montage(montage).ch_names, 1.0, "eeg")
+        info.set_montage(montage)
+        adjacency, _ = mne.channels.find_ch_adjacency(info, "eeg")
+        pairs = np.column_stack(triu(adjacency, k=1).nonzero()).astype(np.int64)
+    return np.unique(np.sort(pairs, axis=1), axis=0)
+
+
+def sensor_time_edges(sensor_pairs: np.ndarray, n_sensors: int, n_times: int) -> np.ndarray:
+    """
+    Edges of the (sensor x time) graph: neighbouring sensors at the same time point, and
+    consecutive time points of the same sensor. Node index = sensor * n_times + time.
+    """
+
+    t = np.arange(n_times)
+    spatial = (sensor_pairs[:, None, :] * n_times + t[None, :, None]).reshape(-1, 2)
+    s = np.arange(n_sensors)[:, None] * n_times
+    temporal = np.stack([(s + t[None, :-1]).ravel(), (s + t[None, 1:]).ravel()], axis=1)
+    return np.concatenate([spatial, temporal])
+
+
+def sign_flips(n_subjects: int, n_perm: int = N_PERM, seed: int = 0) -> np.ndarray:
+    """
+    Sign-flip matrix for a one-sample test: all 2^n patterns if there are at most `n_perm`
+    of them, otherwise `n_perm` random patterns. Row 0 is the observed data (no flips).
+
+    Returns:
+        np.ndarray: (permutation, subject) matrix of ±1.
+    """
+
+    if 2 ** n_subjects <= n_perm:
+        codes = np.arange(2 ** n_subjects)
+        flips = 1 - 2 * ((codes[:, None] >> np.arange(n_subjects)) & 1)
+    else:
+        rng = np.random.default_rng(seed)
+        flips = rng.choice([-1, 1], size=(n_perm, n_subjects))
+        flips[0] = 1
+    return flips.astype(float)
+
+
+def t_maps(flips: np.ndarray, data: np.ndarray, sum_sq: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    One-sample t-values of a batch of sign flips with one matrix product.
+
+    Parameters:
+        flips (np.ndarray): (permutation, subject) ±1.
+        data (np.ndarray): (subject, point) data.
+        sum_sq (np.ndarray, optional): Σ x² per point (invariant under sign flips).
+
+    Returns:
+        np.ndarray: (permutation, point) t-values.
+    """
+
+    n = data.shape[0]
+    if sum_sq is None:
+        sum_sq = np.einsum("sv,sv->v", data, data)
+    mean = (flips @ data) / n
+    var = (sum_sq[None] - n * mean ** 2) / (n - 1)
+    return mean / np.sqrt(np.clip(var, 1e-300, None) / n)
+
+
+def _components(mask: np.ndarray, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Connected components of the supra-threshold points of a batch of maps at once.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: flat indices (into mask.ravel()) of the points in the mask,
+        and the component label of each.
+    """
+
+    n_maps, n_points = mask.shape
+    flat = mask.ravel()
+    nodes = np.flatnonzero(flat)
+    position = np.cumsum(flat) - 1  # index of each masked point among the nodes
+    m, e = np.nonzero(mask[:, edges[:, 0]] & mask[:, edges[:, 1]])
+    a = position[m * n_points + edges[e, 0]]
+    b = position[m * n_points + edges[e, 1]]
+    graph = coo_matrix((np.ones(len(a), dtype=np.int8), (a, b)), shape=(len(nodes), len(nodes)))
+    _, labels = connected_components(graph, directed=False)
+    return nodes, labels
+
+
+def _ranked_graph(values: np.ndarray, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Orders the points of a batch of maps by decreasing value, and the edges by decreasing
+    value of their lower end, so that the points and edges above any threshold are prefixes.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: point order (flat indices),
+        sorted point values, sorted edge values, and edge endpoints as ranks in the point order.
+    """
+
+    n_maps, n_points = values.shape
+    flat = values.ravel()
+    order = np.argsort(-flat, kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    offsets = (np.arange(n_maps) * n_points)[:, None]
+    a = (offsets + edges[None, :, 0]).ravel()
+    b = (offsets + edges[None, :, 1]).ravel()
+    edge_values = np.minimum(flat[a], flat[b])
+    edge_order = np.argsort(-edge_values, kind="stable")
+    ends = np.stack([rank[a[edge_order]], rank[b[edge_order]]])
+    return order, flat[order], edge_values[edge_order], ends
+
+
+def tfce(maps: np.ndarray, edges: np.ndarray, step: float = TFCE_STEP,
+         E: float = TFCE_E, H: float = TFCE_H) -> np.ndarray:
+    """
+    Threshold-free cluster enhancement of a batch of maps (positive and negative parts
+    separately, signed result).
+
+    Parameters:
+        maps (np.ndarray): (map, point) statistic maps.
+        edges (np.ndarray): (edge, 2) point adjacency (see `sensor_time_edges`).
+        step (float): Threshold step.
+        E, H (float): Extent and height exponents.
+
+    Returns:
+        np.ndarray: (map, point) TFCE values.
+
+    Notes:
+        - Points and edges are sorted once per batch, so the clusters at each threshold are the
+          connected components of a prefix of the points and edges.
+    """
+
+    out = np.zeros(maps.size)
+    for sign in (1, -1):
+        order, values, edge_values, ends = _ranked_graph(sign * maps, edges)
+        acc = np.zeros(len(order))
+        #the points (edges) at or above h are the first k (m) of the sorted arrays
+        for h in np.arange(step, max(values[0], 0) + step / 2, step):
+            k = int(np.searchsorted(-values, -h, side="right"))
+            m = int(np.searchsorted(-edge_values, -h, side="right"))
+            graph = coo_matrix((np.ones(m, dtype=np.int8), (ends[0, :m], ends[1, :m])), shape=(k, k))
+            _, labels = connected_components(graph, directed=False)
+            acc[:k] += np.bincount(labels)[labels] ** E * h ** H * step
+        out[order] += sign * acc
+    return out.reshape(maps.shape)
+
+
+def cluster_mass(maps: np.ndarray, edges: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Cluster-mass map of a batch of maps: each point gets the summed statistic of its cluster
+    (points beyond ±threshold, positive and negative clusters separately).
+    """
+
+    out = np.zeros(maps.size)
+    flat = maps.ravel()
+    for sign in (1, -1):
+        nodes, labels = _components(sign * maps > threshold, edges)
+        mass = np.bincount(labels, weights=flat[nodes])
+        out[nodes] = mass[labels]
+    return out.reshape(maps.shape)
+
+
+_WORKER = {}
+
+
+def _init_worker(data, sum_sq, blocks, edges, method, options):
+    _WORKER.update(data=data, sum_sq=sum_sq, blocks=blocks, edges=edges, method=method, options=options)
+
+
+def _statistic(t: np.ndarray) -> np.ndarray:
+    #statistic maps of every block (predictor) of a batch of t-maps
+    w = _WORKER
+    if w["method"] == "t":
+        return t
+    out = np.empty_like(t)
+    for start, stop in w["blocks"]:
+        if w["method"] == "tfce":
+            out[:, start:stop] = tfce(t[:, start:stop], w["edges"], **w["options"])
+        else:
+            out[:, start:stop] = cluster_mass(t[:, start:stop], w["edges"], **w["options"])
+    return out
+
+
+def _null_max(flips: np.ndarray) -> np.ndarray:
+    #maximum |statistic| of every block, for a chunk of permutations
+    w = _WORKER
+    stat = _statistic(t_maps(flips, w["data"], w["sum_sq"]))
+    return np.stack([np.abs(stat[:, a:b]).max(1) for a, b in w["blocks"]], axis=1)
+
+
+def group_test(data: Dict[str, np.ndarray],
+               sensor_pairs: np.ndarray,
+               method: str = "tfce",
+               n_perm: int = N_PERM,
+               threshold: Optional[float] = None,
+               batch_size: int = BATCH_SIZE,
+               n_workers: Optional[int] = None,
+               seed: int = 0,
+               tfce_step: float = TFCE_STEP) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    One-sample sign-flip permutation tests (two-tailed, against 0) of several (sensor x time)
+    maps in one shared pass, e.g. the h_scaled of every predictor.
+
+    All predictors are concatenated along the point axis, so every batch of permutations costs
+    one matrix product; TFCE or cluster statistics are then computed per predictor, and each
+    predictor is corrected for multiple comparisons with its own maximum statistic (as one
+    `testnd.TTestOneSample` per predictor would).
+
+    Parameters:
+        data (dict): name -> (subject, sensor, time) data (same subjects, same order).
+        sensor_pairs (np.ndarray): (edge, 2) sensor adjacency (see `montage_edges`).
+        method (str): 'tfce', 'cluster' (cluster mass beyond `threshold`) or 't' (max-t).
+        n_perm (int): Number of permutations (all 2^n sign flips if there are fewer).
+        threshold (float, optional): Cluster-forming t threshold (default: two-tailed p = .05).
+        batch_size (int): Permutations per batch (memory per worker ~ batch_size x points).
+        n_workers (int, optional): Worker processes (default: all CPU cores; 1 = in process).
+        seed (int): Seed of the random sign flips.
+        tfce_step (float): TFCE threshold step.
+
+    Returns:
+        Dict[str, Dict[str, np.ndarray]]: name -> 't' (sensor, time), 'stat' (sensor, time),
+        'p' (sensor, time) corrected p-values and 'null' (permutation,) maximum statistics.
+
+    Notes:
+        - 10000 permutations of 4 predictors x 20 subjects (65 sensors x 80 samples) take about
+          10 s per core with max-t and about 1 min with cluster mass; TFCE (about 15 s per batch of
+          256 permutations) needs several minutes per core, short of the target of seconds.
+    """
+
+    if method not in {"tfce", "cluster", "t"}:
+        raise ValueError("method must be 'tfce', 'cluster' or 't'")
+    names = list(data)
+    shapes = {data[n].shape for n in names}
+    if len(shapes) != 1:
+        raise ValueError(f"all maps must have the same shape: {sorted(shapes)}")
+    n_subjects, n_sensors, n_times = shapes.pop()
+
+    flat = np.concatenate([np.asarray(data[n], dtype=float).reshape(n_subjects, -1) for n in names], axis=1)
+    size = n_sensors * n_times
+    blocks = [(i * size, (i + 1) * size) for i in range(len(names))]
+    edges = sensor_time_edges(np.asarray(sensor_pairs), n_sensors, n_times)
+    sum_sq = np.einsum("sv,sv->v", flat, flat)
+
+    options = {}
+    if method == "tfce":
+        options = {"step": tfce_step}
+    elif method == "cluster":
+        from scipy.stats import t as t_dist
+        options = {"threshold": threshold if threshold is not None else float(t_dist.ppf(0.975, n_subjects - 1))}
+
+    flips = sign_flips(n_subjects, n_perm, seed)
+    chunks = [flips[i:i + batch_size] for i in range(0, len(flips), batch_size)]
+    args = (flat, sum_sq, blocks, edges, method, options)
+
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1 or len(chunks) == 1:
+        _init_worker(*args)
+        null = np.concatenate([_null_max(c) for c in chunks])
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(chunks)), initializer=_init_worker,
+                                 initargs=args) as pool:
+            null = np.concatenate(list(pool.map(_null_max, chunks)))
+
+    _init_worker(*args)
+    t_obs = t_maps(flips[:1], flat, sum_sq)
+    stat_obs = _statistic(t_obs)[0]
+
+    results = {}
+    for k, (name, (a, b)) in enumerate(zip(names, blocks)):
+        stat = stat_obs[a:b]
+        #fraction of the null (observed included, row 0) at or above |stat|
+        ranked = np.sort(null[:, k])
+        p = 1 - np.searchsorted(ranked, np.abs(stat) - 1e-12, side="left") / len(ranked)
+        results[name] = {"t": t_obs[0, a:b].reshape(n_sensors, n_times),
+                         "stat": stat.reshape(n_sensors, n_times),
+                         "p": p.reshape(n_sensors, n_times),
+                         "null": null[:, k]}
+    return results
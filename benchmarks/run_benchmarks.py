@@ -0,0 +1,402 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "predictors"), os.path.join(ROOT, "mTRF"), os.path.dirname(os.path.abspath(__file__))):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("HF_HUB_OFFLINE", "1")         # everything is generated locally
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import synthetic
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+SCALES = {
+    "small": dict(n_stories=3, words_per_story=600, n_subjects=2, trials_per_story=3, trial_sec=20, n_channels=65),
+    "thesis": dict(n_stories=5, words_per_story=700, n_subjects=6, trials_per_story=3, trial_sec=60, n_channels=65),
+    "large": dict(n_stories=10, words_per_story=2000, n_subjects=20, trials_per_story=3, trial_sec=60, n_channels=65),
+}
+REPEATS = 3                  # timed runs per stage (after one untimed warm-up run)
+THREADS = 1                  # BLAS / OpenMP / torch threads of every stage, for comparable timings
+SEED = 0
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.jsonl")
+BASELINE_RUNS = 5            # previous runs (same scale, machine and settings) forming the baseline
+THRESHOLDS = {"seconds": 0.20, "peak_mb": 0.10}   # relative increase over the baseline median that fails
+STAGE_THRESHOLDS = {"feature_extraction": {"seconds": 0.30}}
+MIN_SECONDS = 0.02           # time differences below this are noise, never regressions
+
+
+def make_dataset(work_dir: str, scale: Dict, seed: int = SEED) -> Dict:
+    """
+    Generates the synthetic study in `work_dir`: story texts, word-event tables, tiny local
+    models, story orders of the subjects, and one EEG .mat per subject whose responses are
+    driven by the rendered predictors.
+
+    Returns:
+        Dict: Paths and settings shared by the stages.
+    """
+
+    from rendering import render_predictors
+
+    texts = synthetic.story_texts(scale["n_stories"], scale["words_per_story"], os.path.join(work_dir, "texts"), seed)
+    events = []
+    for k, (story, path) in enumerate(texts.items()):
+        with open(path, "r", encoding="utf-8") as f:
+            events.append(synthetic.word_events(f.read().split(), story, seed + k))
+    events = pd.concat(events, ignore_index=True)
+    events_path = os.path.join(work_dir, "events.pkl")
+    events.to_pickle(events_path)
+
+    corpus = []
+    for path in texts.values():
+        with open(path, "r", encoding="utf-8") as f:
+            corpus.append(f.read())
+    lm_dir, encoder_dir = synthetic.tiny_models(os.path.join(work_dir, "models"), corpus, seed)
+
+    trial_len = scale["trial_sec"] * synthetic.FS
+    n_trials = scale["n_stories"] * scale["trials_per_story"]
+    durations = {s: synthetic.story_duration(e) for s, e in events.groupby("story")}
+    short = {s: d for s, d in durations.items() if d * synthetic.FS < scale["trials_per_story"] * trial_len}
+    if short:
+        raise ValueError(f"stories shorter than {scale['trials_per_story']} trials: {short}; use more words per story")
+    rendered = render_predictors(events, synthetic.FEATURES, durations, story_column="story")
+    orders = synthetic.subject_orders(list(texts), scale["n_subjects"], seed)
+
+    mat_paths = {}
+    os.makedirs(os.path.join(work_dir, "eeg"), exist_ok=True)
+    for k, (subject, stories) in enumerate(orders.items()):
+        x = np.concatenate([rendered[s][:, :scale["trials_per_story"] * trial_len] for s in stories], axis=1)
+        x = np.nan_to_num(x).reshape(len(synthetic.FEATURES), n_trials, trial_len)
+        eeg = synthetic.synthetic_eeg(x, scale["n_channels"], seed=seed + k)
+        mat_paths[subject] = synthetic.write_eeg_mat(os.path.join(work_dir, "eeg", f"{subject}.mat"), eeg)
+
+    return {"work_dir": work_dir, "texts": texts, "events": events_path, "lm": lm_dir, "encoder": encoder_dir,
+            "durations": durations, "orders": orders, "mat_paths": mat_paths, "trial_len": trial_len,
+            "n_trials": n_trials, "trials_per_story": scale["trials_per_story"]}
+
+
+def _scratch(data: Dict) -> str:
+    #fresh output directory for one run of a stage
+    return tempfile.mkdtemp(dir=data["work_dir"])
+
+
+def _feature_extraction(data: Dict) -> Callable[[], object]:
+    from nlp_pipeline.semantic_dissimilarity import calculate_semantic_dissimilarity
+    from nlp_pipeline.surprisal import calculate_surprisal_entropy
+
+    def run():
+        out_dir = _scratch(data)
+        for path in data["texts"].values():
+            calculate_surprisal_entropy(path, out_dir, model_name=data["lm"])
+            calculate_semantic_dissimilarity(path, out_dir, model_name=data["encoder"])
+    return run
+
+
+def _word_reconstruction(data: Dict) -> Callable[[], object]:
+    from nlp_pipeline.models import get_tokenizer
+    from nlp_pipeline.surprisal import STAT_AGGREGATION
+    from nlp_pipeline.utils import reconstruct_words
+
+    tokenizer = get_tokenizer(data["lm"])
+    tokens = []
+    for path in data["texts"].values():
+        with open(path, "r", encoding="utf-8") as f:
+            tokens += tokenizer.tokenize(f.read())
+    rng = np.random.default_rng(SEED)
+    values = {name: rng.gamma(2.0, 2.0, len(tokens)).tolist() for name in STAT_AGGREGATION}
+    return lambda: reconstruct_words(tokens, values, tokenizer, agg=STAT_AGGREGATION)
+
+
+def _rendered(data: Dict) -> Dict[str, np.ndarray]:
+    from rendering import render_predictors
+
+    events = pd.read_pickle(data["events"])
+    return render_predictors(events, synthetic.FEATURES, data["durations"], story_column="story")
+
+
+def _build_store(data: Dict, rendered: Dict[str, np.ndarray]):
+    from trial_store import TrialStore
+
+    store = TrialStore(_scratch(data), synthetic.FS, data["trial_len"])
+    for story, matrix in rendered.items():
+        for feature, predictor in zip(synthetic.FEATURES, matrix):
+            store.add_story(feature, story, np.nan_to_num(predictor))
+    for subject, stories in data["orders"].items():
+        store.add_subject(subject, stories, data["n_trials"], data["trials_per_story"])
+    store.save()
+    return store
+
+
+def _predictor_rendering(data: Dict) -> Callable[[], object]:
+    return lambda: _rendered(data)
+
+
+def _trial_assembly(data: Dict) -> Callable[[], object]:
+    rendered = _rendered(data)
+
+    def run():
+        store = _build_store(data, rendered)
+        return sum(float(np.asarray(store.trials(s, f)).sum()) for s in data["orders"] for f in synthetic.FEATURES)
+    return run
+
+
+def _eeg_loading(data: Dict) -> Callable[[], object]:
+    from eeg_io import load_eeg
+
+    def run():
+        cache_dir = _scratch(data)
+        return sum(float(load_eeg(path, cache_dir)[0].sum()) for path in data["mat_paths"].values())
+    return run
+
+
+def _trf_fitting(data: Dict) -> Callable[[], object]:
+    from eeg_io import load_eeg
+    from ridge import fit_subject
+
+    store = _build_store(data, _rendered(data))
+    cache_dir = _scratch(data)
+    eeg = {s: load_eeg(path, cache_dir)[0] for s, path in data["mat_paths"].items()}
+    predictors = {s: {f: store.trials(s, f) for f in synthetic.FEATURES} for s in data["orders"]}
+    return lambda: [fit_subject(eeg[s], predictors[s]) for s in data["orders"]]
+
+
+STAGES = {
+    "feature_extraction": _feature_extraction,      # surprisal + dissimilarity with tiny local models
+    "word_reconstruction": _word_reconstruction,    # `reconstruct_words` over every story
+    "predictor_rendering": _predictor_rendering,    # `render_predictors`, all stories and features
+    "trial_assembly": _trial_assembly,              # `TrialStore` build + every subject's trials
+    "eeg_loading": _eeg_loading,                    # .mat -> memory-mapped cache, read once
+    "trf_fitting": _trf_fitting,                    # ridge full + reduced models, every subject
+}
+
+
+def _peak_rss_mb() -> float:
+    #peak resident memory of this process (VmHWM restarts at exec, unlike ru_maxrss)
+    try:
+        with open("/proc/self/status", "r") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+    except (OSError, StopIteration):
+        if resource is None:
+            return float("nan")
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_stage(name: str, data: Dict, repeats: int) -> Dict:
+    #runs in a fresh process, so that the peak RSS belongs to this stage only
+    logging.getLogger().setLevel(logging.WARNING)  # per-file messages of the pipeline
+    run = STAGES[name](data)
+    run()  # warm-up: model loading, first-call allocations
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": float(np.median(seconds)), "min_seconds": float(np.min(seconds)),
+            "peak_mb": peak / 2 ** 20, "rss_mb": _peak_rss_mb()}
+
+
+def _limit_threads(n_threads: int):
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(n_threads)
+
+
+def _machine() -> Dict:
+    return {"platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def _versions() -> Dict:
+    import torch
+    import transformers
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "torch": torch.__version__, "transformers": transformers.__version__}
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scale: str = "small",
+                   overrides: Optional[Dict] = None,
+                   stages: Optional[Sequence[str]] = None,
+                   repeats: int = REPEATS,
+                   threads: int = THREADS,
+                   seed: int = SEED,
+                   work_dir: Optional[str] = None) -> Dict:
+    """
+    Times and memory-profiles every pipeline stage on synthetic data, fully offline.
+
+    Every stage runs in its own process: one untimed warm-up run, `repeats` timed runs, and
+    one run under `tracemalloc`.
+
+    Parameters:
+        scale (str): Key of `SCALES`.
+        overrides (dict, optional): Settings replacing those of the scale (e.g. {'words_per_story': 2000}).
+        stages (Sequence[str], optional): Stages to run (default: all of `STAGES`).
+        repeats (int): Timed runs per stage.
+        threads (int): Threads of every stage.
+        seed (int): Seed of the synthetic data.
+        work_dir (str, optional): Directory of the synthetic data (default: a temporary
+            directory, removed afterwards).
+
+    Returns:
+        Dict: The history record: 'time', 'commit', 'machine', 'versions', 'scale', 'config',
+        'repeats', 'threads' and 'stages' (stage -> 'seconds' (median), 'min_seconds',
+        'peak_mb' (Python and NumPy allocations; torch tensors are not traced) and 'rss_mb'
+        (peak resident memory of the stage process)).
+    """
+
+    config = {**SCALES[scale], **(overrides or {})}
+    stages = list(stages or STAGES)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"unknown stages: {sorted(unknown)}")
+    _limit_threads(threads)
+
+    owned = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="pipeline_bench_")
+    try:
+        started = time.perf_counter()
+        data = make_dataset(work_dir, config, seed)
+        logging.info(f"Synthetic data ({scale}: {config}) generated in {time.perf_counter() - started:.1f}s")
+
+        results = {}
+        context = multiprocessing.get_context("spawn")
+        for name in stages:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[name] = pool.submit(_run_stage, name, data, repeats).result()
+            logging.info(f"{name}: {results[name]['seconds']:.3f}s (min {results[name]['min_seconds']:.3f}s), "
+                         f"peak {results[name]['peak_mb']:.1f} MB, RSS {results[name]['rss_mb']:.0f} MB")
+    finally:
+        if owned:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _commit(), "machine": _machine(),
+            "versions": _versions(), "scale": scale, "config": config, "repeats": repeats, "threads": threads,
+            "stages": results}
+
+
+def load_history(path: str = HISTORY_FILE) -> List[Dict]:
+    """
+    Previous records of the history file (one JSON record per line).
+    """
+
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(record: Dict, path: str = HISTORY_FILE):
+    """
+    Appends a record to the history file.
+    """
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def check_regressions(record: Dict,
+                      history: Sequence[Dict],
+                      thresholds: Optional[Dict] = None,
+                      baseline_runs: int = BASELINE_RUNS) -> pd.DataFrame:
+    """
+    Compares a record with the median of the last `baseline_runs` comparable records (same
+    config, machine, repeats and threads).
+
+    Parameters:
+        thresholds (dict, optional): metric -> maximum relative increase (default `THRESHOLDS`,
+            with the per-stage values of `STAGE_THRESHOLDS`).
+
+    Returns:
+        pd.DataFrame: One row per stage and metric: 'stage', 'metric', 'value', 'baseline',
+        'change' (relative), 'threshold', 'regression'. Empty without comparable records.
+    """
+
+    thresholds = {**THRESHOLDS, **(thresholds or {})}
+    same = [r for r in history if r["config"] == record["config"] and r["machine"] == record["machine"]
+            and r["repeats"] == record["repeats"] and r["threads"] == record["threads"]][-baseline_runs:]
+    rows = []
+    for stage, values in record["stages"].items():
+        previous = [r["stages"][stage] for r in same if stage in r["stages"]]
+        if not previous:
+            continue
+        for metric, default in thresholds.items():
+            baseline = float(np.median([p[metric] for p in previous]))
+            threshold = STAGE_THRESHOLDS.get(stage, {}).get(metric, default)
+            change = values[metric] / baseline - 1 if baseline > 0 else 0.0
+            regression = change > threshold and not (metric == "seconds" and values[metric] - baseline < MIN_SECONDS)
+            rows.append({"stage": stage, "metric": metric, "value": values[metric], "baseline": baseline,
+                         "change": change, "threshold": threshold, "regression": regression})
+    return pd.DataFrame(rows, columns=["stage", "metric", "value", "baseline", "change", "threshold", "regression"])
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the pipeline stages on synthetic data.")
+    parser.add_argument("--scale", default="small", choices=sorted(SCALES))
+    parser.add_argument("--set", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="override settings of the scale, e.g. words_per_story=2000 n_channels=128")
+    parser.add_argument("--stages", nargs="*", choices=list(STAGES), help="stages to run (default: all)")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--threads", type=int, default=THREADS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--history", default=HISTORY_FILE, help="JSON-lines history file")
+    parser.add_argument("--no-save", action="store_true", help="do not append this run to the history")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on a regression")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for item in args.set:
+        key, value = item.split("=", 1)
+        if key not in SCALES[args.scale]:
+            parser.error(f"unknown setting {key!r}")
+        overrides[key] = int(value)
+
+    record = run_benchmarks(args.scale, overrides, args.stages, args.repeats, args.threads, args.seed)
+    report = check_regressions(record, load_history(args.history))
+    if len(report):
+        logging.info(f"Against the last {BASELINE_RUNS} comparable runs:\n{report.to_string(index=False)}")
+    else:
+        logging.info("No comparable runs in the history yet: this run is the baseline")
+    if not args.no_save:
+        append_history(record, args.history)
+        logging.info(f"Saved run: {args.history}")
+
+    regressions = report[report["regression"]] if len(report) else report
+    for row in regressions.itertuples():
+        logging.warning(f"Regression: {row.stage} {row.metric} {row.value:.3f} vs {row.baseline:.3f} "
+                        f"(+{row.change:.0%}, threshold {row.threshold:.0%})")
+    return 1 if args.check and len(regressions) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
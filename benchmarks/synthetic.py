@@ -0,0 +1,206 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Sequence, Tuple
+
+#parameters
+FS = 100                     # Hz, predictors and EEG
+AUDIO_FS = 44100             # Hz, word onsets (as in the forced-aligner tables)
+N_CHANNELS = 65              # GSN-HydroCel-65
+MAT_VARIABLE = "CutEEG_Zsc"  # as in mTRF/eeg_io.py
+FEATURES = ["surprisal", "entropy", "frequency", "semantic_dissimilarity"]
+
+ONSETS = ["", "b", "c", "d", "f", "g", "l", "m", "n", "p", "r", "s", "t", "v", "ch", "gl", "gn", "pr", "st", "tr"]
+VOWELS = ["a", "e", "i", "o", "u"]
+FUNCTION_WORDS = ["il", "la", "di", "che", "e", "un", "una", "per", "non", "si", "con", "del", "della", "le", "lo"]
+ELIDED = ["l'", "dell'", "un'", "all'", "c'", "d'"]   # attached to the next word, as in "l'uomo"
+PUNCTUATION = [",", ".", "!", "?", ";", ":"]
+DIALOGUE = ("«", "»")
+
+
+def italian_lexicon(n_types: int = 5000, seed: int = 0) -> List[str]:
+    """
+    Italian-like word types: 1-4 consonant-vowel syllables, ending in a vowel (with a few
+    accented finals), in Zipf rank order behind the function words.
+    """
+
+    rng = np.random.default_rng(seed)
+    words = dict.fromkeys(FUNCTION_WORDS)
+    while len(words) < n_types:
+        n_syllables = rng.choice([1, 2, 3, 4], p=[0.1, 0.4, 0.35, 0.15])
+        word = "".join(ONSETS[rng.integers(len(ONSETS))] + VOWELS[rng.integers(len(VOWELS))]
+                       for _ in range(n_syllables))
+        if rng.random() < 0.03:
+            word = word[:-1] + {"a": "à", "e": "è", "i": "ì", "o": "ò", "u": "ù"}[word[-1]]
+        words.setdefault(word)
+    return list(words)
+
+
+def italian_text(n_words: int, seed: int = 0, lexicon: Sequence[str] = ()) -> str:
+    """
+    Italian-like text of `n_words` words: Zipf-distributed word types, elisions ("l'uomo"),
+    sentence punctuation, capitalized sentence starts and occasional dialogue in «».
+    """
+
+    rng = np.random.default_rng(seed)
+    lexicon = list(lexicon) or italian_lexicon(seed=seed)
+    ranks = np.arange(1, len(lexicon) + 1)
+    p = 1.0 / ranks
+    draws = rng.choice(len(lexicon), size=n_words, p=p / p.sum())
+
+    out, capitalize, quoted = [], True, False
+    for i, k in enumerate(draws):
+        word = lexicon[k]
+        if rng.random() < 0.04 and word[0] in "aeiouàèìòù":
+            word = ELIDED[rng.integers(len(ELIDED))] + word
+        if capitalize:
+            word = word[0].upper() + word[1:]
+            capitalize = False
+        if rng.random() < 0.01:
+            word = word + DIALOGUE[1] if quoted else DIALOGUE[0] + word
+            quoted = not quoted
+        r = rng.random()
+        if r < 0.07 or i == n_words - 1:
+            word += PUNCTUATION[rng.integers(1, len(PUNCTUATION))]
+            capitalize = True
+        elif r < 0.15:
+            word += ","
+        out.append(word)
+    return " ".join(out)
+
+
+def story_texts(n_stories: int, words_per_story: int, out_dir: str, seed: int = 0) -> Dict[str, str]:
+    """
+    Writes one synthetic story per .txt file ('01_01.txt', ...), sharing one lexicon.
+
+    Returns:
+        Dict[str, str]: story -> path.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    lexicon = italian_lexicon(seed=seed)
+    paths = {}
+    for s in range(n_stories):
+        story = f"{s + 1:02d}_01"
+        paths[story] = os.path.join(out_dir, f"{story}.txt")
+        with open(paths[story], "w", encoding="utf-8") as f:
+            f.write(italian_text(words_per_story, seed + s + 1, lexicon))
+    return paths
+
+
+def word_events(words: Sequence[str], story: str = "", seed: int = 0,
+                audio_fs: float = AUDIO_FS) -> pd.DataFrame:
+    """
+    Word-event table of one story, in the format of `nlp_pipeline.alignment.story_events`:
+    'story', 'word_index', 'word', BEGIN/END in audio samples (~3 words/s with pauses) and
+    one column per feature of `FEATURES` (a few NaN, as for words missing from the lexicon).
+    """
+
+    rng = np.random.default_rng(seed)
+    n = len(words)
+    durations = rng.gamma(4.0, 0.06, n) + 0.05           # s
+    pauses = rng.exponential(0.08, n) * (rng.random(n) < 0.6)
+    begin = np.concatenate([[0.5], 0.5 + np.cumsum(durations + pauses)[:-1]])
+    events = pd.DataFrame({"story": story, "word_index": np.arange(n), "word": list(words),
+                           "BEGIN": np.round(begin * audio_fs).astype(np.int64),
+                           "END": np.round((begin + durations) * audio_fs).astype(np.int64)})
+    events["surprisal"] = rng.gamma(2.0, 4.0, n)
+    events["entropy"] = rng.gamma(6.0, 1.0, n)
+    events["frequency"] = np.where(rng.random(n) < 0.05, np.nan, rng.normal(3.5, 1.0, n))
+    events["semantic_dissimilarity"] = rng.beta(2.0, 5.0, n)
+    return events
+
+
+def story_duration(events: pd.DataFrame, audio_fs: float = AUDIO_FS) -> float:
+    """
+    Duration of a story in seconds: one second after the end of its last word.
+    """
+
+    return float(events["END"].max()) / audio_fs + 1.0
+
+
+def subject_orders(stories: Sequence[str], n_subjects: int, seed: int = 0) -> Dict[str, List[str]]:
+    """
+    Story order of every subject (a random permutation each, as in the experiment).
+    """
+
+    rng = np.random.default_rng(seed)
+    return {f"S{k + 1:02d}": [stories[i] for i in rng.permutation(len(stories))] for k in range(n_subjects)}
+
+
+def synthetic_eeg(predictors: np.ndarray, n_channels: int = N_CHANNELS, fs: float = FS,
+                  snr: float = 0.1, seed: int = 0) -> np.ndarray:
+    """
+    (trial, channel, time) EEG: each predictor convolved with an N400-like TRF (negative
+    peak at 400 ms), projected on random channel topographies, plus unit-variance noise.
+
+    Parameters:
+        predictors (np.ndarray): (predictor, trial, time) predictors.
+        snr (float): Standard deviation of the response relative to the noise.
+    """
+
+    rng = np.random.default_rng(seed)
+    n_predictors, n_trials, n_times = predictors.shape
+    t = np.arange(int(0.6 * fs)) / fs
+    trf = -np.exp(-0.5 * ((t - 0.4) / 0.08) ** 2)
+    eeg = rng.standard_normal((n_trials, n_channels, n_times))
+    for k in range(n_predictors):
+        x = predictors[k] / (predictors[k].std() or 1.0)
+        response = np.apply_along_axis(lambda row: np.convolve(row, trf)[:n_times], 1, x)
+        topography = rng.standard_normal(n_channels) * snr / (response.std() or 1.0)
+        eeg += topography[None, :, None] * response[:, None, :]
+    return eeg
+
+
+def write_eeg_mat(path: str, eeg: np.ndarray, variable: str = MAT_VARIABLE) -> str:
+    """
+    Writes (trial, channel, time) EEG as the .mat of one subject: a (1, n_trials) cell array of
+    (time, channel) trials (see `mTRF/eeg_io.convert_mat`).
+    """
+
+    from scipy.io import savemat
+
+    cells = np.empty((1, len(eeg)), dtype=object)
+    for i, trial in enumerate(eeg):
+        cells[0, i] = np.ascontiguousarray(trial.T)
+    savemat(path, {variable: cells})
+    return path
+
+
+def tiny_models(out_dir: str, texts: Sequence[str], seed: int = 0) -> Tuple[str, str]:
+    """
+    Tiny local stand-ins of the feature extractors, trained and saved offline: a byte-level BPE
+    GPT-2 ('Ġ' markers, like GroNLP/gpt2-small-italian) and a SentencePiece RoBERTa ('▁'
+    markers, like UmBERTo), with random weights. Their outputs are meaningless, but the code
+    path (tokenization, windows, chunking, word reconstruction) is that of the real models.
+
+    Returns:
+        Tuple[str, str]: Directories of the causal and of the encoder model (usable as
+        `model_name` by `nlp_pipeline.models`).
+    """
+
+    import torch
+    from tokenizers import ByteLevelBPETokenizer, SentencePieceBPETokenizer
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast, RobertaConfig, RobertaModel
+
+    torch.manual_seed(seed)
+    lm_dir, encoder_dir = os.path.join(out_dir, "tiny-gpt2"), os.path.join(out_dir, "tiny-roberta")
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(texts, vocab_size=1000, min_frequency=2, special_tokens=["<|endoftext|>"])
+    lm_tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, eos_token="<|endoftext|>")
+    lm = GPT2LMHeadModel(GPT2Config(vocab_size=len(lm_tokenizer), n_positions=1024, n_embd=64, n_layer=2,
+                                    n_head=2, bos_token_id=0, eos_token_id=0))
+    lm.save_pretrained(lm_dir)
+    lm_tokenizer.save_pretrained(lm_dir)
+
+    sentencepiece = SentencePieceBPETokenizer()
+    sentencepiece.train_from_iterator(texts, vocab_size=1000, min_frequency=2, special_tokens=["<s>", "<pad>", "</s>"])
+    encoder_tokenizer = PreTrainedTokenizerFast(tokenizer_object=sentencepiece._tokenizer, bos_token="<s>",
+                                                eos_token="</s>", pad_token="<pad>")
+    encoder = RobertaModel(RobertaConfig(vocab_size=len(encoder_tokenizer), hidden_size=64, num_hidden_layers=4,
+                                         num_attention_heads=2, intermediate_size=128, max_position_embeddings=514,
+                                         pad_token_id=1, bos_token_id=0, eos_token_id=2), add_pooling_layer=False)
+    encoder.save_pretrained(encoder_dir)
+    encoder_tokenizer.save_pretrained(encoder_dir)
+    return lm_dir, encoder_dir
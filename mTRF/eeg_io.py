@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from typing import Dict, Optional, Sequence, Tuple
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+FS = 100                             # Hz
+MONTAGE = "GSN-HydroCel-65_1.0"
+MAT_VARIABLE = "CutEEG_Zsc"          # (1, n_trials) cell array of (time, channels) trials
+EEG_CACHE = os.environ.get("MTRF_EEG_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mtrf_eeg"))
+
+DATA_FILE = "eeg.npy"
+META_FILE = "meta.json"
+
+
+def _cache_dir(mat_path: str, cache_dir: str, dtype: str) -> str:
+    #readable name, plus a hash of the absolute path: equal file names in different folders do not collide
+    path = os.path.abspath(mat_path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha256(path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{name}_{digest}_{np.dtype(dtype).name}")
+
+
+def convert_mat(mat_path: str,
+                out_dir: str,
+                variable: str = MAT_VARIABLE,
+                fs: float = FS,
+                montage: str = MONTAGE,
+                channel_names: Optional[Sequence[str]] = None,
+                dtype: str = "float64") -> str:
+    """
+    Converts the EEG trials of one subject's .mat file into a contiguous
+    (trials, channels, time) .npy array, with its metadata in meta.json.
+
+    Each trial is transposed and written straight into the memory-mapped output, so the data
+    is never duplicated in RAM beyond what `loadmat` itself holds.
+
+    Parameters:
+        mat_path (str): Path to the .mat file.
+        out_dir (str): Output directory.
+        variable (str): Name of the cell array of (time, channels) trials.
+        fs (float): Sampling rate (Hz).
+        montage (str): Sensor montage (as understood by `eelbrain.Sensor.from_montage`).
+        channel_names (Sequence[str], optional): Channel names. Defaults to the names of the
+            montage when eelbrain is available.
+        dtype (str): 'float64' (default) or 'float32' (half the size).
+
+    Returns:
+        str: `out_dir`.
+    """
+
+    from scipy.io import loadmat
+
+    logging.info(f"Converting EEG: {mat_path}")
+    cells = loadmat(mat_path)[variable]
+    trials = [cells.flat[i] for i in range(cells.size)]
+    shapes = {t.shape for t in trials}
+    if len(shapes) != 1:
+        raise ValueError(f"trials of {mat_path} have different shapes: {sorted(shapes)}")
+    n_times, n_channels = shapes.pop()
+
+    if channel_names is None:
+        try:
+            import eelbrain as eel
+            channel_names = list(eel.Sensor.from_montage(montage).names)
+        except ImportError:
+            channel_names = None
+    if channel_names is not None and len(channel_names) != n_channels:
+        raise ValueError(f"{len(channel_names)} channel names for {n_channels} channels")
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, DATA_FILE + ".tmp")
+    data = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(len(trials), n_channels, n_times))
+    for i, trial in enumerate(trials):
+        data[i] = trial.T
+    data.flush()
+    del data
+    os.replace(tmp_path, os.path.join(out_dir, DATA_FILE))
+
+    meta = {"source": os.path.abspath(mat_path), "source_mtime": os.path.getmtime(mat_path),
+            "variable": variable, "fs": fs, "montage": montage, "channel_names": channel_names,
+            "dtype": np.dtype(dtype).name, "shape": [len(trials), n_channels, n_times]}
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    logging.info(f"Saved EEG: {out_dir} ({len(trials)} trials, {n_channels} channels, {n_times} samples)")
+    return out_dir
+
+
+def load_eeg(mat_path: str,
+             cache_dir: str = EEG_CACHE,
+             dtype: str = "float64",
+             **kwargs) -> Tuple[np.ndarray, Dict]:
+    """
+    Returns the (trials, channels, time) EEG of a subject as a memory map, converting the
+    .mat file first if it has not been converted yet (or changed since).
+
+    Parameters:
+        mat_path (str): Path to the .mat file.
+        cache_dir (str): Directory of converted subjects (default $MTRF_EEG_CACHE or ~/.cache/mtrf_eeg).
+        dtype (str): 'float64' or 'float32'.
+        **kwargs: Passed to `convert_mat` (variable, fs, montage, channel_names).
+
+    Returns:
+        Tuple[np.ndarray, Dict]:
+            - Copy-on-write memory map: pages are read from disk on use, and writes never
+              reach the file.
+            - Metadata (fs, montage, channel_names, ...).
+    """
+
+    out_dir = _cache_dir(mat_path, cache_dir, dtype)
+    meta_path = os.path.join(out_dir, META_FILE)
+    stale = not os.path.exists(meta_path)
+    if not stale and os.path.exists(mat_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        stale = (cached["source"] != os.path.abspath(mat_path)
+                 or cached["source_mtime"] < os.path.getmtime(mat_path))
+    if stale:
+        convert_mat(mat_path, out_dir, dtype=dtype, **kwargs)
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return np.load(os.path.join(out_dir, DATA_FILE), mmap_mode="c"), meta
+
+
+def eeg_ndvar(data: np.ndarray, meta: Dict, name: str = "EEG"):
+    """
+    Wraps (trials, channels, time) EEG in an eelbrain NDVar (Case, Sensor, UTS) without copying.
+    """
+
+    import eelbrain as eel
+
+    n_trials, _, n_times = data.shape
+    sensor = eel.Sensor.from_montage(meta["montage"])
+    time = eel.UTS(0.0, 1 / meta["fs"], n_times)
+    return eel.NDVar(data, dims=(eel.Case(n_trials), sensor, time), name=name)
+
+
+def predictor_ndvar(trials: np.ndarray, fs: float = FS, name: Optional[str] = None):
+    """
+    Wraps (trials, time) predictor data in an eelbrain NDVar (Case, UTS).
+
+    The array is used as is (no copy), e.g. a `TrialStore` view.
+    """
+
+    import eelbrain as eel
+
+    n_trials, n_times = trials.shape
+    return eel.NDVar(trials, dims=(eel.Case(n_trials), eel.UTS(0.0, 1 / fs, n_times)), name=name)
+
+
+def load_subject(mat_path: str, cache_dir: str = EEG_CACHE, dtype: str = "float64", **kwargs):
+    """
+    Returns the EEG NDVar of one subject (see `load_eeg`).
+    """
+
+    data, meta = load_eeg(mat_path, cache_dir, dtype, **kwargs)
+    return eeg_ndvar(data, meta)
@@ -0,0 +1,253 @@
+import os
+import logging
+import numpy as np
+from typing import Dict, Optional, Sequence, Union
+from eeg_io import EEG_CACHE, load_eeg
+from runner import PREDICTORS, PREDICTOR_STORE, SUBJECTS, _load_trials, model_spec
+from ridge import FS, LAMBDAS, N_FOLDS, TSTART, TSTOP, cross_validate, fit_models, fold_ids, lagged_design, lags, \
+    nested_cross_validate, trial_stats
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+N_NULL = 200          # null predictors per subject and predictor
+MIN_SHIFT = 1.0       # s, shifts closer than this to 0 (or to the trial length) are not drawn
+BATCH_SIZE = 16       # null predictors whose statistics are held in memory at once
+NULLS_FILE = "nulls.npz"
+
+
+def circular_shifts(x: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+    """
+    Circularly shifts every trial of a predictor in the frequency domain.
+
+    The trials are transformed once; each shift is a phase ramp applied to the spectrum, so
+    any number of shifted copies costs one inverse FFT each.
+
+    Parameters:
+        x (np.ndarray): (trial, time) predictor.
+        shifts (np.ndarray): (null, trial) shifts in samples.
+
+    Returns:
+        np.ndarray: (null, trial, time) shifted predictors (x[t - shift], wrapping around).
+    """
+
+    n_times = x.shape[-1]
+    spectrum = np.fft.rfft(x, axis=-1)
+    freqs = np.arange(spectrum.shape[-1])
+    ramps = np.exp(-2j * np.pi * shifts[:, :, None] * freqs[None, None, :] / n_times)
+    return np.fft.irfft(spectrum[None] * ramps, n=n_times, axis=-1)
+
+
+def random_shifts(n_null: int, n_trials: int, n_times: int, min_shift: int, seed: int = 0) -> np.ndarray:
+    """
+    Random shifts in [min_shift, n_times - min_shift], drawn independently for every trial.
+
+    Returns:
+        np.ndarray: (null, trial) shifts in samples.
+    """
+
+    if n_times - 2 * min_shift < 1:
+        raise ValueError(f"trials of {n_times} samples are too short for a minimum shift of {min_shift} samples")
+    rng = np.random.default_rng(seed)
+    return rng.integers(min_shift, n_times - min_shift + 1, size=(n_null, n_trials))
+
+
+def shuffled_values(x: np.ndarray, n_null: int, seed: int = 0) -> np.ndarray:
+    """
+    Shuffles the non-zero values of an impulse predictor across words (of all trials), keeping
+    the word onsets in place: the timing is preserved, the feature values are not.
+
+    Returns:
+        np.ndarray: (null, trial, time) shuffled predictors.
+    """
+
+    rng = np.random.default_rng(seed)
+    positions = np.flatnonzero(x)
+    values = x.ravel()[positions]
+    out = np.zeros((n_null, x.size))
+    for i in range(n_null):
+        out[i, positions] = rng.permutation(values)
+    return out.reshape((n_null,) + x.shape)
+
+
+def _null_stats(stats: Dict[str, np.ndarray],
+                eeg: np.ndarray,
+                x: np.ndarray,
+                null_x: np.ndarray,
+                p: int,
+                lag_samples: np.ndarray) -> Dict[str, np.ndarray]:
+    #statistics of the columns of predictor p when it is replaced by each null predictor:
+    #the blocks of the other predictors (and of the EEG) are those of `stats`, unchanged
+    n_null, n_trials, _ = null_x.shape
+    n_lags = len(lag_samples)
+    dim = stats["xx"].shape[1]
+    sx = np.zeros((n_null, n_trials, n_lags))
+    cross = np.zeros((n_null, n_trials, n_lags, dim))
+    xy = np.zeros((n_null, n_trials, n_lags, stats["xy"].shape[2]))
+    own = slice(p * n_lags, (p + 1) * n_lags)
+    for i in range(n_trials):
+        X = lagged_design(np.asarray(x[:, i], dtype=np.float64), lag_samples)
+        Y = np.asarray(eeg[i], dtype=np.float64).T
+        Xn = lagged_design(null_x[:, i], lag_samples)  # (time, null * lag)
+        sx[:, i] = Xn.sum(0).reshape(n_null, n_lags)
+        cross[:, i] = (Xn.T @ X).reshape(n_null, n_lags, dim)
+        Xn = Xn.reshape(len(Xn), n_null, n_lags).transpose(1, 0, 2)
+        cross[:, i, :, own] = Xn.transpose(0, 2, 1) @ Xn
+        xy[:, i] = Xn.transpose(0, 2, 1) @ Y
+    return {"sx": sx, "cross": cross, "xy": xy}
+
+
+def _replace(stats: Dict[str, np.ndarray], null: Dict[str, np.ndarray], k: int, p: int, n_lags: int) -> Dict[str, np.ndarray]:
+    #per-trial statistics with the columns of predictor p taken from null predictor k
+    own = slice(p * n_lags, (p + 1) * n_lags)
+    out = dict(stats)
+    out["sx"] = stats["sx"].copy()
+    out["sx"][:, own] = null["sx"][k]
+    out["xx"] = stats["xx"].copy()
+    out["xx"][:, own, :] = null["cross"][k]
+    out["xx"][:, :, own] = null["cross"][k].transpose(0, 2, 1)
+    out["xy"] = stats["xy"].copy()
+    out["xy"][:, own] = null["xy"][k]
+    return out
+
+
+def _z(r: np.ndarray) -> float:
+    #Fisher z of the sensor-averaged accuracy, as in model_comparison.ipynb
+    return float(np.arctanh(np.mean(r)))
+
+
+def null_contributions(eeg: np.ndarray,
+                       predictors: Dict[str, np.ndarray],
+                       keys: Optional[Sequence[str]] = None,
+                       method: str = "shift",
+                       n_null: int = N_NULL,
+                       min_shift: float = MIN_SHIFT,
+                       tstart: float = TSTART,
+                       tstop: float = TSTOP,
+                       fs: float = FS,
+                       n_folds: int = N_FOLDS,
+                       lambdas: np.ndarray = LAMBDAS,
+                       batch_size: int = BATCH_SIZE,
+                       seed: int = 0,
+                       nested: bool = True) -> Dict[str, dict]:
+    """
+    Null distributions of the contribution of each predictor to the prediction accuracy of one
+    subject (ridge mTRFs, see `ridge.py`).
+
+    The contribution is Δz = arctanh(mean r of the full model) - arctanh(mean r of the model
+    without the predictor). Its null distribution replaces the predictor, in the full model, by
+    circularly shifted (`method='shift'`) or value-shuffled (`method='shuffle'`) copies.
+
+    Parameters:
+        eeg (np.ndarray): (trial, channel, time) EEG.
+        predictors (dict): predictor key -> (trial, time) trials.
+        keys (Sequence[str], optional): Predictors to test (default: all).
+        method (str): 'shift' (random circular shift of every trial, keeps the values and the
+            autocorrelation) or 'shuffle' (shuffles the values across words, keeps the onsets;
+            for impulse predictors).
+        n_null (int): Null predictors per tested predictor.
+        min_shift (float): Minimum circular shift (s); should exceed the TRF window.
+        tstart, tstop (float): TRF window in seconds (tstop exclusive).
+        fs (float): Sampling rate (Hz).
+        n_folds (int): Cross-validation folds (over trials).
+        lambdas (np.ndarray): Relative regularization grid.
+        batch_size (int): Null predictors whose statistics are computed at once (memory
+            ~ batch_size x trials x lags x columns).
+        seed (int): Seed of the shifts / shuffles.
+        nested (bool): Nested selection of lambda for every r (see `ridge.fit_models`).
+
+    Returns:
+        Dict[str, dict]: predictor key -> 'delta' (observed Δz), 'null' (n_null,) null Δz and
+        'p' (fraction of the null at or above the observed Δz, observed included).
+
+    Notes:
+        - The per-trial XᵀX/XᵀY of the real predictors are computed once; a null predictor only
+          recomputes the rows of its own lagged columns, and the reduced model does not change.
+        - The regularization of every null fit is selected like that of the observed fit.
+    """
+
+    if method not in {"shift", "shuffle"}:
+        raise ValueError("method must be 'shift' or 'shuffle'")
+    names = list(predictors)
+    keys = list(keys or names)
+    lag_samples = lags(tstart, tstop, fs)
+    n_lags = len(lag_samples)
+    x = np.stack([np.asarray(predictors[k], dtype=np.float64) for k in names])
+    n_trials, n_times = x.shape[1:]
+
+    stats = trial_stats(eeg, x, lag_samples)
+    spec = {m: [names.index(k) for k in ks] for m, ks in model_spec(names).items() if m == "" or m[3:] in keys}
+    observed = fit_models(stats, spec, n_lags, n_folds, lambdas, nested)
+    folds = fold_ids(n_trials, n_folds)
+    cols = np.arange(len(names) * n_lags)
+
+    results = {}
+    for j, key in enumerate(keys):
+        p = names.index(key)
+        z_reduced = _z(observed[f"_no{key}"]["r"])
+        rng_seed = seed + j
+        if method == "shift":
+            shifts = random_shifts(n_null, n_trials, n_times, int(round(min_shift * fs)), rng_seed)
+        null = np.zeros(n_null)
+        for start in range(0, n_null, batch_size):
+            stop = min(start + batch_size, n_null)
+            if method == "shift":
+                null_x = circular_shifts(x[p], shifts[start:stop])
+            else:
+                null_x = shuffled_values(x[p], stop - start, rng_seed * 100003 + start)
+            batch = _null_stats(stats, eeg, x, null_x, p, lag_samples)
+            for k in range(stop - start):
+                null_stats = _replace(stats, batch, k, p, n_lags)
+                if nested:
+                    r = nested_cross_validate(null_stats, cols, folds, lambdas)
+                else:
+                    r_grid = cross_validate(null_stats, cols, folds, lambdas)
+                    r = r_grid[int(np.argmax(r_grid.mean(1)))]
+                null[start + k] = _z(r) - z_reduced
+        delta = _z(observed[""]["r"]) - z_reduced
+        results[key] = {"delta": delta, "null": null, "p": float((np.sum(null >= delta) + 1) / (n_null + 1))}
+        logging.info(f"{key}: Δz = {delta:.4f}, null {null.mean():.4f} ± {null.std():.4f}, p = {results[key]['p']:.3f}")
+    return results
+
+
+def run_nulls(subjects: Sequence = SUBJECTS,
+              eeg_paths: Union[str, Dict] = "",
+              predictor_source: str = PREDICTOR_STORE,
+              out_path: str = NULLS_FILE,
+              keys: Sequence[str] = tuple(PREDICTORS),
+              eeg_cache: str = EEG_CACHE,
+              **kwargs) -> Dict[str, np.ndarray]:
+    """
+    Null distributions of every predictor contribution for every subject, saved in one .npz.
+
+    Parameters:
+        subjects (Sequence): Subject IDs.
+        eeg_paths (str or dict): .mat path per subject, or a pattern with '{subject}'.
+        predictor_source (str): `TrialStore` directory of the predictor trials (see `runner`).
+        out_path (str): Output .npz (rewritten after every subject).
+        keys (Sequence[str]): Predictor keys (of `runner.PREDICTORS`), all in the model.
+        eeg_cache (str): Directory of the converted EEG.
+        **kwargs: Passed to `null_contributions` (method, n_null, min_shift, ...).
+
+    Returns:
+        Dict[str, np.ndarray]: 'subjects', and per key 'delta_<key>' (subject,) and
+        'null_<key>' (subject, n_null) Δz, in the order of `subjects`. E.g. the contribution of
+        each subject beyond its null mean, `delta - null.mean(1)`, goes into the group t-test.
+    """
+
+    out, done = {}, []
+    for subject in subjects:
+        path = eeg_paths[subject] if isinstance(eeg_paths, dict) else eeg_paths.format(subject=subject)
+        eeg, _ = load_eeg(path, eeg_cache)
+        predictors = {k: _load_trials(subject, PREDICTORS[k][0], predictor_source) for k in keys}
+        logging.info(f"Null models: subject {subject}")
+        done.append(null_contributions(eeg, predictors, keys, **kwargs))
+
+        for key in keys:
+            out[f"delta_{key}"] = np.array([d[key]["delta"] for d in done])
+            out[f"null_{key}"] = np.stack([d[key]["null"] for d in done])
+        out["subjects"] = np.array([str(s) for s in subjects[:len(done)]])
+        tmp = out_path + ".tmp.npz"
+        np.savez(tmp, **out)
+        os.replace(tmp, out_path)
+    return out
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+from eeg_io import MONTAGE
+
+INDEX_FILE = "index.csv"
+INDEX_COLUMNS = ["subject", "model", "engine", "predictors", "tstart", "tstep", "n_times",
+                 "montage", "sensors", "arrays", "created"]
+
+
+def boosting_arrays(trf) -> Dict[str, object]:
+    """
+    Extracts the arrays analyzed downstream from an eelbrain BoostingResult.
+
+    Returns:
+        Dict[str, object]: 'arrays' (r and proportion_explained per sensor, h and h_scaled as
+        (predictor, sensor, time)) and 'meta' (predictor names, time axis, sensor names).
+    """
+
+    hs = trf.h if isinstance(trf.h, (list, tuple)) else [trf.h]
+    hs_scaled = trf.h_scaled if isinstance(trf.h_scaled, (list, tuple)) else [trf.h_scaled]
+    time_axis = hs[0].time
+    arrays = {"r": trf.r.get_data(("sensor",)),
+              "proportion_explained": trf.proportion_explained.get_data(("sensor",)),
+              "h": np.stack([h.get_data(("sensor", "time")) for h in hs]),
+              "h_scaled": np.stack([h.get_data(("sensor", "time")) for h in hs_scaled])}
+    meta = {"predictors": [h.name for h in hs], "tstart": float(time_axis.tmin), "tstep": float(time_axis.tstep),
+            "n_times": int(time_axis.nsamples), "sensors": list(trf.r.sensor.names)}
+    return {"arrays": arrays, "meta": meta}
+
+
+class ResultStore:
+    """
+    Compact, indexed store of mTRF results.
+
+    Only the arrays used by the group analyses are kept: one .npy file per array and fit, in
+    one directory per array ('r/', 'proportion_explained/', 'h/', 'h_scaled/', ...), and one
+    row per fit in index.csv (subject, model, engine, predictors, time axis, sensors).
+    Arrays are read as memory maps, so selecting a few fits or arrays reads only those.
+
+    Parameters:
+        root (str): Directory of the store (created if needed).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, INDEX_FILE)
+        if os.path.exists(path):
+            self.index = pd.read_csv(path, dtype={"subject": str, "model": str}, keep_default_na=False)
+        else:
+            self.index = pd.DataFrame(columns=INDEX_COLUMNS)
+
+    @staticmethod
+    def fit_id(subject, model: str, engine: str = "boosting") -> str:
+        return f"{subject}{model}" if engine == "boosting" else f"{subject}{model}.{engine}"
+
+    def put(self, subject, model: str, arrays: Dict[str, np.ndarray], meta: dict, engine: str = "boosting"):
+        """
+        Stores (or replaces) the arrays of one fit and updates the index.
+
+        Parameters:
+            subject: Subject ID.
+            model (str): Model suffix ('' for the full model, '_no<key>' for reductions).
+            arrays (dict): name -> array (e.g. r, proportion_explained, h, h_scaled).
+            meta (dict): 'predictors', 'tstart', 'tstep', 'n_times', and optionally 'sensors'
+                and 'montage' (default `eeg_io.MONTAGE`).
+            engine (str): Fitting engine ('boosting' or 'ridge').
+        """
+
+        fit_id = self.fit_id(subject, model, engine)
+        for name, arr in arrays.items():
+            os.makedirs(os.path.join(self.root, name), exist_ok=True)
+            path = os.path.join(self.root, name, f"{fit_id}.npy")
+            np.save(path + ".tmp.npy", np.ascontiguousarray(arr))
+            os.replace(path + ".tmp.npy", path)
+
+        row = {"subject": str(subject), "model": model, "engine": engine,
+               "predictors": json.dumps(list(meta["predictors"])),
+               "tstart": meta["tstart"], "tstep": meta["tstep"], "n_times": meta["n_times"],
+               "montage": meta.get("montage", MONTAGE), "sensors": json.dumps(meta.get("sensors")),
+               "arrays": json.dumps(sorted(arrays)), "created": time.time()}
+        keep = ~((self.index["subject"] == str(subject)) & (self.index["model"] == model)
+                 & (self.index["engine"] == engine))
+        self.index = pd.concat([self.index[keep], pd.DataFrame([row])], ignore_index=True)
+        self.save()
+
+    def save(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        self.index.to_csv(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    def add_boosting(self, subject, model: str, trf, montage: str = MONTAGE):
+        """
+        Stores the analyzed arrays of an eelbrain BoostingResult (see `boosting_arrays`).
+        """
+
+        extracted = boosting_arrays(trf)
+        self.put(subject, model, extracted["arrays"], {**extracted["meta"], "montage": montage})
+
+    def add_ridge(self, subject, model: str, result: dict, montage: str = MONTAGE):
+        """
+        Stores r and h of a `ridge.fit_subject` model result.
+        """
+
+        times = result["times"]
+        self.put(subject, model, {"r": result["r"], "h": result["h"]},
+                 {"predictors": result["predictors"], "tstart": float(times[0]),
+                  "tstep": float(times[1] - times[0]), "n_times": len(times), "montage": montage},
+                 engine="ridge")
+
+    def select(self, model: Optional[str] = None, subjects: Optional[Sequence] = None,
+               engine: str = "boosting") -> pd.DataFrame:
+        """
+        Index rows of the matching fits (in the order of `subjects` when given).
+        """
+
+        rows = self.index[self.index["engine"] == engine]
+        if model is not None:
+            rows = rows[rows["model"] == model]
+        if subjects is not None:
+            rows = rows.set_index("subject").loc[[str(s) for s in subjects]].reset_index()
+        return rows
+
+    def get(self, name: str, subject, model: str = "", engine: str = "boosting") -> np.ndarray:
+        """
+        Returns one array of one fit as a read-only memory map.
+        """
+
+        return np.load(os.path.join(self.root, name, f"{self.fit_id(subject, model, engine)}.npy"), mmap_mode="r")
+
+    def stack(self, name: str, model: str = "", subjects: Optional[Sequence] = None,
+              engine: str = "boosting") -> np.ndarray:
+        """
+        Stacks one array across subjects: (subject, ...) in the order of `subjects`
+        (default: index order).
+        """
+
+        rows = self.select(model, subjects, engine)
+        return np.stack([self.get(name, s, model, engine) for s in rows["subject"]])
+
+    def subjects(self, model: str = "", engine: str = "boosting") -> List[str]:
+        return list(self.select(model, engine=engine)["subject"])
+
+    def ndvar(self, name: str, model: str = "", subjects: Optional[Sequence] = None,
+              predictor: Optional[str] = None, engine: str = "boosting"):
+        """
+        Returns a (case, sensor[, time]) eelbrain NDVar of one array across subjects.
+
+        Parameters:
+            name (str): Array name ('r', 'proportion_explained', 'h', 'h_scaled').
+            model (str): Model suffix.
+            subjects (Sequence, optional): Subjects (default: all, in index order).
+            predictor (str, optional): For 'h'/'h_scaled', the predictor to select (required).
+            engine (str): Fitting engine.
+        """
+
+        import eelbrain as eel
+
+        rows = self.select(model, subjects, engine)
+        first = rows.iloc[0]
+        data = self.stack(name, model, list(rows["subject"]), engine)
+        dims = [eel.Case(len(rows)), eel.Sensor.from_montage(first["montage"] or MONTAGE)]
+        if predictor is None and data.ndim == 4:
+            raise ValueError(f"{name!r} has one TRF per predictor: pass predictor= one of "
+                             f"{json.loads(first['predictors'])}")
+        if predictor is not None:
+            data = data[:, json.loads(first["predictors"]).index(predictor)]
+        if data.ndim == 3:
+            dims.append(eel.UTS(first["tstart"], first["tstep"], int(first["n_times"])))
+        return eel.NDVar(np.asarray(data), dims=tuple(dims), name=predictor or name)
+
+
+def import_pickles(output_dir: str, store: ResultStore, pattern: str = "mTRF{subject}{model}.pkl",
+                   subjects: Sequence = (), models: Sequence[str] = (), montage: str = MONTAGE) -> int:
+    """
+    Copies the analyzed arrays of existing BoostingResult pickles into a store.
+
+    Returns:
+        int: Number of fits imported.
+    """
+
+    import eelbrain as eel
+
+    n = 0
+    for subject in subjects:
+        for model in models:
+            path = os.path.join(output_dir, pattern.format(subject=subject, model=model))
+            if os.path.exists(path):
+                store.add_boosting(subject, model, eel.load.unpickle(path), montage)
+                n += 1
+    return n
@@ -0,0 +1,291 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+from runner import model_spec
+
+#parameters
+FS = 100             # Hz
+TSTART = -0.200      # s
+TSTOP = 0.600        # s (exclusive, as in eel.boosting)
+N_FOLDS = 6
+LAMBDAS = np.logspace(-3, 3, 13)   # relative to the mean eigenvalue of the training covariance
+
+
+def lags(tstart: float = TSTART, tstop: float = TSTOP, fs: float = FS) -> np.ndarray:
+    """
+    TRF lags in samples, from `tstart` (inclusive) to `tstop` (exclusive).
+    """
+
+    return np.arange(int(round(tstart * fs)), int(round(tstop * fs)))
+
+
+def lagged_design(x: np.ndarray, lag_samples: np.ndarray) -> np.ndarray:
+    """
+    Time-lagged design matrix of one trial.
+
+    Parameters:
+        x (np.ndarray): (predictor, time) predictors.
+        lag_samples (np.ndarray): Lags in samples (see `lags`).
+
+    Returns:
+        np.ndarray: (time, predictor * lag) matrix whose column (p, j) is x[p, t - lag_j]
+        (zero outside the trial). Columns are grouped by predictor.
+    """
+
+    n_pred, n_times = x.shape
+    X = np.zeros((n_times, n_pred, len(lag_samples)))
+    for j, lag in enumerate(lag_samples):
+        if lag >= 0:
+            X[lag:, :, j] = x[:, :n_times - lag].T
+        else:
+            X[:lag, :, j] = x[:, -lag:].T
+    return X.reshape(n_times, n_pred * len(lag_samples))
+
+
+def trial_stats(eeg: np.ndarray, predictors: np.ndarray, lag_samples: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Sufficient statistics of every trial: everything later fits need, computed in one pass.
+
+    Parameters:
+        eeg (np.ndarray): (trial, channel, time) EEG.
+        predictors (np.ndarray): (predictor, trial, time) predictors.
+        lag_samples (np.ndarray): Lags in samples.
+
+    Returns:
+        Dict[str, np.ndarray]: Per-trial 'n' (samples), 'sx' (sum of the design columns),
+        'sy' (sum of the EEG), 'xx' (XᵀX), 'xy' (XᵀY) and 'yy' (sum of squared EEG).
+    """
+
+    n_trials = eeg.shape[0]
+    dim = predictors.shape[0] * len(lag_samples)
+    n_channels = eeg.shape[1]
+    stats = {"n": np.zeros(n_trials), "sx": np.zeros((n_trials, dim)), "sy": np.zeros((n_trials, n_channels)),
+             "xx": np.zeros((n_trials, dim, dim)), "xy": np.zeros((n_trials, dim, n_channels)),
+             "yy": np.zeros((n_trials, n_channels))}
+    for i in range(n_trials):
+        X = lagged_design(np.asarray(predictors[:, i], dtype=np.float64), lag_samples)
+        Y = np.asarray(eeg[i], dtype=np.float64).T  # (time, channel)
+        stats["n"][i] = len(Y)
+        stats["sx"][i] = X.sum(0)
+        stats["sy"][i] = Y.sum(0)
+        stats["xx"][i] = X.T @ X
+        stats["xy"][i] = X.T @ Y
+        stats["yy"][i] = np.einsum("tc,tc->c", Y, Y)
+    return stats
+
+
+def _sum(stats: Dict[str, np.ndarray], trials: np.ndarray, cols: np.ndarray) -> Dict[str, np.ndarray]:
+    #statistics of a set of trials, restricted to the design columns of a model
+    return {"n": stats["n"][trials].sum(),
+            "sx": stats["sx"][trials][:, cols].sum(0),
+            "sy": stats["sy"][trials].sum(0),
+            "xx": stats["xx"][trials][:, cols][:, :, cols].sum(0),
+            "xy": stats["xy"][trials][:, cols].sum(0),
+            "yy": stats["yy"][trials].sum(0)}
+
+
+def _minus(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {k: a[k] - b[k] for k in a}
+
+
+def solve_grid(train: Dict[str, np.ndarray], lambdas: np.ndarray) -> np.ndarray:
+    """
+    Ridge weights for every regularization value from one eigendecomposition.
+
+    Columns are centred and scaled to unit variance with the training statistics, so the
+    penalty is the same for all predictors; `lambdas` are relative to the mean eigenvalue.
+
+    Returns:
+        np.ndarray: (lambda, column, channel) weights in the original units of the design.
+    """
+
+    n = train["n"]
+    mean_x, mean_y = train["sx"] / n, train["sy"] / n
+    cxx = train["xx"] - n * np.outer(mean_x, mean_x)
+    cxy = train["xy"] - n * np.outer(mean_x, mean_y)
+    scale = np.sqrt(np.clip(np.diag(cxx), 1e-12, None))
+    cxx = cxx / np.outer(scale, scale)
+    cxy = cxy / scale[:, None]
+
+    s, V = np.linalg.eigh(cxx)
+    s = np.clip(s, 0, None)
+    proj = V.T @ cxy  # (eig, channel)
+    shrink = 1 / (s[None, :] + lambdas[:, None] * s.mean())  # (lambda, eig)
+    W = V @ (shrink[:, :, None] * proj[None])  # (lambda, column, channel)
+    return W / scale[None, :, None]
+
+
+def _test_sums(test: Dict[str, np.ndarray], W: np.ndarray, train_mean_x: np.ndarray) -> Dict[str, np.ndarray]:
+    #sums of y, ŷ, y², ŷ² and yŷ over a test set, for every lambda and channel (ŷ = (x - mean_x) W)
+    n = test["n"]
+    sx = test["sx"] - n * train_mean_x
+    xx = test["xx"] - np.outer(test["sx"], train_mean_x) - np.outer(train_mean_x, test["sx"]) \
+        + n * np.outer(train_mean_x, train_mean_x)
+    xy = test["xy"] - np.outer(train_mean_x, test["sy"])
+    return {"n": n, "sy": test["sy"], "yy": test["yy"],
+            "sp": sx @ W,
+            "pp": ((xx @ W) * W).sum(1),
+            "yp": (xy[None] * W).sum(1)}
+
+
+def _correlation(s: Dict[str, np.ndarray]) -> np.ndarray:
+    n = s["n"]
+    cov = s["yp"] - s["sy"] * s["sp"] / n
+    var_y = s["yy"] - s["sy"] ** 2 / n
+    var_p = s["pp"] - s["sp"] ** 2 / n
+    return cov / np.sqrt(np.clip(var_y * var_p, 1e-300, None))
+
+
+def fold_ids(n_trials: int, n_folds: int = N_FOLDS) -> np.ndarray:
+    """
+    Assigns trials to cross-validation folds (interleaved: trial i goes to fold i % n_folds).
+    """
+
+    return np.arange(n_trials) % n_folds
+
+
+def cross_validate(stats: Dict[str, np.ndarray],
+                   cols: np.ndarray,
+                   folds: np.ndarray,
+                   lambdas: np.ndarray = LAMBDAS) -> np.ndarray:
+    """
+    Cross-validated prediction accuracy of one model for every regularization value.
+
+    For each fold, the training statistics are the total minus the fold, so no design matrix
+    is rebuilt; the test predictions of all folds are pooled (as if concatenated) before
+    computing the correlation.
+
+    Returns:
+        np.ndarray: (lambda, channel) correlations.
+    """
+
+    all_trials = np.arange(len(stats["n"]))
+    total = _sum(stats, all_trials, cols)
+    pooled = None
+    for fold in np.unique(folds):
+        test = _sum(stats, all_trials[folds == fold], cols)
+        train = _minus(total, test)
+        W = solve_grid(train, lambdas)
+        sums = _test_sums(test, W, train["sx"] / train["n"])
+        pooled = sums if pooled is None else {k: pooled[k] + sums[k] for k in sums}
+    return _correlation(pooled)
+
+
+def nested_cross_validate(stats: Dict[str, np.ndarray],
+                          cols: np.ndarray,
+                          folds: np.ndarray,
+                          lambdas: np.ndarray = LAMBDAS) -> np.ndarray:
+    """
+    Cross-validated prediction accuracy of one model, with the regularization selected within
+    each outer training set.
+
+    For each fold, lambda is chosen by `cross_validate` over the other folds only, so the test
+    trials play no part in the selection; the test predictions of all folds are then pooled as
+    in `cross_validate`.
+
+    Returns:
+        np.ndarray: (channel,) correlations.
+    """
+
+    all_trials = np.arange(len(stats["n"]))
+    total = _sum(stats, all_trials, cols)
+    pooled = None
+    for fold in np.unique(folds):
+        inner = np.flatnonzero(folds != fold)
+        inner_r = cross_validate({k: v[inner] for k, v in stats.items()}, cols, folds[inner], lambdas)
+        test = _sum(stats, all_trials[folds == fold], cols)
+        train = _minus(total, test)
+        W = solve_grid(train, lambdas[[int(np.argmax(inner_r.mean(1)))]])
+        sums = _test_sums(test, W, train["sx"] / train["n"])
+        pooled = sums if pooled is None else {k: pooled[k] + sums[k] for k in sums}
+    return _correlation(pooled)[0]
+
+
+def fit_models(stats: Dict[str, np.ndarray],
+               spec: Dict[str, List[int]],
+               n_lags: int,
+               n_folds: int = N_FOLDS,
+               lambdas: np.ndarray = LAMBDAS,
+               nested: bool = True) -> Dict[str, dict]:
+    """
+    Fits several models that share the same per-trial statistics.
+
+    Every model (e.g. the full model and its leave-one-predictor-out reductions) only selects
+    the sub-block of the lagged covariance that belongs to its predictors.
+
+    Parameters:
+        stats (dict): Output of `trial_stats`.
+        spec (dict): model name -> indices of its predictors (in the order of `stats`).
+        n_lags (int): Number of lags per predictor.
+        n_folds (int): Cross-validation folds (over trials).
+        lambdas (np.ndarray): Relative regularization grid.
+        nested (bool): Select lambda within each outer training set for 'r'
+            (`nested_cross_validate`, default). With False, 'r' is taken on the same pooled
+            folds that select lambda, which is n_folds times cheaper but optimistically biased.
+
+    Returns:
+        Dict[str, dict]: model name -> 'r' (channel,), 'lambda' (best on the pooled folds),
+        'r_grid' (lambda, channel; its maximum is biased upwards by the selection), 'h'
+        (predictor, channel, lag) weights fitted on all trials with that lambda, and
+        'predictors'.
+    """
+
+    folds = fold_ids(len(stats["n"]), n_folds)
+    out = {}
+    for name, predictors in spec.items():
+        cols = np.concatenate([np.arange(p * n_lags, (p + 1) * n_lags) for p in predictors])
+        r_grid = cross_validate(stats, cols, folds, lambdas)
+
+        best = int(np.argmax(r_grid.mean(1)))
+        total = _sum(stats, np.arange(len(folds)), cols)
+        r = nested_cross_validate(stats, cols, folds, lambdas) if nested else r_grid[best]
+
+        W = solve_grid(total, lambdas[[best]])[0]
+        out[name] = {"r": r, "lambda": float(lambdas[best]), "r_grid": r_grid, "predictors": list(predictors),
+                     "h": W.reshape(len(predictors), n_lags, -1).transpose(0, 2, 1)}
+    return out
+
+
+def fit_subject(eeg: np.ndarray,
+                predictors: Dict[str, np.ndarray],
+                spec: Optional[Dict[str, Sequence[str]]] = None,
+                tstart: float = TSTART,
+                tstop: float = TSTOP,
+                fs: float = FS,
+                n_folds: int = N_FOLDS,
+                lambdas: np.ndarray = LAMBDAS,
+                nested: bool = True) -> Dict[str, dict]:
+    """
+    Ridge mTRFs of one subject for a full model and its reductions, from one pass over the data.
+
+    Parameters:
+        eeg (np.ndarray): (trial, channel, time) EEG (e.g. from `eeg_io.load_eeg`).
+        predictors (dict): predictor key -> (trial, time) trials (e.g. `TrialStore.trials`).
+        spec (dict, optional): model suffix -> predictor keys. Default: full model and all
+            leave-one-predictor-out models (`runner.model_spec`).
+        tstart, tstop (float): TRF window in seconds (tstop exclusive).
+        fs (float): Sampling rate (Hz).
+        n_folds (int): Cross-validation folds (over trials).
+        lambdas (np.ndarray): Relative regularization grid.
+        nested (bool): Nested selection of lambda for 'r' (default, see `fit_models`).
+
+    Returns:
+        Dict[str, dict]: model suffix -> result (see `fit_models`), with the predictor keys and
+        the lag 'times' (s) of `h`.
+
+    Notes:
+        - The lagged design and XᵀX/XᵀY are computed once per trial; folds, the lambda grid and
+          all reduced models only combine and solve these statistics, so a full/reduced
+          comparison costs about as much as one fit.
+    """
+
+    keys = list(predictors)
+    spec = spec or model_spec(keys)
+    lag_samples = lags(tstart, tstop, fs)
+    x = np.stack([np.asarray(predictors[k], dtype=np.float64) for k in keys])
+    stats = trial_stats(eeg, x, lag_samples)
+    index = {k: i for i, k in enumerate(keys)}
+    results = fit_models(stats, {m: [index[k] for k in ks] for m, ks in spec.items()},
+                         len(lag_samples), n_folds, lambdas, nested)
+    for m, ks in spec.items():
+        results[m].update(predictors=list(ks), times=lag_samples / fs)
+    return results
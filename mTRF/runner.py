@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import pickle
+import logging
+import contextlib
+import multiprocessing
+import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence, Union
+from eeg_io import EEG_CACHE, eeg_ndvar, load_eeg, predictor_ndvar
+from results_store import ResultStore, boosting_arrays
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+SUBJECTS = [4, 5, 6, 7, 18, 19]
+
+# model key (used in '_no<key>' output names) -> (predictor file key, NDVar name)
+PREDICTORS = {
+    "WO": ("wo_gauss", "Word Onset"),
+    "freq": ("Freq", "Word Frequency"),
+    "surp": ("Surp", "Surprisal"),
+    "diss": ("Diss", "Semantic dissimilarity"),
+}
+
+BOOSTING = dict(tstart=-0.200, tstop=0.600, partitions=6, test=True, delta=0.003, partition_results=True,
+                basis=0.08, selective_stopping=4, scale_data=True)
+
+PREDICTOR_STORE = "trial_store"   # TrialStore directory of the predictor trials (predictors/Subject Predictors.py)
+OUTPUT_PATTERN = "mTRF{subject}{model}.pkl"
+MANIFEST_FILE = "manifest.jsonl"
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def model_spec(predictors: Sequence[str] = tuple(PREDICTORS), reduced: bool = True) -> Dict[str, List[str]]:
+    """
+    Full model plus one leave-one-predictor-out model per predictor.
+
+    Returns:
+        Dict[str, List[str]]: model suffix ('' for the full model, '_no<key>' otherwise) ->
+        predictor keys, in the order of `predictors`.
+    """
+
+    spec = {"": list(predictors)}
+    if reduced:
+        for key in predictors:
+            spec[f"_no{key}"] = [p for p in predictors if p != key]
+    return spec
+
+
+def _load_trials(subject, file_key: str, source: str):
+    #predictor trials of a subject, from a TrialStore directory (or from legacy per-subject pickles)
+    if "{subject}" in source:
+        with open(source.format(subject=subject, predictor=file_key), "rb") as f:
+            return pickle.load(f)["trials"]
+    predictors_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "predictors")
+    if predictors_dir not in sys.path:
+        sys.path.insert(0, predictors_dir)
+    from trial_store import TrialStore
+    return TrialStore(source).trials(str(subject), file_key)
+
+
+@contextlib.contextmanager
+def _thread_env(n_threads: int):
+    #thread variables are read when the BLAS/OpenMP libraries load: set them before the workers start
+    saved = {var: os.environ.get(var) for var in THREAD_VARIABLES}
+    os.environ.update({var: str(n_threads) for var in THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _init_fit_worker(n_threads: int):
+    #bound every thread pool of the worker, so that jobs x threads does not oversubscribe the cores
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(n_threads)
+    import eelbrain as eel
+    eel.configure(n_workers=n_threads if n_threads > 1 else False)
+
+
+def fit_model(subject,
+              model: str,
+              predictors: Sequence[str],
+              eeg_path: str,
+              predictor_source: str,
+              out_path: str,
+              eeg_cache: str = EEG_CACHE,
+              boosting_kwargs: Optional[dict] = None,
+              extract: bool = False) -> Optional[dict]:
+    """
+    Fits one boosting mTRF (one subject, one predictor set) and saves it with `eelbrain.save.pickle`.
+
+    The result is written to a temporary file and renamed, so an interrupted fit never
+    leaves a partial output behind.
+
+    Returns:
+        dict or None: With `extract`, the analyzed arrays of the fit (see
+        `results_store.boosting_arrays`), small enough to send back to the parent process.
+    """
+
+    import eelbrain as eel
+
+    data, meta = load_eeg(eeg_path, eeg_cache)
+    eeg = eeg_ndvar(data, meta)
+    xs = [predictor_ndvar(_load_trials(subject, PREDICTORS[key][0], predictor_source), meta["fs"], PREDICTORS[key][1])
+          for key in predictors]
+
+    logging.info(f"Fitting: subject {subject}, model '{model or 'full'}' ({', '.join(predictors)})")
+    trf = eel.boosting(eeg, xs, **{**BOOSTING, **(boosting_kwargs or {})})
+
+    tmp = out_path + ".tmp"
+    eel.save.pickle(trf, tmp)
+    os.replace(tmp, out_path)
+    return boosting_arrays(trf) if extract else None
+
+
+def run_batch(subjects: Sequence = SUBJECTS,
+              eeg_paths: Union[str, Dict] = "",
+              predictor_source: str = PREDICTOR_STORE,
+              output_dir: str = "Output",
+              spec: Optional[Dict[str, List[str]]] = None,
+              n_jobs: Optional[int] = None,
+              threads_per_job: Optional[int] = None,
+              eeg_cache: str = EEG_CACHE,
+              boosting_kwargs: Optional[dict] = None,
+              results_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Fits every subject x model of a model spec across a process pool.
+
+    Parameters:
+        subjects (Sequence): Subject IDs.
+        eeg_paths (str or dict): .mat path per subject, or a pattern with '{subject}'.
+        predictor_source (str): `TrialStore` directory of the predictor trials (predictor names
+            are the file keys of `PREDICTORS`). Per-subject pickles written before the trial
+            store can still be read with a pattern containing '{subject}' and '{predictor}'.
+        output_dir (str): Directory of the fitted models (`OUTPUT_PATTERN`) and of the manifest.
+        spec (dict, optional): model suffix -> predictor keys. Default: `model_spec()` (full
+            model and all leave-one-predictor-out models).
+        n_jobs (int, optional): Fits running at the same time (default: all CPU cores divided
+            by `threads_per_job`).
+        threads_per_job (int, optional): Threads (BLAS and eelbrain workers) per fit
+            (default: CPU cores divided by `n_jobs`, at least 1).
+        eeg_cache (str): Directory of the converted EEG (see `eeg_io.load_eeg`).
+        boosting_kwargs (dict, optional): Overrides of `BOOSTING`.
+        results_dir (str, optional): `ResultStore` directory where the analyzed arrays of every
+            fit are also stored (written by this process, as fits finish).
+
+    Returns:
+        pd.DataFrame: One row per fit (subject, model, predictors, output, status, seconds).
+
+    Notes:
+        - Fits whose output already exists are skipped, so a crashed batch resumes where it stopped.
+          With `results_dir`, a saved fit missing from the store index (the batch stopped between
+          saving and indexing it) is indexed from its pickle instead of being skipped.
+        - Every finished fit (or failure) is appended to `manifest.jsonl` as it happens.
+        - The EEG of every subject is converted once, before the workers start.
+    """
+
+    spec = spec or model_spec()
+    n_cpus = os.cpu_count() or 1
+    if n_jobs is None:
+        n_jobs = max(1, n_cpus // (threads_per_job or 1))
+    threads_per_job = threads_per_job or max(1, n_cpus // n_jobs)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = os.path.join(output_dir, MANIFEST_FILE)
+
+    def eeg_path(subject):
+        return eeg_paths[subject] if isinstance(eeg_paths, dict) else eeg_paths.format(subject=subject)
+
+    store = ResultStore(results_dir) if results_dir is not None else None
+    indexed = set() if store is None else set(
+        zip(store.index.loc[store.index["engine"] == "boosting", "subject"],
+            store.index.loc[store.index["engine"] == "boosting", "model"]))
+
+    jobs, rows = [], []
+    for subject in subjects:
+        load_eeg(eeg_path(subject), eeg_cache)  # convert once, before the workers map it
+        for model, predictors in spec.items():
+            out_path = os.path.join(output_dir, OUTPUT_PATTERN.format(subject=subject, model=model))
+            if os.path.exists(out_path):
+                status = "skipped"
+                if store is not None and (str(subject), model) not in indexed:
+                    #saved, but the batch stopped before indexing it: index the saved fit
+                    import eelbrain as eel
+                    store.add_boosting(subject, model, eel.load.unpickle(out_path))
+                    status = "indexed"
+                rows.append({"subject": subject, "model": model, "predictors": list(predictors),
+                             "output": out_path, "status": status, "seconds": 0.0})
+                continue
+            jobs.append((subject, model, list(predictors), eeg_path(subject), predictor_source, out_path,
+                         eeg_cache, boosting_kwargs, results_dir is not None))
+    logging.info(f"Fitting {len(jobs)} models ({len(rows)} already done), {n_jobs} jobs x {threads_per_job} threads")
+
+    def record(job, status, started, error=None):
+        row = {"subject": job[0], "model": job[1], "predictors": job[2], "output": job[5],
+               "status": status, "seconds": round(time.time() - started, 1)}
+        if error is not None:
+            row["error"] = error
+        with open(manifest, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row) + "\n")
+        rows.append(row)
+
+    #fresh (spawned) workers load their BLAS with the thread variables already set
+    with _thread_env(threads_per_job), ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_fit_worker,
+                                                           initargs=(threads_per_job,),
+                                                           mp_context=multiprocessing.get_context("spawn")) as pool:
+        todo = iter(jobs)
+        pending = {}
+        while True:
+            #keep a bounded number of fits in flight
+            for job in todo:
+                pending[pool.submit(fit_model, *job)] = (job, time.time())
+                if len(pending) >= 2 * n_jobs:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, started = pending.pop(future)
+                try:
+                    extracted = future.result()
+                    if store is not None:
+                        store.put(job[0], job[1], extracted["arrays"], extracted["meta"])
+                    record(job, "done", started)
+                except Exception as e:
+                    logging.error(f"Failed: subject {job[0]}, model '{job[1]}': {e!r}")
+                    record(job, "failed", started, repr(e))
+            logging.info(f"Fitted {sum(r['status'] == 'done' for r in rows)}/{len(jobs)} models")
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,208 @@
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Sequence, Tuple
+from nlp_pipeline.utils import STRIP_CHARS, normalize_text
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+BAND = 50                          # words on each side of the diagonal explored by the alignment
+WORD_COLUMN = "word"               # word column of the onset table (forced aligner)
+AGGREGATION = {"surprisal": "sum"}  # columns of several source words mapped to one onset word; default 'mean'
+
+_KEY_TABLE = str.maketrans("", "", STRIP_CHARS + "'")
+_MATCH, _SUBSTITUTE, _DELETE, _INSERT, _MERGE, _SPLIT = range(6)
+OPERATIONS = {_MATCH: "match", _SUBSTITUTE: "substitute", _DELETE: "missing", _INSERT: "extra",
+              _MERGE: "merge", _SPLIT: "split"}
+
+
+def word_key(word) -> str:
+    """
+    Comparison key of a word: `normalize_text`, lowercased, without punctuation or apostrophes.
+    """
+
+    return normalize_text(word).lower().translate(_KEY_TABLE).strip()
+
+
+def _codes(keys: Sequence[str], vocabulary: Dict[str, int]) -> np.ndarray:
+    return np.array([vocabulary.setdefault(k, len(vocabulary)) for k in keys], dtype=np.int64)
+
+
+def _pairs(keys: Sequence[str], vocabulary: Dict[str, int]) -> np.ndarray:
+    #code of each key concatenated with the previous one (-1 for the first)
+    return np.concatenate([[-1], _codes([a + b for a, b in zip(keys[:-1], keys[1:])], vocabulary)]).astype(np.int64)
+
+
+def align_words(reference: Sequence[str],
+                words: Sequence[str],
+                band: int = BAND) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Aligns a word sequence (e.g. reconstructed LM words) onto a reference sequence (e.g. the
+    words of the forced aligner).
+
+    Banded edit distance on word keys (see `word_key`): only the cells within `band` words of
+    the diagonal are computed, so the cost is linear in the story length. Besides matches,
+    substitutions, missing and extra words, two words may merge into one reference word (e.g.
+    "l'" + "uomo" = "l'uomo") and one word may cover two reference words, at no cost when the
+    keys agree.
+
+    Parameters:
+        reference (Sequence[str]): Reference words.
+        words (Sequence[str]): Words to align.
+        band (int): Half-width of the band, in words.
+
+    Returns:
+        Tuple[np.ndarray, pd.DataFrame]:
+            - Reference index of every word (-1 for extra words; merged words share an index,
+              and a word covering two reference words gets the first).
+            - Report of every operation other than an exact match: 'operation' (substitute,
+              missing, extra, merge, split), 'reference_index', 'word_index', 'reference', 'word'.
+    """
+
+    n, m = len(reference), len(words)
+    columns = ["operation", "reference_index", "word_index", "reference", "word"]
+    if n == 0 or m == 0:
+        #nothing to align against: every reference word is missing, every word is extra
+        report = ([{"operation": OPERATIONS[_DELETE], "reference_index": i, "word_index": -1,
+                    "reference": str(w), "word": ""} for i, w in enumerate(reference)]
+                  + [{"operation": OPERATIONS[_INSERT], "reference_index": -1, "word_index": j,
+                      "reference": "", "word": str(w)} for j, w in enumerate(words)])
+        return np.full(m, -1, dtype=np.int64), pd.DataFrame(report, columns=columns)
+    vocabulary = {}
+    ref_keys, keys = [word_key(w) for w in reference], [word_key(w) for w in words]
+    a, b = _codes(ref_keys, vocabulary), _codes(keys, vocabulary)
+    a_pairs, b_pairs = _pairs(ref_keys, vocabulary), _pairs(keys, vocabulary)
+
+    centre = np.round(np.arange(n + 1) * (m / max(n, 1))).astype(np.int64)
+    lo = np.clip(centre - band, 0, m)
+    hi = np.clip(centre + band, 0, m) + 1
+    lo[0], hi[n] = 0, m + 1
+    width = int((hi - lo).max())
+    cost = np.full((n + 1, width), np.inf)
+    ops = np.full((n + 1, width), -1, dtype=np.int8)
+    cost[0, :hi[0]] = np.arange(hi[0])
+    ops[0, 1:hi[0]] = _INSERT
+
+    def previous(row: int, js: np.ndarray) -> np.ndarray:
+        #costs of row `row` at columns js (inf outside its band)
+        if row < 0:
+            return np.full(len(js), np.inf)
+        k = js - lo[row]
+        valid = (k >= 0) & (js < hi[row])
+        return np.where(valid, cost[row, np.clip(k, 0, width - 1)], np.inf)
+
+    for i in range(1, n + 1):
+        js = np.arange(lo[i], hi[i])
+        jb = np.clip(js - 1, 0, max(m - 1, 0))
+        before = previous(i - 1, np.arange(lo[i] - 2, hi[i]))  # columns js - 2, js - 1, js
+        diagonal = before[1:-1]
+        candidates = [
+            (_MATCH, np.where((js >= 1) & (b[jb] == a[i - 1]), diagonal, np.inf)),
+            (_MERGE, np.where((js >= 2) & (b_pairs[jb] == a[i - 1]), before[:-2], np.inf)),
+            (_SPLIT, np.where((js >= 1) & (b[jb] == a_pairs[i - 1]), previous(i - 2, js - 1), np.inf)),
+            (_SUBSTITUTE, np.where(js >= 1, diagonal + 1, np.inf)),
+            (_DELETE, before[2:] + 1),
+        ]
+        best = np.full(len(js), np.inf)
+        op = np.full(len(js), -1, dtype=np.int8)
+        for code, values in candidates:
+            better = values < best
+            best[better], op[better] = values[better], code
+        #extra words within the row: cost[j] = min(best[j], cost[j - 1] + 1)
+        row = js + np.minimum.accumulate(best - js)
+        op[row < best] = _INSERT
+        cost[i, :len(js)] = row
+        ops[i, :len(js)] = op
+
+    index = np.full(m, -1, dtype=np.int64)
+    report = []
+    i, j, at_edge = n, m, False
+    while i > 0 or j > 0:
+        op = ops[i, j - lo[i]]
+        at_edge |= (j == lo[i] and lo[i] > 0) or (j == hi[i] - 1 and hi[i] <= m)
+        if op in (_MATCH, _SUBSTITUTE):
+            index[j - 1] = i - 1
+            step = (1, 1)
+        elif op == _MERGE:
+            index[j - 2:j] = i - 1
+            step = (1, 2)
+        elif op == _SPLIT:
+            index[j - 1] = i - 2
+            step = (2, 1)
+        elif op == _DELETE:
+            step = (1, 0)
+        else:
+            step = (0, 1)
+        #merges/splits with a punctuation-only token are tokenization details, not mismatches
+        benign = op in (_MERGE, _SPLIT) and "" in (ref_keys[i - step[0]:i] + keys[j - step[1]:j])
+        if op != _MATCH and not benign:
+            ref_span = reference[i - step[0]:i]
+            word_span = words[j - step[1]:j]
+            report.append({"operation": OPERATIONS[int(op)],
+                           "reference_index": i - step[0] if step[0] else -1,
+                           "word_index": j - step[1] if step[1] else -1,
+                           "reference": " ".join(map(str, ref_span)), "word": " ".join(map(str, word_span))})
+        i, j = i - step[0], j - step[1]
+
+    if at_edge:
+        logging.warning(f"The alignment reached the edge of the band ({band} words): the sequences may be "
+                        f"misaligned, consider a larger band")
+    return index, pd.DataFrame(report[::-1], columns=columns)
+
+
+def story_events(onsets: pd.DataFrame,
+                 features: Dict[str, Tuple[pd.DataFrame, str]],
+                 story: str = "",
+                 word_column: str = WORD_COLUMN,
+                 agg: Optional[Dict[str, str]] = None,
+                 band: int = BAND) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Event table of one story: one row per word of the onset table (forced aligner), with the
+    features of every source mapped onto it by `align_words`.
+
+    Parameters:
+        onsets (pd.DataFrame): One row per spoken word, with `word_column` and the onset columns
+            (BEGIN, END, ...).
+        features (dict): source name -> (table, word column), e.g.
+            {"frequency": (processor output, "tokens_no_punct"), "surprisal": (surprisal CSV, "word")}.
+            All other columns of the tables are features.
+        story (str): Story name (added as a 'story' column).
+        word_column (str): Word column of `onsets`.
+        agg (dict, optional): Aggregation ('mean', 'sum', 'first', ...) of the source words that
+            map onto one onset word, per column (default `AGGREGATION`, then 'mean' for numbers
+            and 'first' otherwise).
+        band (int): Half-width of the alignment band, in words.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]:
+            - Events: 'story', 'word_index' and the onset table, followed by the features
+              (NaN for onset words without a source word).
+            - Mismatch report of all sources (see `align_words`), with 'story' and 'source'.
+    """
+
+    agg = {**AGGREGATION, **(agg or {})}
+    reference = onsets[word_column].tolist()
+    events = onsets.reset_index(drop=True).copy()
+    events.insert(0, "word_index", np.arange(len(events)))
+    events.insert(0, "story", story)
+
+    reports = []
+    for source, (table, source_word_column) in features.items():
+        index, report = align_words(reference, table[source_word_column].tolist(), band)
+        counts = report["operation"].value_counts().to_dict()
+        logging.info(f"Aligned {source} of story {story!r}: {len(table)} words onto {len(reference)}, "
+                     f"{int((index >= 0).sum())} mapped ({', '.join(f'{v} {k}' for k, v in counts.items()) or 'exact'})")
+        reports.append(report.assign(story=story, source=source))
+
+        values = table.drop(columns=[source_word_column]).reset_index(drop=True)
+        values = values[index >= 0].assign(_event=index[index >= 0])
+        methods = {c: agg.get(c, "mean" if pd.api.types.is_numeric_dtype(values[c]) else "first")
+                   for c in values.columns if c != "_event"}
+        mapped = values.groupby("_event").agg(methods)
+        clashes = [c for c in mapped.columns if c in events.columns]
+        if clashes:
+            raise ValueError(f"feature columns of {source!r} already in the event table: {clashes}")
+        events = events.join(mapped, how="left")
+
+    return events, pd.concat(reports, ignore_index=True) if reports else pd.DataFrame()
@@ -0,0 +1,445 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import inspect
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODE_DIRS = ("nlp_pipeline", "predictors")   # code every node may depend on (hashed into all signatures)
+
+# feature CSVs of a story written by the `feature_graph` nodes:
+# node step -> (file name, word column, feature columns (all if empty), read_csv options)
+FEATURE_FILES = {
+    "frequency": ("{story}.csv", "tokens_no_punct", ["Zipf_freq"], {"sep": ";", "decimal": ",", "encoding": "utf-8-sig"}),
+    "surprisal": ("suprisal{story}.csv", "word", [], {}),
+    "dissimilarity": ("dissimilarity_{story}.csv", "word", [], {}),
+}
+PREDICTOR_FEATURES = ["Zipf_freq", "surprisal", "entropy", "semantic_dissimilarity"]
+
+
+class Node:
+    """
+    One step of the build graph: `func(*args, **params)` reads `inputs` and writes `outputs`.
+
+    Parameters:
+        name (str): Unique node name (e.g. '01_03/surprisal').
+        func (Callable): Module-level function (it may run in a worker process).
+        args (Sequence): Positional arguments of `func`.
+        params (dict): Keyword arguments of `func`; they are part of the node signature.
+        inputs (Sequence[str]): Files read by the node.
+        outputs (Sequence[str]): Files written by the node.
+        deps (Sequence[str]): Names of nodes that must run first. Their outputs are
+            automatically added to the inputs.
+        versions (dict): Anything else the result depends on (model names, revisions, ...).
+        resources (dict): Keyword arguments of `func` that do not change its outputs
+            (caches, thread settings); they are not part of the node signature.
+    """
+
+    def __init__(self, name: str, func: Callable, args: Sequence = (), params: Optional[dict] = None,
+                 inputs: Sequence[str] = (), outputs: Sequence[str] = (), deps: Sequence[str] = (),
+                 versions: Optional[dict] = None, resources: Optional[dict] = None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.params = dict(params or {})
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.versions = dict(versions or {})
+        self.resources = dict(resources or {})
+
+
+class BuildGraph:
+    """
+    Incremental build of the study: text -> tokens -> features -> predictors -> trials.
+
+    Every node records a content hash of its inputs, its parameters, its versions, the
+    source code of its function and the code of the `CODE_DIRS` packages it builds on. On `run`, only nodes whose signature changed (or whose
+    outputs are missing) are rebuilt; independent nodes run in parallel.
+
+    Parameters:
+        state_path (str): JSON file where node signatures and file hashes are recorded.
+    """
+
+    def __init__(self, state_path: str):
+        self.state_path = state_path
+        self.nodes: Dict[str, Node] = {}
+        self.state = {"nodes": {}, "files": {}}
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def add(self, name: str, func: Callable, **kwargs) -> str:
+        """
+        Adds a node (see `Node` for the arguments) and returns its name.
+        """
+
+        if name in self.nodes:
+            raise ValueError(f"duplicate node: {name}")
+        self.nodes[name] = Node(name, func, **kwargs)
+        return name
+
+    def _file_hash(self, path: str) -> Optional[str]:
+        #hashes are reused while size and modification time are unchanged
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        cached = self.state["files"].get(path)
+        if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+            return cached["sha256"]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.state["files"][path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+        return h.hexdigest()
+
+    def _inputs(self, node: Node) -> List[str]:
+        return node.inputs + [p for dep in node.deps for p in self.nodes[dep].outputs]
+
+    def _code_hash(self) -> str:
+        #hash of every module of CODE_DIRS: the steps import each other (utils, cache, models,
+        #rendering, ...), so a change anywhere in them makes every node stale
+        h = hashlib.sha256()
+        for folder in CODE_DIRS:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(_ROOT, folder)):
+                dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+                for name in sorted(f for f in filenames if f.endswith(".py")):
+                    path = os.path.join(dirpath, name)
+                    h.update(f"{os.path.relpath(path, _ROOT)}:{self._file_hash(path)}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def signature(self, node: Node) -> str:
+        """
+        Content hash of everything the outputs of `node` depend on.
+        """
+
+        try:
+            source = inspect.getsourcefile(node.func)
+            code = self._file_hash(source) if source else None
+        except TypeError:
+            code = None
+        payload = {
+            "func": f"{node.func.__module__}.{node.func.__qualname__}",
+            "code": code,
+            "package": self._code_hash(),
+            "args": [str(a) for a in node.args],
+            "params": {k: str(v) for k, v in sorted(node.params.items())},
+            "versions": {k: str(v) for k, v in sorted(node.versions.items())},
+            "inputs": {p: self._file_hash(p) for p in sorted(self._inputs(node))},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_stale(self, node: Node) -> bool:
+        recorded = self.state["nodes"].get(node.name, {}).get("signature")
+        return recorded != self.signature(node) or not all(os.path.exists(p) for p in node.outputs)
+
+    def _order(self) -> List[str]:
+        #topological order (raises on cycles and unknown dependencies)
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"dependency cycle at node: {name}")
+            if name not in self.nodes:
+                raise ValueError(f"unknown dependency: {name}")
+            visiting.add(name)
+            for dep in self.nodes[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name)
+        return order
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def run(self, n_workers: int = 1, processes: bool = True, force: Sequence[str] = ()) -> Dict[str, str]:
+        """
+        Rebuilds the stale nodes, running independent nodes in parallel.
+
+        Parameters:
+            n_workers (int): Maximum number of nodes running at the same time.
+            processes (bool): Run nodes in worker processes (default) rather than threads.
+            force (Sequence[str]): Node names to rebuild even if they are up to date.
+
+        Returns:
+            Dict[str, str]: Status of every node: 'built', 'up to date', 'failed' or 'skipped'
+            (a dependency failed).
+
+        Notes:
+            - A node's signature is computed when its dependencies have finished, so it
+              reflects the content of the files they actually produced.
+            - The state file is updated after every finished node, so an interrupted run
+              resumes where it stopped.
+        """
+
+        order = self._order()
+        status: Dict[str, str] = {}
+        remaining = list(order)
+        running = {}
+        Executor = ProcessPoolExecutor if processes and n_workers > 1 else ThreadPoolExecutor
+
+        with Executor(max_workers=max(1, n_workers)) as pool:
+            while remaining or running:
+                for name in list(remaining):
+                    node = self.nodes[name]
+                    dep_status = [status.get(d) for d in node.deps]
+                    if any(s in ("failed", "skipped") for s in dep_status):
+                        status[name] = "skipped"
+                        remaining.remove(name)
+                        continue
+                    if any(s is None for s in dep_status):
+                        continue
+                    if name in force or self.is_stale(node):
+                        if len(running) >= max(1, n_workers):
+                            break
+                        logging.info(f"Building: {name}")
+                        future = pool.submit(node.func, *node.args, **node.params, **node.resources)
+                        running[future] = (name, time.time())
+                    else:
+                        status[name] = "up to date"
+                    remaining.remove(name)
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, started = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        status[name] = "failed"
+                        logging.error(f"Failed: {name}: {e!r}")
+                        continue
+                    status[name] = "built"
+                    self.state["nodes"][name] = {"signature": self.signature(self.nodes[name]),
+                                                 "seconds": round(time.time() - started, 3)}
+                    self._save_state()
+                    logging.info(f"Built: {name} ({time.time() - started:.1f}s)")
+
+        self._save_state()
+        return {name: status[name] for name in order}
+
+
+def feature_graph(text_files: Sequence[str], output_dir: str, state_path: str, cache_dir: Optional[str] = None,
+                  precision: str = "float32") -> BuildGraph:
+    """
+    Builds the graph of the three word-level feature producers for a set of stories.
+
+    For each text file, three independent nodes are added: '<story>/frequency'
+    (`processor.process_text_file`), '<story>/surprisal' (`surprisal.calculate_surprisal_entropy`)
+    and '<story>/dissimilarity' (`semantic_dissimilarity.calculate_semantic_dissimilarity`).
+    Event, predictor and trial nodes are added on top with `predictor_nodes` and `trial_nodes`
+    (text -> features -> events -> predictors -> trials); any other step can be attached with
+    `BuildGraph.add`, using these node names as `deps`.
+
+    Parameters:
+        text_files (Sequence[str]): Paths to the story .txt files.
+        output_dir (str): Root directory of the feature CSVs.
+        state_path (str): JSON state file of the build.
+        cache_dir (str, optional): Directory of a `FeatureCache` shared by the model nodes.
+        precision (str): Inference precision of the model nodes ('float32', 'int8', 'bfloat16';
+            see `nlp_pipeline.quantization`). It is part of their signature.
+
+    Returns:
+        BuildGraph: The graph, ready to `run`.
+    """
+
+    from nlp_pipeline import processor, semantic_dissimilarity, surprisal
+    from nlp_pipeline.lexicon import SUBTLEX_PATH
+
+    graph = BuildGraph(state_path)
+    resources = {"cache": _cache(cache_dir)} if cache_dir else {}
+    params = {"precision": precision} if precision != "float32" else {}  # float32 signatures are unchanged
+
+    for path in text_files:
+        story = os.path.splitext(os.path.basename(path))[0]
+        story_dir = os.path.join(output_dir, story)
+
+        graph.add(f"{story}/frequency", processor.process_text_file,
+                  args=(path, output_dir),
+                  inputs=[path] + ([SUBTLEX_PATH] if os.path.exists(SUBTLEX_PATH) else []),
+                  outputs=[os.path.join(story_dir, f"{story}.csv")],
+                  versions={"stanza": processor.STANZA_PROCESSORS})
+        graph.add(f"{story}/surprisal", surprisal.calculate_surprisal_entropy,
+                  args=(path, output_dir), params=params, resources=resources,
+                  inputs=[path],
+                  outputs=[os.path.join(story_dir, f"suprisal{story}.csv")],
+                  versions={"model": surprisal.MODEL_NAME, "revision": surprisal.REVISION})
+        graph.add(f"{story}/dissimilarity", semantic_dissimilarity.calculate_semantic_dissimilarity,
+                  args=(path, output_dir), params=params, resources=resources,
+                  inputs=[path],
+                  outputs=[os.path.join(story_dir, f"dissimilarity_{story}.csv")],
+                  versions={"model": semantic_dissimilarity.MODEL_NAME,
+                            "revision": semantic_dissimilarity.REVISION})
+    return graph
+
+
+def _read_table(path: str, **options) -> pd.DataFrame:
+    if path.endswith((".xlsx", ".xls")):
+        return pd.read_excel(path)
+    return pd.read_csv(path, **options)
+
+
+def _predictors_module():
+    #predictors/ is a script folder: its modules import each other directly
+    folder = os.path.join(_ROOT, "predictors")
+    if folder not in sys.path:
+        sys.path.append(folder)
+    import rendering
+    return rendering
+
+
+def story_events_step(onsets_path: str, feature_dir: str, story: str, out_path: str,
+                      word_column: str = "word"):
+    """
+    Writes the event table of a story: its feature CSVs (`FEATURE_FILES`, in `feature_dir`)
+    aligned onto its onset table (see `alignment.story_events`).
+    """
+
+    from nlp_pipeline.alignment import story_events
+
+    features = {}
+    for source, (pattern, source_word_column, columns, options) in FEATURE_FILES.items():
+        table = pd.read_csv(os.path.join(feature_dir, pattern.format(story=story)), **options)
+        features[source] = (table[[source_word_column] + columns] if columns else table, source_word_column)
+    events, report = story_events(_read_table(onsets_path), features, story, word_column=word_column)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    events.to_csv(out_path, index=False)
+    report.to_csv(os.path.splitext(out_path)[0] + "_mismatches.csv", index=False)
+    logging.info(f"Saved CSV: {out_path}")
+
+
+def predictors_step(events_path: str, story: str, out_dir: str, feature_columns: Sequence[str],
+                    bounds_path: Optional[str] = None, duration_s: Optional[float] = None,
+                    collision: str = "sum"):
+    """
+    Renders and saves the predictors of a story from its event table (see
+    `rendering.render_predictors`; one '<story>_<feature>.csv' per feature).
+    """
+
+    rendering = _predictors_module()
+    events = pd.read_csv(events_path)
+    events["story"] = events["story"].astype(str)
+    if duration_s is None:
+        duration_s = float(events["END"].max()) / rendering.AUDIO_FS + 1.0  # one second after the last word
+    bounds = {story: rendering.load_bounds(bounds_path)} if bounds_path else None
+    rendered = rendering.render_predictors(events, feature_columns, duration_s, bounds=bounds,
+                                           story_column="story", collision=collision)
+    rendering.save_predictors(rendered, feature_columns, out_dir)
+
+
+def trials_step(store_dir: str, predictor_files: Dict[str, Dict[str, str]], subjects: Dict[str, Sequence[str]],
+                n_trials: Optional[int] = None, trials_per_story: Optional[int] = None):
+    """
+    Adds the story predictors to a `TrialStore` (each stored once) and records the story
+    order of every subject.
+
+    Parameters:
+        predictor_files (dict): predictor -> story -> CSV of the rendered predictor.
+        subjects (dict): subject -> stories in presentation order.
+    """
+
+    _predictors_module()
+    import trial_store
+
+    store = trial_store.TrialStore(store_dir)
+    for predictor, files in predictor_files.items():
+        for story, path in files.items():
+            store.add_story(predictor, story, np.loadtxt(path, delimiter=",", ndmin=1))
+    for subject, stories in subjects.items():
+        store.add_subject(subject, stories, n_trials=n_trials or trial_store.NUM_TRIALS,
+                          trials_per_story=trials_per_story or trial_store.TRIALS_PER_STORY)
+    store.save()
+    logging.info(f"Saved trial store: {store_dir} ({len(predictor_files)} predictors, {len(subjects)} subjects)")
+
+
+def predictor_nodes(graph: BuildGraph, text_files: Sequence[str], output_dir: str, onset_files: Dict[str, str],
+                    predictors_dir: str, feature_columns: Sequence[str] = PREDICTOR_FEATURES,
+                    bounds_files: Optional[Dict[str, str]] = None, durations: Optional[Dict[str, float]] = None,
+                    collision: str = "sum") -> List[str]:
+    """
+    Adds the event and predictor nodes of every story on top of `feature_graph`:
+    '<story>/events' (features aligned onto the onsets, `<output_dir>/<story>/events_<story>.csv`)
+    and '<story>/predictors' (one CSV per feature in `predictors_dir`).
+
+    Parameters:
+        onset_files (dict): story -> onset table of the forced aligner (.csv or .xlsx, with
+            'word', 'BEGIN' and 'END').
+        feature_columns (Sequence[str]): Event-table columns rendered as predictors.
+        bounds_files (dict, optional): story -> first/last word file (see `rendering.load_bounds`).
+        durations (dict, optional): story -> stimulus duration in seconds (default: one second
+            after the last word).
+
+    Returns:
+        List[str]: The predictor nodes (dependencies of `trial_nodes`).
+    """
+
+    rendering_path = os.path.join(_ROOT, "predictors", "rendering.py")
+    alignment_path = os.path.join(_ROOT, "nlp_pipeline", "alignment.py")
+    nodes = []
+    for path in text_files:
+        story = os.path.splitext(os.path.basename(path))[0]
+        story_dir = os.path.join(output_dir, story)
+        events_path = os.path.join(story_dir, f"events_{story}.csv")
+        graph.add(f"{story}/events", story_events_step,
+                  args=(onset_files[story], story_dir, story, events_path),
+                  inputs=[onset_files[story], alignment_path],
+                  outputs=[events_path, os.path.splitext(events_path)[0] + "_mismatches.csv"],
+                  deps=[f"{story}/{step}" for step in FEATURE_FILES])
+        bounds_path = (bounds_files or {}).get(story)
+        nodes.append(graph.add(f"{story}/predictors", predictors_step,
+                               args=(events_path, story, predictors_dir),
+                               params={"feature_columns": list(feature_columns), "bounds_path": bounds_path,
+                                       "duration_s": (durations or {}).get(story), "collision": collision},
+                               inputs=[rendering_path] + ([bounds_path] if bounds_path else []),
+                               outputs=[os.path.join(predictors_dir, f"{story}_{feature}.csv")
+                                        for feature in feature_columns],
+                               deps=[f"{story}/events"]))
+    return nodes
+
+
+def trial_nodes(graph: BuildGraph, subjects: Dict[str, Sequence[str]], predictors_dir: str, store_dir: str,
+                feature_columns: Sequence[str] = PREDICTOR_FEATURES, n_trials: Optional[int] = None,
+                trials_per_story: Optional[int] = None) -> str:
+    """
+    Adds the 'trials' node: the predictors of `predictor_nodes` stored in one `TrialStore`
+    with the story order of every subject (read with `TrialStore(store_dir).trials(subject, predictor)`).
+
+    A single node writes the store, whose index is shared by all predictors and subjects.
+
+    Parameters:
+        subjects (dict): subject -> stories in presentation order.
+    """
+
+    stories = list(dict.fromkeys(story for order in subjects.values() for story in order))
+    files = {feature: {story: os.path.join(predictors_dir, f"{story}_{feature}.csv") for story in stories}
+             for feature in feature_columns}
+    return graph.add("trials", trials_step,
+                     args=(store_dir, files, {str(k): list(v) for k, v in subjects.items()}),
+                     params={"n_trials": n_trials, "trials_per_story": trials_per_story},
+                     inputs=[os.path.join(_ROOT, "predictors", "trial_store.py")],
+                     outputs=[os.path.join(store_dir, "index.json")],
+                     deps=[f"{story}/predictors" for story in stories])
+
+
+def _cache(cache_dir: str):
+    from nlp_pipeline.cache import FeatureCache
+    return FeatureCache(cache_dir)
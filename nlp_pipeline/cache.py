@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+CACHE_DIR = os.environ.get("NLP_PIPELINE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "nlp_pipeline"))
+MAX_BYTES = 20 * 1024 ** 3  # 20 GB
+
+META_FILE = "meta.json"
+TOKENS_FILE = "tokens.json"
+
+
+def cache_key(text: str, model_name: str, revision: Optional[str] = None, tokenizer_settings: Optional[dict] = None) -> str:
+    """
+    Builds the cache key of a text encoded by a given model.
+
+    Parameters:
+        text (str): Input text, exactly as fed to the tokenizer (i.e. after the pipeline's
+            newline normalization). It is not passed through `normalize_text`: the cached tokens
+            are those of this exact text, so two texts that only normalize alike must not share
+            an entry.
+        model_name (str): Hugging Face model name or local model directory.
+        revision (str, optional): Model revision (commit hash or branch). Default 'main'.
+        tokenizer_settings (dict, optional): Every setting that changes what is computed
+            (e.g. max_length, stride, window parameters).
+
+    Returns:
+        str: Hex SHA-256 digest identifying the cache entry.
+    """
+
+    h = hashlib.sha256()
+    h.update(text.encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps({"model": model_name,
+                         "revision": revision or "main",
+                         "settings": tokenizer_settings or {}}, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class FeatureCache:
+    """
+    Persistent on-disk cache of per-token model outputs (hidden states, next-token statistics).
+
+    Each entry is a directory named after its key (see `cache_key`) holding one .npy file per
+    array, the token strings (tokens.json) and metadata (meta.json). Arrays are returned as
+    read-only memory maps, so downstream computations only page in the slices they use
+    (e.g. the last 4 layers of the hidden states).
+
+    When the total size exceeds `max_bytes`, the least recently used entries are evicted.
+
+    Parameters:
+        root (str): Cache directory. Defaults to $NLP_PIPELINE_CACHE or ~/.cache/nlp_pipeline.
+        max_bytes (int): Maximum total size of the cache in bytes (default 20 GB).
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> Optional[Dict[str, object]]:
+        """
+        Returns the cached entry for `key`, or None if it is not cached.
+
+        The returned dict maps each array name to a read-only `np.memmap`, plus
+        'tokens' (List[str]) and 'meta' (dict).
+        """
+
+        entry = self._load(key)
+        if entry is not None:
+            try:
+                os.utime(os.path.join(self._path(key), META_FILE))  # mark as recently used
+            except FileNotFoundError:
+                return None  # evicted by another worker in the meantime
+            logging.info(f"Cache hit: {key[:12]} ({entry['meta'].get('model')})")
+        return entry
+
+    def _load(self, key: str) -> Optional[Dict[str, object]]:
+        #None if the entry is missing, or is removed (evicted by another worker) while it is read
+        path = self._path(key)
+        meta_path = os.path.join(path, META_FILE)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(os.path.join(path, TOKENS_FILE), "r", encoding="utf-8") as f:
+                tokens = json.load(f)
+            entry: Dict[str, object] = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                                        for name in meta["arrays"]}
+        except FileNotFoundError:
+            return None
+        entry["tokens"] = tokens
+        entry["meta"] = meta
+        return entry
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray], tokens: List[str], meta: Optional[dict] = None) -> Optional[Dict[str, object]]:
+        """
+        Stores the arrays and tokens of an entry and returns it as memory maps (see `get`), or
+        None if another worker has already evicted it.
+
+        The entry is written to a temporary directory first and moved into place atomically,
+        so concurrent workers never read a partially written entry.
+        """
+
+        meta = dict(meta or {})
+        meta["arrays"] = sorted(arrays)
+        meta["created"] = time.time()
+
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        try:
+            for name, arr in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(arr))
+            with open(os.path.join(tmp, TOKENS_FILE), "w", encoding="utf-8") as f:
+                json.dump(list(tokens), f, ensure_ascii=False)
+            meta["nbytes"] = sum(os.path.getsize(os.path.join(tmp, n)) for n in os.listdir(tmp))
+            with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            try:
+                os.rename(tmp, self._path(key))
+            except OSError:
+                # another worker stored the same entry in the meantime
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        self.evict(keep=key)
+        return self._load(key)
+
+    def entries(self) -> List[dict]:
+        """
+        Lists the cache entries as dicts with 'key', 'nbytes' and 'last_access' (oldest first).
+        """
+
+        out = []
+        for key in os.listdir(self.root):
+            meta_path = os.path.join(self._path(key), META_FILE)
+            if key.startswith("."):
+                continue
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    nbytes = json.load(f).get("nbytes", 0)
+                out.append({"key": key, "nbytes": nbytes, "last_access": os.path.getmtime(meta_path)})
+            except FileNotFoundError:
+                continue  # incomplete, or evicted by another worker
+        return sorted(out, key=lambda e: e["last_access"])
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        Removes least recently used entries until the cache fits in `max_bytes`.
+
+        Parameters:
+            keep (str, optional): Key that must not be evicted (e.g. the entry just written).
+        """
+
+        entries = self.entries()
+        total = sum(e["nbytes"] for e in entries)
+        for e in entries:
+            if total <= self.max_bytes:
+                break
+            if e["key"] == keep:
+                continue
+            shutil.rmtree(self._path(e["key"]), ignore_errors=True)
+            total -= e["nbytes"]
+            logging.info(f"Cache evicted: {e['key'][:12]}")
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import threading
+import contextvars
+from typing import Dict, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# JSONL trace of the stage events; set (by `enable`, or by hand) to trace worker processes too
+TRACE_ENV = "NLP_PIPELINE_TRACE"
+# directory of the per-stage cProfile dumps (optional)
+PROFILE_ENV = "NLP_PIPELINE_PROFILE"
+PROFILE_STAGES_ENV = "NLP_PIPELINE_PROFILE_STAGES"   # comma-separated stages to profile (default: all)
+
+_state = {"trace": os.environ.get(TRACE_ENV) or None,
+          "profile_dir": os.environ.get(PROFILE_ENV) or None,
+          "profile_stages": set(filter(None, os.environ.get(PROFILE_STAGES_ENV, "").split(",")))}
+_lock = threading.Lock()
+_handle = {"pid": None, "file": None}
+_profiles: Dict[str, cProfile.Profile] = {}
+_profiling = {"active": False}
+_item = contextvars.ContextVar("trace_item", default=None)
+_depth = contextvars.ContextVar("trace_depth", default=0)
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 2 ** 20 if hasattr(os, "sysconf") else 0.0
+
+
+def enabled() -> bool:
+    return _state["trace"] is not None
+
+
+def enable(trace_path: str, profile_dir: Optional[str] = None, profile_stages: Optional[Sequence[str]] = None):
+    """
+    Starts recording stage events to a JSONL trace (appended), in this process and in the
+    worker processes it starts afterwards (through environment variables).
+
+    Parameters:
+        trace_path (str): JSONL file of the events (see `stage`).
+        profile_dir (str, optional): Also profile the stages with cProfile, one pstats dump per
+            stage and process (`<stage>.<pid>.prof`, for `pstats`, snakeviz or flameprof).
+        profile_stages (Sequence[str], optional): Stages to profile (default: all). Profiling
+            is costly: restrict it to the stage under investigation.
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+    _state.update(trace=trace_path, profile_dir=profile_dir, profile_stages=set(profile_stages or ()))
+    os.environ[TRACE_ENV] = trace_path
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        os.environ[PROFILE_ENV] = profile_dir
+        os.environ[PROFILE_STAGES_ENV] = ",".join(profile_stages or ())
+
+
+def disable():
+    """
+    Stops recording (in this process and in workers started afterwards).
+    """
+
+    _state.update(trace=None, profile_dir=None, profile_stages=set())
+    for var in (TRACE_ENV, PROFILE_ENV, PROFILE_STAGES_ENV):
+        os.environ.pop(var, None)
+    _close()
+
+
+def _close():
+    with _lock:
+        if _handle["file"] is not None and _handle["pid"] == os.getpid():
+            _handle["file"].close()
+        _handle.update(pid=None, file=None)
+
+
+atexit.register(_close)
+
+
+def _write(event: dict):
+    line = json.dumps(event) + "\n"
+    with _lock:
+        #one handle per process (a forked worker reopens its own), appending whole lines
+        if _handle["pid"] != os.getpid():
+            _handle.update(pid=os.getpid(), file=open(_state["trace"], "a", encoding="utf-8", buffering=1))
+        _handle["file"].write(line)
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, IndexError, ValueError):
+        return float("nan")
+
+
+def _peak_rss_mb() -> float:
+    #peak resident memory of the process so far (ru_maxrss is in kB on Linux, bytes on macOS)
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class _Stage:
+    """
+    One running stage: measures wall time, CPU time and memory, and writes its event on exit.
+    """
+
+    __slots__ = ("name", "item", "counts", "_wall", "_cpu", "_start", "_tokens", "_profile")
+
+    def __init__(self, name: str, item: Optional[str], counts: Dict[str, float]):
+        self.name = name
+        self.item = item
+        self.counts = dict(counts)
+
+    def add(self, **counts):
+        """
+        Adds processed units (tokens=..., words=..., samples=...) to the event.
+        """
+
+        for unit, n in counts.items():
+            self.counts[unit] = self.counts.get(unit, 0) + n
+
+    def __enter__(self):
+        self._tokens = (_item.set(self.item) if self.item is not None else None, _depth.set(_depth.get() + 1))
+        self._profile = None
+        stages = _state["profile_stages"]
+        if _state["profile_dir"] and not _profiling["active"] and (not stages or self.name in stages):
+            #one profiler at a time: nested stages are included in the outer stage's profile
+            self._profile = _profiles.setdefault(self.name, cProfile.Profile())
+            _profiling["active"] = True
+            self._profile.enable()
+        self._start = time.time()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        if self._profile is not None:
+            self._profile.disable()
+            _profiling["active"] = False
+            self._profile.dump_stats(os.path.join(_state["profile_dir"], f"{self.name}.{os.getpid()}.prof"))
+        item_token, depth_token = self._tokens
+        _depth.reset(depth_token)
+        if item_token is not None:
+            _item.reset(item_token)
+
+        event = {"stage": self.name, "item": self.item if self.item is not None else _item.get(),
+                 "pid": os.getpid(), "depth": _depth.get(), "start": round(self._start, 6),
+                 "wall_s": wall, "cpu_s": cpu, "rss_mb": _rss_mb(), "peak_rss_mb": _peak_rss_mb(),
+                 **self.counts, **{f"{unit}_per_s": n / wall if wall > 0 else None for unit, n in self.counts.items()}}
+        if exc_type is not None:
+            event["error"] = exc_type.__name__
+        _write(event)
+        return False
+
+
+class _Off:
+    """
+    Stand-in for `_Stage` while tracing is off: no clock, no I/O.
+    """
+
+    __slots__ = ()
+
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_OFF = _Off()
+
+
+def stage(name: str, item: Optional[str] = None, **counts):
+    """
+    Context manager recording one stage event (one JSON line of the trace) when tracing is on.
+
+    Usage:
+        with stage("model_forward", item=filepath, tokens=n_tokens) as s:
+            ...
+            s.add(words=n_words)   # units known only at the end
+
+    Each event has 'stage', 'item' (file, subject/predictor...; default: that of the enclosing
+    `trace_item` or stage), 'pid', 'depth' (0 for outermost stages), 'start' (epoch s),
+    'wall_s', 'cpu_s' (CPU time of the whole process, all threads), 'rss_mb', 'peak_rss_mb'
+    (process peak so far), the processed units and their throughput ('<unit>_per_s'), and
+    'error' if the stage raised.
+
+    Notes:
+        - While tracing is off, a shared no-op object is returned: the cost is one function
+          call and one attribute lookup.
+    """
+
+    if _state["trace"] is None:
+        return _OFF
+    return _Stage(name, item, counts)
+
+
+def trace_item(item: str):
+    """
+    Context manager setting the item (e.g. the file) of the stage events recorded inside it.
+    """
+
+    if _state["trace"] is None:
+        return _OFF
+    return _Item(item)
+
+
+class _Item:
+    __slots__ = ("item", "_token")
+
+    def __init__(self, item: str):
+        self.item = item
+
+    def __enter__(self):
+        self._token = _item.set(self.item)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _item.reset(self._token)
+        return False
+
+
+def read_trace(path: str):
+    """
+    Returns the events of a trace as a DataFrame (one row per event).
+    """
+
+    import pandas as pd
+
+    with open(path, "r", encoding="utf-8") as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summarize(path: str):
+    """
+    Per-stage totals of a trace, to find the stage that dominates a run.
+
+    Returns:
+        pd.DataFrame: One row per stage (sorted by wall time): 'events', 'items', 'wall_s',
+        'cpu_s', 'share' (of the wall time of the stages at the same depth), 'max_wall_s',
+        'peak_rss_mb', and for every unit its total and overall throughput ('<unit>_per_s').
+    """
+
+    import pandas as pd
+
+    events = read_trace(path)
+    if events.empty:
+        return pd.DataFrame()
+    units = [c for c in events.columns if f"{c}_per_s" in events.columns]
+    grouped = events.groupby("stage")
+    summary = pd.DataFrame({"depth": grouped["depth"].min(), "events": grouped.size(),
+                            "items": grouped["item"].nunique(), "wall_s": grouped["wall_s"].sum(),
+                            "cpu_s": grouped["cpu_s"].sum(), "max_wall_s": grouped["wall_s"].max(),
+                            "peak_rss_mb": grouped["peak_rss_mb"].max()})
+    summary["share"] = summary["wall_s"] / summary.groupby("depth")["wall_s"].transform("sum")
+    for unit in units:
+        timed = events[events[unit].notna()].groupby("stage")
+        summary[unit] = grouped[unit].sum(min_count=1)
+        summary[f"{unit}_per_s"] = timed[unit].sum() / timed["wall_s"].sum()
+    return summary.sort_values("wall_s", ascending=False)
@@ -0,0 +1,247 @@
+import os
+import json
+import shutil
+import contextlib
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Sequence, Tuple
+from nlp_pipeline.cache import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+SUBTLEX_PATH = "PATH"  # SUBTLEX-IT norms (Excel file with 'wordform' and 'zipf' columns)
+LEXICON_DIR = os.environ.get("NLP_PIPELINE_LEXICON", os.path.join(CACHE_DIR, "subtlex_it"))
+
+# lookup steps, tried in the given order until a word is found
+FALLBACK_ORDER = ("exact", "lower", "lemma")
+SOURCES = ("missing", "exact", "lower", "lemma")  # codes returned by `Lexicon.lookup`
+
+_LEXICONS = {}  # one shared read-only lexicon per directory and process
+
+
+def _encode(words: Sequence[str]) -> np.ndarray:
+    """
+    Encodes strings as a fixed-width UTF-8 byte array (sortable, memory-mappable).
+    """
+
+    encoded = [str(w).encode("utf-8") for w in words]
+    width = max((len(w) for w in encoded), default=1) or 1
+    return np.asarray(encoded, dtype=f"S{width}")
+
+
+def _sorted_table(words: np.ndarray, values: np.ndarray, keep: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sorts a (word, value) table and removes duplicate words, keeping the 'last' value
+    (like building a dict) or the 'max' value.
+    """
+
+    if keep == "max":
+        order = np.lexsort((values, words))  # by word, then by value
+    else:
+        order = np.argsort(words, kind="stable")
+    words, values = words[order], values[order]
+    last = np.ones(len(words), dtype=bool)
+    last[:-1] = words[1:] != words[:-1]
+    return words[last], values[last]
+
+
+def compile_lexicon(source_path: str = SUBTLEX_PATH,
+                    out_dir: str = LEXICON_DIR,
+                    word_column: str = "wordform",
+                    value_column: str = "zipf") -> str:
+    """
+    Compiles the SUBTLEX-IT norms once into a compact binary store.
+
+    The store holds two sorted string tables (exact wordforms, and lowercased wordforms)
+    with matching arrays of Zipf values, saved as .npy files that are memory-mapped
+    read-only by every worker.
+
+    Parameters:
+        source_path (str): Path to the SUBTLEX-IT Excel (or CSV) file.
+        out_dir (str): Directory of the compiled store.
+        word_column (str): Column with the wordforms (default 'wordform').
+        value_column (str): Column with the Zipf values (default 'zipf').
+
+    Returns:
+        str: `out_dir`.
+
+    Notes:
+        - Duplicate wordforms keep their last value (as the previous dict-based mapping did);
+          lowercased duplicates keep the highest value.
+    """
+
+    logging.info(f"Compiling lexicon: {source_path}")
+    if source_path.endswith(".csv"):
+        df = pd.read_csv(source_path)
+    else:
+        df = pd.read_excel(source_path)
+    df = df.dropna(subset=[word_column])
+
+    raw = df[word_column].astype(str).to_numpy()
+    values = df[value_column].to_numpy(dtype=np.float64)
+    exact_words, exact_values = _sorted_table(_encode(raw), values, keep="last")
+    lower_words, lower_values = _sorted_table(_encode([w.lower() for w in raw]), values, keep="max")
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_dir)), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(os.path.abspath(out_dir)))
+    np.save(os.path.join(tmp, "exact_words.npy"), exact_words)
+    np.save(os.path.join(tmp, "exact_values.npy"), exact_values)
+    np.save(os.path.join(tmp, "lower_words.npy"), lower_words)
+    np.save(os.path.join(tmp, "lower_values.npy"), lower_values)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(source_path),
+                   "source_mtime": os.path.getmtime(source_path),
+                   "n_entries": int(len(exact_words))}, f)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    try:
+        os.rename(tmp, out_dir)
+    except OSError:
+        #another process compiled the store at the same time: keep its copy
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(os.path.join(out_dir, "meta.json")):
+            raise
+        logging.info(f"Lexicon compiled concurrently by another process: {out_dir}")
+        return out_dir
+    logging.info(f"Saved lexicon: {out_dir} ({len(exact_words)} entries)")
+    return out_dir
+
+
+class Lexicon:
+    """
+    Read-only, memory-mapped frequency lexicon with vectorized lookups.
+
+    Parameters:
+        path (str): Directory of a store built by `compile_lexicon`.
+    """
+
+    def __init__(self, path: str = LEXICON_DIR):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._tables = {
+            name: (np.load(os.path.join(path, f"{name}_words.npy"), mmap_mode="r"),
+                   np.load(os.path.join(path, f"{name}_values.npy"), mmap_mode="r"))
+            for name in ("exact", "lower")
+        }
+
+    def __len__(self) -> int:
+        return self.meta["n_entries"]
+
+    def _search(self, table: str, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        words, values = self._tables[table]
+        out = np.full(len(queries), np.nan)
+        if len(queries) == 0 or len(words) == 0:
+            return out, np.zeros(len(queries), dtype=bool)
+        idx = np.searchsorted(words, queries).clip(max=len(words) - 1)
+        found = words[idx] == queries
+        out[found] = values[idx[found]]
+        return out, found
+
+    def lookup(self,
+               words: Sequence[str],
+               lemmas: Optional[Sequence[str]] = None,
+               order: Sequence[str] = FALLBACK_ORDER) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Looks up the values of a whole array of words at once.
+
+        Parameters:
+            words (Sequence[str]): Wordforms to look up.
+            lemmas (Sequence[str], optional): Lemma of each word, required for the 'lemma' step.
+            order (Sequence[str]): Lookup steps tried in order until a word is found:
+                'exact' (wordform as given), 'lower' (lowercased wordform, against the
+                lowercased table) and 'lemma' (lemma as given, then lowercased).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]:
+                - Values (float, NaN when not found).
+                - Source of each value, as an index into `SOURCES` (0 = missing).
+        """
+
+        if any(step not in SOURCES[1:] for step in order):
+            raise ValueError("order may only contain 'exact', 'lower' and 'lemma'")
+        if "lemma" in order and lemmas is None:
+            raise ValueError("lemmas are required for the 'lemma' lookup step")
+
+        words = [str(w) for w in words]
+        values = np.full(len(words), np.nan)
+        source = np.zeros(len(words), dtype=np.int8)
+
+        for step in order:
+            todo = np.flatnonzero(source == 0)
+            if len(todo) == 0:
+                break
+            if step == "exact":
+                found_vals, found = self._search("exact", _encode([words[i] for i in todo]))
+            elif step == "lower":
+                found_vals, found = self._search("lower", _encode([words[i].lower() for i in todo]))
+            else:
+                todo_lemmas = [str(lemmas[i]) for i in todo]
+                found_vals, found = self._search("exact", _encode(todo_lemmas))
+                lower_vals, lower_found = self._search("lower", _encode([l.lower() for l in todo_lemmas]))
+                found_vals = np.where(found, found_vals, lower_vals)
+                found |= lower_found
+            values[todo[found]] = found_vals[found]
+            source[todo[found]] = SOURCES.index(step)
+
+        return values, source
+
+
+def coverage(source: np.ndarray) -> Dict[str, float]:
+    """
+    Summarizes lookup results: number of words, proportion found, and proportion per source.
+    """
+
+    n = len(source)
+    stats = {"n_words": n, "coverage": float(np.mean(source > 0)) if n else float("nan")}
+    for code, name in enumerate(SOURCES):
+        stats[name] = float(np.mean(source == code)) if n else float("nan")
+    return stats
+
+
+def get_lexicon(path: str = LEXICON_DIR, source_path: str = SUBTLEX_PATH) -> Lexicon:
+    """
+    Returns the process-wide lexicon, compiling the store first if it is missing or older
+    than the source norms.
+    """
+
+    if path not in _LEXICONS:
+        if _is_stale(path, source_path):
+            #workers starting together compile once: the others wait for the lock, then find the store
+            with _lock(path):
+                if _is_stale(path, source_path):
+                    compile_lexicon(source_path, path)
+        _LEXICONS[path] = Lexicon(path)
+    return _LEXICONS[path]
+
+
+def _is_stale(path: str, source_path: str) -> bool:
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return True
+    if not os.path.exists(source_path):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)["source_mtime"] < os.path.getmtime(source_path)
+
+
+@contextlib.contextmanager
+def _lock(path: str):
+    #exclusive lock file next to the store (no locking where fcntl is unavailable)
+    lock_path = os.path.abspath(path) + ".lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
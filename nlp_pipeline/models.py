@@ -0,0 +1,150 @@
+import os
+import logging
+from typing import Optional
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+# local directory with pre-downloaded models, for workers without network access
+MODEL_DIR = os.environ.get("NLP_PIPELINE_MODEL_DIR")
+
+_REGISTRY = {}  # one shared instance per model and process
+
+
+def resolve_model_path(model_name: str, model_dir: Optional[str] = None) -> str:
+    """
+    Returns the local copy of a Hugging Face model if one exists, otherwise the model name.
+
+    A model 'org/name' is looked up in `model_dir` (default: $NLP_PIPELINE_MODEL_DIR) as
+    'org/name' or 'org--name' (the layout of `huggingface-cli download --local-dir`).
+
+    Parameters:
+        model_name (str): Hugging Face model name or path to a model directory.
+        model_dir (str, optional): Directory with pre-downloaded models.
+
+    Returns:
+        str: Path to the local model directory, or `model_name` unchanged.
+    """
+
+    model_dir = model_dir or MODEL_DIR
+    if os.path.isdir(model_name) or not model_dir:
+        return model_name
+    for candidate in (model_name, model_name.replace("/", "--")):
+        path = os.path.join(model_dir, candidate)
+        if os.path.isdir(path):
+            return path
+    return model_name
+
+
+def get_stanza_pipeline(lang: str = "it",
+                        processors: str = "tokenize,mwt,pos,lemma",
+                        model_dir: Optional[str] = None,
+                        use_gpu: bool = False,
+                        **kwargs):
+    """
+    Returns the process-wide Stanza pipeline for a language, creating it on first use.
+
+    Parameters:
+        lang (str): Language code (default 'it').
+        processors (str): Comma-separated Stanza processors.
+        model_dir (str, optional): Directory with pre-downloaded Stanza resources. When set
+            (or when $NLP_PIPELINE_MODEL_DIR is set) nothing is downloaded.
+        use_gpu (bool): Whether Stanza may use the GPU (default False).
+        **kwargs: Further `stanza.Pipeline` options (e.g. `tokenize_batch_size`, `pos_batch_size`).
+
+    Returns:
+        stanza.Pipeline: The shared pipeline.
+
+    Notes:
+        - Without a local model directory, missing resources are downloaded once into
+          Stanza's default resource directory and reused afterwards.
+    """
+
+    key = ("stanza", lang, processors, use_gpu, tuple(sorted(kwargs.items())))
+    if key not in _REGISTRY:
+        import stanza
+
+        model_dir = model_dir or MODEL_DIR
+        #only download resources that are missing (never re-check resources.json per worker)
+        options = dict(processors=processors, use_gpu=use_gpu,
+                       download_method=stanza.DownloadMethod.REUSE_RESOURCES, **kwargs)
+        if model_dir:
+            options.update(dir=os.path.join(model_dir, "stanza"), download_method=None)
+        logging.info(f"Loading Stanza pipeline: {lang} ({processors})")
+        _REGISTRY[key] = stanza.Pipeline(lang, **options)
+    return _REGISTRY[key]
+
+
+def get_tokenizer(model_name: str, revision: str = "main", model_dir: Optional[str] = None):
+    """
+    Returns the process-wide Hugging Face tokenizer for a model, loading it on first use.
+    """
+
+    key = ("tokenizer", model_name, revision)
+    if key not in _REGISTRY:
+        from transformers import AutoTokenizer
+
+        path = resolve_model_path(model_name, model_dir)
+        _REGISTRY[key] = AutoTokenizer.from_pretrained(path, revision=revision,
+                                                       local_files_only=path != model_name)
+    return _REGISTRY[key]
+
+
+def get_model(model_name: str,
+              kind: str = "causal",
+              revision: str = "main",
+              model_dir: Optional[str] = None,
+              device=None,
+              precision: str = "float32"):
+    """
+    Returns the process-wide Hugging Face model, loading it on first use.
+
+    The model is moved to `device` and set to evaluation mode (no dropout, etc.).
+    With `precision` 'int8' or 'bfloat16' it is converted for CPU inference (see
+    `nlp_pipeline.quantization.quantize_model`, with the thread settings of
+    `configure_threads`); each precision is a separate instance. int8 is experimental: it
+    logs a warning, since its measured speedup is below `quantization.TARGET_SPEEDUP`.
+
+    Parameters:
+        model_name (str): Hugging Face model name or path to a model directory.
+        kind (str): 'causal' (AutoModelForCausalLM) or 'encoder' (AutoModel with hidden states).
+        revision (str): Model revision (default 'main').
+        model_dir (str, optional): Directory with pre-downloaded models (see `resolve_model_path`).
+        device (torch.device, optional): Defaults to CUDA when available, else CPU (always CPU
+            for 'int8').
+        precision (str): 'float32' (default), 'int8' or 'bfloat16'.
+
+    Returns:
+        The shared model instance.
+    """
+
+    if kind not in {"causal", "encoder"}:
+        raise ValueError("kind must be 'causal' or 'encoder'")
+
+    import torch
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() and precision != "int8" else "cpu")
+
+    key = ("model", model_name, kind, revision, str(device), precision)
+    if key not in _REGISTRY:
+        from transformers import AutoModel, AutoModelForCausalLM
+
+        path = resolve_model_path(model_name, model_dir)
+        options = dict(revision=revision, local_files_only=path != model_name)
+        logging.info(f"Loading model: {model_name} ({kind}, {precision}) on {device}")
+        if kind == "causal":
+            model = AutoModelForCausalLM.from_pretrained(path, **options)
+        else:
+            model = AutoModel.from_pretrained(path, output_hidden_states=True, **options)
+        model.to(device)
+        model.eval()
+        if precision != "float32":
+            from nlp_pipeline.quantization import MEASURED_SPEEDUP, TARGET_SPEEDUP, configure_threads, quantize_model
+            if precision in MEASURED_SPEEDUP:
+                low, high = MEASURED_SPEEDUP[precision]
+                logging.warning(f"{precision} is experimental: measured {low:g}-{high:g}x float32 CPU throughput, "
+                                f"below the {TARGET_SPEEDUP:g}x target (see quantization.validate_precision)")
+            if torch.device(device).type == "cpu":
+                configure_threads()  # one inter-op thread; intra-op threads as set by the caller
+            model = quantize_model(model, precision)
+        _REGISTRY[key] = model
+    return _REGISTRY[key]
@@ -1,44 +1,43 @@
 import os
+import glob
 import logging
 import string
 import pandas as pd
-import stanza
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence, Tuple
+from nlp_pipeline.instrumentation import stage, trace_item
+from nlp_pipeline.lexicon import LEXICON_DIR, SUBTLEX_PATH, Lexicon, coverage, get_lexicon
+from nlp_pipeline.models import get_stanza_pipeline
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
-stanza.download("it")
-nlp = stanza.Pipeline("it", processors="tokenize, mwt, pos, lemma, ", use_gpu=False)
+STANZA_PROCESSORS = "tokenize,mwt,pos,lemma"
 
-def process_text_file(filepath, output_dir): 
-    """
-    Processes a single text file using the Stanza NLP pipeline and extracts linguistic features.
+# Stanza batch sizes for corpus mode (tokens per batch for tokenize, words per batch for pos)
+TOKENIZE_BATCH_SIZE = 64
+POS_BATCH_SIZE = 3000
+DOCS_PER_BATCH = 16  # documents sent to Stanza in one bulk call
 
-    For each input file, a dedicated subfolder is created (named after the file, e.g. '01_03') 
-    where all outputs are saved.
+FUNCTION_POS = {"ADP", "AUX", "CCONJ", "SCONJ", "DET", "PRON", "PART", "INTJ", "ADV"}
+CONTENT_POS = {"NOUN", "VERB", "ADJ", "PROPN"}
+OUTPUT_COLUMNS = ["token_id", "sentence_ids", "tokens_no_punct", "lemma_no_punct", "PoS", "depparse", "head", "constituency", "AoA(m+sd)", "Zipf_freq", "type_of_words"]
 
-    Parameters:
-        filepath (str): Path to the input .txt file.
-        output_dir (str): Root directory where output subfolders will be created.
-
-    Outputs:
-        - A CSV file containing token-level linguistic features:
-          sentence ID, token, lemma, PoS,  cleaned token/lemma, and SUBTLEX-IT Zipf frequency.
-
-        
-
-    Notes:
-        - Output filenames are automatically derived from the input filename.
-        - Constituency parsing is included if available in the sentence object.
-        - AoA and frequency values are mapped from external normative datasets.
-        - Logging messages indicate where each output file is saved.
 
+def doc_to_dataframe(doc, lexicon: Lexicon, freq_fallback: Sequence[str] = ("exact",)) -> Tuple[pd.DataFrame, Dict[str, float]]:
     """
-    logging.info(f"Processing file: {filepath}")
+    Extracts the token-level feature table from a processed Stanza document.
 
-    with open(filepath, "r", encoding="utf-8") as infile:
-        text = infile.read()
+    Parameters:
+        doc (stanza.Document): Document processed by the Stanza pipeline.
+        lexicon (Lexicon): Frequency lexicon (see `nlp_pipeline.lexicon`).
+        freq_fallback (Sequence[str]): Lookup order for the Zipf frequency.
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, float]]:
+            - The feature table, one row per non-punctuation token (columns `OUTPUT_COLUMNS`).
+            - Lexicon coverage statistics.
+    """
 
-    doc = nlp(text)
     sentence_ids, tokens, PoS, lemma, clean_tokens, clean_lemmas, raw_tokens = [], [], [], [], [], [], []
     for sent_id, sentence in enumerate(doc.sentences):
         for token in sentence.tokens:
@@ -55,40 +54,197 @@ def process_text_file(filepath, output_dir):
                 PoS.append(word.pos)
               
 
-    subtlex_df = pd.read_excel('PATH')
-    subtlex_df["zipf"] = subtlex_df["zipf"]
-    freq_dict = subtlex_df.set_index("wordform")["zipf"].to_dict()
-
     df = pd.DataFrame({
         "sentence_ids": sentence_ids,
         "tokens_no_punct": clean_tokens, 
         "lemma_no_punct": clean_lemmas,
         "PoS": PoS
     })
-    
 
-    function_pos = {"ADP", "AUX", "CCONJ", "SCONJ", "DET", "PRON", "PART", "INTJ", "ADV"}
-    content_pos = {"NOUN", "VERB", "ADJ", "PROPN"}
-
-    df["type_of_words"] = df["PoS"].apply(lambda x: "function" if x in function_pos else ("content" if x in content_pos else 'NaN'))
-    df["Zipf_freq"] = df["tokens_no_punct"].map(freq_dict)
+    df["type_of_words"] = df["PoS"].apply(lambda x: "function" if x in FUNCTION_POS else ("content" if x in CONTENT_POS else 'NaN'))
+    with stage("lexicon_lookup", words=len(clean_tokens)):
+        df["Zipf_freq"], source = lexicon.lookup(clean_tokens, clean_lemmas, order=freq_fallback)
 
     df["token_id"] = range(1, len(df)+1)
-    df = df[["token_id", "sentence_ids", "tokens_no_punct", "lemma_no_punct", "PoS", "depparse", "head", "constituency", "AoA(m+sd)", "Zipf_freq", "type_of_words"]]
+    #features not produced by this pipeline (parsing, AoA) are kept as empty columns
+    df = df.reindex(columns=OUTPUT_COLUMNS)
+    return df, coverage(source)
 
 
+def _save_features(df: pd.DataFrame, filepath: str, output_dir: str) -> str:
     name_base = os.path.splitext(os.path.basename(filepath))[0]
     file_output_dir = os.path.join (output_dir, name_base)
     os.makedirs(file_output_dir, exist_ok=True)
     csv_path = os.path.join(file_output_dir, f"{name_base}.csv")
     df.to_csv(csv_path, sep=";",  decimal=",", index=False, encoding="utf-8-sig")
     logging.info(f"Saved CSV: {csv_path}")
-    
+    return csv_path
+
+
+def _log_coverage(stats: Dict[str, float], freq_fallback: Sequence[str]):
+    logging.info(f"Lexicon coverage: {stats['coverage']:.1%} of {stats['n_words']} words "
+                 + ", ".join(f"{name}={stats[name]:.1%}" for name in freq_fallback))
+
+
+def process_text_file(filepath, output_dir, lexicon_dir: str = LEXICON_DIR, freq_fallback: Sequence[str] = ("exact",)): 
+    """
+    Processes a single text file using the Stanza NLP pipeline and extracts linguistic features.
+
+    For each input file, a dedicated subfolder is created (named after the file, e.g. '01_03') 
+    where all outputs are saved.
 
+    Parameters:
+        filepath (str): Path to the input .txt file.
+        output_dir (str): Root directory where output subfolders will be created.
+        lexicon_dir (str): Compiled SUBTLEX-IT store (built from `SUBTLEX_PATH` on first use,
+            see `nlp_pipeline.lexicon`).
+        freq_fallback (Sequence[str]): Lookup order for the Zipf frequency, any of
+            'exact', 'lower' and 'lemma'. Default ('exact',), i.e. the cleaned token only.
+
+    Returns:
+        dict: Lexicon coverage statistics of the file (see `nlp_pipeline.lexicon.coverage`).
+
+    Outputs:
+        - A CSV file containing token-level linguistic features:
+          sentence ID, token, lemma, PoS,  cleaned token/lemma, and SUBTLEX-IT Zipf frequency.
+
+        
+
+    Notes:
+        - Output filenames are automatically derived from the input filename.
+        - Constituency parsing is included if available in the sentence object.
+        - AoA and frequency values are mapped from external normative datasets.
+        - Logging messages indicate where each output file is saved, and the lexicon coverage.
+        - The Stanza pipeline is created on first use and shared within the process
+          (see `nlp_pipeline.models.get_stanza_pipeline`).
+
+    """
+    logging.info(f"Processing file: {filepath}")
+
+    with open(filepath, "r", encoding="utf-8") as infile:
+        text = infile.read()
+
+    nlp = get_stanza_pipeline("it", processors=STANZA_PROCESSORS, use_gpu=False)
+    with stage("stanza", item=filepath, chars=len(text)) as s:
+        doc = nlp(text)
+        s.add(tokens=doc.num_tokens)
 
+    lexicon = get_lexicon(lexicon_dir, SUBTLEX_PATH)
+    with trace_item(filepath):
+        df, stats = doc_to_dataframe(doc, lexicon, freq_fallback)
+    _log_coverage(stats, freq_fallback)
 
+    _save_features(df, filepath, output_dir)
+    return stats
 
 
+def _init_corpus_worker(n_threads: int):
+    #one intra-op thread per worker: parallelism comes from the process pool
+    import torch
+    torch.set_num_threads(n_threads)
+
+
+def _process_batch(filepaths: List[str],
+                   output_dir: str,
+                   lexicon_dir: str,
+                   freq_fallback: Sequence[str],
+                   tokenize_batch_size: int,
+                   pos_batch_size: int) -> List[Tuple[str, str, Dict[str, float]]]:
+    """
+    Processes a batch of files with one bulk Stanza call and writes one CSV per file.
+    """
 
-    
+    import stanza
+
+    texts = []
+    for filepath in filepaths:
+        with open(filepath, "r", encoding="utf-8") as infile:
+            texts.append(infile.read())
+
+    nlp = get_stanza_pipeline("it", processors=STANZA_PROCESSORS, use_gpu=False,
+                              tokenize_batch_size=tokenize_batch_size, pos_batch_size=pos_batch_size)
+    with stage("stanza", item=f"batch of {len(texts)} files", chars=sum(map(len, texts))) as s:
+        docs = nlp([stanza.Document([], text=text) for text in texts])
+        s.add(tokens=sum(doc.num_tokens for doc in docs))
+
+    lexicon = get_lexicon(lexicon_dir, SUBTLEX_PATH)
+    results = []
+    for filepath, doc in zip(filepaths, docs):
+        with trace_item(filepath):
+            df, stats = doc_to_dataframe(doc, lexicon, freq_fallback)
+        results.append((filepath, _save_features(df, filepath, output_dir), stats))
+    return results
+
+
+def process_corpus(input_dir: str,
+                   output_dir: str,
+                   pattern: str = "*.txt",
+                   n_workers: Optional[int] = None,
+                   docs_per_batch: int = DOCS_PER_BATCH,
+                   tokenize_batch_size: int = TOKENIZE_BATCH_SIZE,
+                   pos_batch_size: int = POS_BATCH_SIZE,
+                   threads_per_worker: int = 1,
+                   lexicon_dir: str = LEXICON_DIR,
+                   freq_fallback: Sequence[str] = ("exact",)) -> pd.DataFrame:
+    """
+    Processes a whole directory of stories or transcripts with the Stanza pipeline.
+
+    Files are grouped into batches of `docs_per_batch` documents, each batch is processed with
+    a single bulk Stanza call, and batches are sharded across a pool of worker processes.
+    Each file's CSV is written as soon as its batch finishes (same layout as `process_text_file`).
+
+    Parameters:
+        input_dir (str): Directory with the input text files.
+        output_dir (str): Root directory where output subfolders will be created.
+        pattern (str): Glob pattern of the input files (default '*.txt').
+        n_workers (int, optional): Number of worker processes (default: all CPU cores).
+            With 1 the corpus is processed in the current process.
+        docs_per_batch (int): Documents per bulk Stanza call.
+        tokenize_batch_size (int): Stanza `tokenize_batch_size`.
+        pos_batch_size (int): Stanza `pos_batch_size`.
+        threads_per_worker (int): Torch intra-op threads per worker (default 1, so that
+            n_workers x threads does not oversubscribe the cores).
+        lexicon_dir (str): Compiled SUBTLEX-IT store (see `nlp_pipeline.lexicon`).
+        freq_fallback (Sequence[str]): Lookup order for the Zipf frequency.
+
+    Returns:
+        pd.DataFrame: One row per file with its output CSV and lexicon coverage.
+
+    Notes:
+        - At most 2 x n_workers batches are in flight at any time, which bounds memory use.
+        - The lexicon is compiled once (if needed) before the workers start, and every worker
+          memory-maps the same read-only store.
+    """
 
+    filepaths = sorted(glob.glob(os.path.join(input_dir, pattern)))
+    n_workers = n_workers or os.cpu_count() or 1
+    batches = [filepaths[i:i + docs_per_batch] for i in range(0, len(filepaths), docs_per_batch)]
+    logging.info(f"Processing corpus: {len(filepaths)} files in {len(batches)} batches, {n_workers} workers")
+
+    get_lexicon(lexicon_dir, SUBTLEX_PATH)  # compile once, before the workers map it
+    args = (output_dir, lexicon_dir, tuple(freq_fallback), tokenize_batch_size, pos_batch_size)
+
+    results = []
+    if n_workers == 1:
+        for batch in batches:
+            results.extend(_process_batch(batch, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_corpus_worker,
+                                 initargs=(threads_per_worker,)) as pool:
+            todo = iter(batches)
+            pending = set()
+            while True:
+                #keep a bounded number of batches in flight
+                for batch in todo:
+                    pending.add(pool.submit(_process_batch, batch, *args))
+                    if len(pending) >= 2 * n_workers:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.extend(future.result())
+                logging.info(f"Processed {len(results)}/{len(filepaths)} files")
+
+    summary = pd.DataFrame([{"file": f, "csv": csv, **stats} for f, csv, stats in results])
+    return summary
@@ -0,0 +1,227 @@
+import os
+import time
+import logging
+import warnings
+import torch
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Sequence, Tuple
+from nlp_pipeline import semantic_dissimilarity as dissimilarity
+from nlp_pipeline import surprisal
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.utils import reconstruct_word_arrays
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+PRECISIONS = ("float32", "int8", "bfloat16")
+N_INTEROP_THREADS = 1          # the pipeline runs one model call at a time
+QUANTIZED_ENGINES = ("x86", "fbgemm", "onednn", "qnnpack")   # preferred int8 kernels, in order
+WARMUP_TOKENS = 64             # tokens of the untimed first forward pass of each model
+TARGET_SPEEDUP = 2.0           # CPU throughput over float32 required for production use
+MEASURED_SPEEDUP = {"int8": (1.5, 1.6)}   # range measured by `validate_precision` so far
+
+
+def configure_threads(n_threads: Optional[int] = None, n_interop_threads: int = N_INTEROP_THREADS) -> int:
+    """
+    Thread settings for CPU inference.
+
+    Parameters:
+        n_threads (int, optional): Intra-op threads (default: torch's, the number of physical
+            cores; lower it when several workers share the machine, see `processor.process_corpus`).
+        n_interop_threads (int): Inter-op threads; can only be set before the first parallel
+            operation of the process (ignored afterwards).
+
+    Returns:
+        int: The intra-op threads in use.
+    """
+
+    if n_threads:
+        torch.set_num_threads(n_threads)
+    try:
+        torch.set_num_interop_threads(n_interop_threads)
+    except RuntimeError:
+        pass  # already set, or parallel work has started
+    return torch.get_num_threads()
+
+
+def _conv1d_to_linear(model: torch.nn.Module) -> torch.nn.Module:
+    #GPT-2 projections are transformers' Conv1D (x @ W + b), which dynamic quantization skips:
+    #replace them with the equivalent nn.Linear (weight transposed)
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in model.named_children():
+        if isinstance(child, Conv1D):
+            linear = torch.nn.Linear(child.weight.size(0), child.weight.size(1))
+            linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+            linear.bias = torch.nn.Parameter(child.bias.detach())
+            setattr(model, name, linear)
+        else:
+            _conv1d_to_linear(child)
+    return model
+
+
+def quantize_model(model: torch.nn.Module, precision: str = "int8") -> torch.nn.Module:
+    """
+    Converts a loaded model (in evaluation mode) for faster CPU inference, in place.
+
+    - 'int8': dynamic int8 quantization of every linear layer (weights quantized once, per
+      output channel; activations quantized on the fly per batch), including GPT-2's Conv1D
+      projections and the LM head. Embeddings, layer norms and the softmax stay in float32.
+    - 'bfloat16': all weights and activations in bfloat16. Only faster on CPUs with native
+      bfloat16 instructions (AVX512-BF16 / AMX); elsewhere it can be slower than float32.
+
+    Parameters:
+        model (torch.nn.Module): Hugging Face model on the CPU.
+        precision (str): One of `PRECISIONS` ('float32' returns the model unchanged).
+
+    Returns:
+        torch.nn.Module: The converted model (outputs stay float32 for 'int8').
+
+    Notes:
+        - Uses `torch.ao.quantization.quantize_dynamic` (deprecated in recent torch in favour
+          of torchao, still available); its deprecation warnings are silenced.
+        - The effect on the features is measured by `validate_precision`.
+    """
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}")
+    if precision == "float32":
+        return model
+    if precision == "bfloat16":
+        return model.to(torch.bfloat16)
+
+    if next(model.parameters()).device.type != "cpu":
+        raise ValueError("int8 dynamic quantization runs on the CPU only")
+    engines = torch.backends.quantized.supported_engines
+    torch.backends.quantized.engine = next(e for e in QUANTIZED_ENGINES + tuple(engines) if e in engines)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        warnings.simplefilter("ignore", UserWarning)
+        from torch.ao.quantization import per_channel_dynamic_qconfig, quantize_dynamic
+
+        qconfig = per_channel_dynamic_qconfig if torch.backends.quantized.engine != "qnnpack" else None
+        _conv1d_to_linear(model)
+        quantize_dynamic(model, {torch.nn.Linear: qconfig} if qconfig else {torch.nn.Linear},
+                         dtype=torch.qint8, inplace=True)
+    return model
+
+
+def _lm_features(text: str, tokenizer, model, **kwargs) -> Tuple[Dict[str, np.ndarray], int, float]:
+    #word-level surprisal and entropy, number of tokens and seconds of inference
+    input_ids = tokenizer(text, return_tensors="pt", add_special_tokens=False)["input_ids"]
+    started = time.perf_counter()
+    stats = surprisal.token_stats(model, input_ids, **kwargs)
+    seconds = time.perf_counter() - started
+    tokens = tokenizer.convert_ids_to_tokens(input_ids[0])
+    token_values = {name: stats[j].numpy() for j, name in enumerate(surprisal.STAT_AGGREGATION)}
+    _, values = reconstruct_word_arrays(tokens, token_values, tokenizer, agg=surprisal.STAT_AGGREGATION)
+    return {"surprisal": values["surprisal"], "entropy": values["entropy"]}, input_ids.size(-1), seconds
+
+
+def _encoder_features(text: str, tokenizer, model,
+                      window_size: int = dissimilarity.WINDOW_SIZE,
+                      n_layers: int = dissimilarity.N_LAYERS,
+                      batch_size: Optional[int] = None) -> Tuple[Dict[str, np.ndarray], int, float]:
+    #word-level semantic dissimilarity, number of tokens and seconds of inference
+    started = time.perf_counter()
+    tokens, _, hidden_states = dissimilarity.encode_chunks(text, tokenizer, model, model.device, batch_size)
+    seconds = time.perf_counter() - started
+    values = dissimilarity.windowed_dissimilarity(hidden_states[-n_layers:].mean(dim=0), window_size).numpy()
+    _, values = reconstruct_word_arrays(tokens, values, tokenizer, agg="mean")
+    return {"semantic_dissimilarity": np.asarray(values, dtype=np.float64)}, len(tokens), seconds
+
+
+def _warm_up(tokenizer, model, kind: str, text: str):
+    #first calls allocate buffers and pick kernels: keep them out of the timings
+    ids = tokenizer(text, return_tensors="pt", add_special_tokens=False)["input_ids"][:, :WARMUP_TOKENS]
+    with torch.no_grad():
+        model(ids.to(model.device), **({"use_cache": True} if kind == "causal" else {}))
+
+
+def _deviation(reference: np.ndarray, values: np.ndarray) -> Dict[str, float]:
+    reference, values = np.asarray(reference, dtype=np.float64), np.asarray(values, dtype=np.float64)
+    valid = np.isfinite(reference) & np.isfinite(values)
+    diff = np.abs(values[valid] - reference[valid])
+    return {"n_words": int(valid.sum()),
+            "r": float(np.corrcoef(reference[valid], values[valid])[0, 1]) if valid.sum() > 1 else float("nan"),
+            "max_abs_dev": float(diff.max()) if len(diff) else float("nan"),
+            "mean_abs_dev": float(diff.mean()) if len(diff) else float("nan")}
+
+
+def validate_precision(text_files: Sequence[str],
+                       precisions: Sequence[str] = ("int8",),
+                       n_threads: Optional[int] = None,
+                       lm_name: str = surprisal.MODEL_NAME,
+                       encoder_name: str = dissimilarity.MODEL_NAME,
+                       out_path: Optional[str] = None,
+                       lm_kwargs: Optional[dict] = None,
+                       encoder_kwargs: Optional[dict] = None) -> pd.DataFrame:
+    """
+    Compares reduced-precision CPU inference with the float32 reference, story by story:
+    throughput of each model and deviation of the word-level surprisal, entropy and semantic
+    dissimilarity.
+
+    Parameters:
+        text_files (Sequence[str]): Story .txt files.
+        precisions (Sequence[str]): Precisions to validate ('int8', 'bfloat16').
+        n_threads (int, optional): Intra-op threads (see `configure_threads`), the same for all runs.
+        lm_name, encoder_name (str): Models (Hugging Face names or local directories).
+        out_path (str, optional): CSV of the report.
+        lm_kwargs (dict, optional): `surprisal.token_stats` options (context_length, stride, ...).
+        encoder_kwargs (dict, optional): window_size, n_layers, batch_size of the dissimilarity.
+
+    Returns:
+        pd.DataFrame: One row per story x precision x feature: 'story', 'precision', 'feature',
+        'n_words', 'r' (Pearson, with the float32 values), 'max_abs_dev', 'mean_abs_dev',
+        'tokens_per_s' and 'reference_tokens_per_s' (of the model computing the feature),
+        'speedup' and 'threads'.
+
+    Notes:
+        - Every model runs once untimed before the first story; the timings cover the forward
+          passes only (tokenization and word reconstruction are the same for all precisions).
+    """
+
+    threads = configure_threads(n_threads)
+    lm_kwargs, encoder_kwargs = dict(lm_kwargs or {}), dict(encoder_kwargs or {})
+    cpu = torch.device("cpu")
+    runs = {"causal": (get_tokenizer(lm_name, surprisal.REVISION), lm_name, surprisal.REVISION,
+                       lambda text, tok, model: _lm_features(text, tok, model, **lm_kwargs)),
+            "encoder": (get_tokenizer(encoder_name, dissimilarity.REVISION), encoder_name, dissimilarity.REVISION,
+                        lambda text, tok, model: _encoder_features(text, tok, model, **encoder_kwargs))}
+
+    texts = {}
+    for path in text_files:
+        with open(path, "r", encoding="utf-8") as f:
+            texts[os.path.splitext(os.path.basename(path))[0]] = f.read().replace("\n", " ").replace("\r", " ")
+
+    rows = []
+    for kind, (tokenizer, name, revision, features) in runs.items():
+        models = {p: get_model(name, kind, revision, device=cpu, precision=p) for p in ("float32", *precisions)}
+        for model in models.values():
+            _warm_up(tokenizer, model, kind, next(iter(texts.values()), "Pronto."))
+        for story, text in texts.items():
+            reference, n_tokens, seconds = features(text, tokenizer, models["float32"])
+            reference_speed = n_tokens / seconds
+            for precision in precisions:
+                values, n_tokens, seconds = features(text, tokenizer, models[precision])
+                speed = n_tokens / seconds
+                for feature in reference:
+                    rows.append({"story": story, "precision": precision, "feature": feature,
+                                 **_deviation(reference[feature], values[feature]),
+                                 "tokens_per_s": speed, "reference_tokens_per_s": reference_speed,
+                                 "speedup": speed / reference_speed, "threads": threads})
+                logging.info(f"{story} ({name}, {precision}): {speed:.0f} tokens/s, {speed / reference_speed:.2f}x float32")
+
+    report = pd.DataFrame(rows)
+    if len(report):
+        summary = report.groupby(["precision", "feature"]).agg(speedup=("speedup", "mean"), min_r=("r", "min"),
+                                                               max_abs_dev=("max_abs_dev", "max"))
+        logging.info(f"Precision validation ({threads} threads):\n{summary.to_string()}")
+        for precision, speedup in report.groupby("precision")["speedup"].mean().items():
+            if speedup < TARGET_SPEEDUP:
+                logging.warning(f"{precision}: {speedup:.2f}x float32 throughput, below the {TARGET_SPEEDUP:g}x target")
+    if out_path:
+        report.to_csv(out_path, index=False)
+        logging.info(f"Saved CSV: {out_path}")
+    return report
@@ -2,13 +2,151 @@ import os
 import logging
 import torch
 import torch.nn.functional as F
+import numpy as np
 import pandas as pd
-from transformers import AutoTokenizer, AutoModel
-from nlp_pipeline.utils import reconstruct_words
+from typing import List, Optional, Sequence, Tuple
+from nlp_pipeline.cache import FeatureCache, cache_key
+from nlp_pipeline.instrumentation import stage, trace_item
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.utils import reconstruct_word_arrays
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
-def calculate_semantic_dissimilarity(filepath: str, output_dir:str):
+WINDOW_SIZE = 20  # number of preceding tokens in the context window
+N_LAYERS = 4      # number of last hidden layers averaged into the token embeddings
+
+MODEL_NAME = "Musixmatch/umberto-commoncrawl-cased-v1"
+REVISION = "main"
+CHUNK_SETTINGS = {"max_length": 512, "stride": 128, "add_special_tokens": False}
+
+
+def encode_chunks(text: str,
+                  tokenizer,
+                  model,
+                  device,
+                  batch_size: Optional[int] = None) -> Tuple[List[str], torch.Tensor, torch.Tensor]:
+    """
+    Encodes a text of arbitrary length with an encoder model and stitches the overlapping
+    512-token chunks back into a single sequence of token embeddings.
+
+    All overflow chunks are padded and run through the model as one batch (or as batches of
+    `batch_size` chunks). Tokens repeated in the overlap between two chunks are kept only
+    from the chunk where they first appear.
+
+    Parameters:
+        text (str): Input text.
+        tokenizer: Hugging Face fast tokenizer (offset mappings are required).
+        model: Hugging Face encoder model loaded with `output_hidden_states=True`.
+        device: Torch device the model lives on.
+        batch_size (int, optional): Maximum number of chunks per forward pass.
+            Defaults to all chunks in a single pass.
+
+    Returns:
+        Tuple[List[str], torch.Tensor, torch.Tensor]:
+            - The tokens of the stitched sequence.
+            - Their character offsets, shape (n_tokens, 2).
+            - Their hidden states for every layer, shape (n_layers + 1, n_tokens, hidden_size),
+              in float32 on the CPU (index 0 is the embedding layer).
+    """
+
+    #tokenize text with max_length of chunck of 512 tokens 
+    with stage("tokenization", chars=len(text)) as s:
+        encodings = tokenizer(
+            text,
+            return_tensors="pt",
+            truncation=True,
+            padding=True,
+            return_overflowing_tokens=True,
+            return_offsets_mapping=True,
+            **CHUNK_SETTINGS
+        )
+        input_ids = encodings["input_ids"]
+        attention_mask = encodings["attention_mask"] #important for padding
+        s.add(tokens=int(attention_mask.sum()))
+    n_chunks = input_ids.size(0)
+    batch_size = batch_size or n_chunks
+
+    #get embeddings from the model without computing the gradient
+    chunk_states = []
+    with torch.no_grad(), stage("model_forward", tokens=int(attention_mask.sum()), chunks=n_chunks):
+        for b in range(0, n_chunks, batch_size):
+            outputs = model(input_ids[b:b + batch_size].to(device),
+                            attention_mask=attention_mask[b:b + batch_size].to(device))
+            chunk_states.append(torch.stack(outputs.hidden_states, dim=0).float().cpu())
+    chunk_states = torch.cat(chunk_states, dim=1)
+
+    #keep each token once: drop padding, and tokens already covered by the previous chunk
+    keep = attention_mask.bool()
+    offsets = encodings["offset_mapping"]
+    ends = torch.where(keep, offsets[..., 1], torch.zeros_like(offsets[..., 1])).max(dim=1).values
+    prev_end = torch.cat([torch.zeros(1, dtype=ends.dtype), ends[:-1]])
+    keep &= offsets[..., 0] >= prev_end.unsqueeze(1)
+    #identical consecutive offsets (e.g. a bare SentencePiece marker) are counted once
+    same = torch.zeros_like(keep)
+    same[:, 1:] = (offsets[:, 1:] == offsets[:, :-1]).all(dim=-1)
+    keep &= ~same
+
+    tokens = tokenizer.convert_ids_to_tokens(input_ids[keep].tolist())
+    return tokens, offsets[keep], chunk_states[:, keep]
+
+
+def windowed_dissimilarity(hidden_states: torch.Tensor, window_size: int = WINDOW_SIZE) -> torch.Tensor:
+    """
+    Computes 1 - cosine similarity between every token embedding and the mean embedding
+    of the `window_size` tokens preceding it.
+
+    The context means of all tokens are obtained at once from a cumulative sum over the
+    sequence, so windows that cross a chunk boundary use the previous chunk's embeddings.
+
+    Parameters:
+        hidden_states (torch.Tensor): Token embeddings of shape (n_tokens, hidden_size).
+        window_size (int): Number of preceding tokens in the context window.
+
+    Returns:
+        torch.Tensor: Dissimilarity values of shape (n_tokens,); the first token is NaN.
+    """
+
+    return windowed_dissimilarities(hidden_states, [window_size])[0]
+
+
+def windowed_dissimilarities(hidden_states: torch.Tensor, window_sizes: Sequence[int]) -> torch.Tensor:
+    """
+    `windowed_dissimilarity` for several window sizes, sharing one cumulative sum.
+
+    Returns:
+        torch.Tensor: Dissimilarity values of shape (len(window_sizes), n_tokens); the first
+        token is NaN.
+    """
+
+    n_tokens = hidden_states.size(0)
+    dissimilarity = torch.full((len(window_sizes), n_tokens), float("nan"))
+    if n_tokens < 2:
+        return dissimilarity
+
+    #cumulative sum in double precision to keep long sequences accurate
+    h = hidden_states.double()
+    csum = torch.cat([torch.zeros(1, h.size(1), dtype=h.dtype), h.cumsum(dim=0)])
+    t = torch.arange(1, n_tokens)
+    for k, window_size in enumerate(window_sizes):
+        start = (t - window_size).clamp(min=0)
+        context = (csum[t] - csum[start]) / (t - start).unsqueeze(1) #Mean embedding of context windows
+
+        #compute cosine similarity between every token and its context
+        sim = F.cosine_similarity(h[1:], context, dim=-1)
+
+        # semantic dissimilarity = 1-similarity
+        dissimilarity[k, 1:] = (1.0 - sim).float()
+    return dissimilarity
+
+
+def calculate_semantic_dissimilarity(filepath: str,
+                                     output_dir: str,
+                                     window_size: int = WINDOW_SIZE,
+                                     batch_size: Optional[int] = None,
+                                     n_layers: int = N_LAYERS,
+                                     cache: Optional[FeatureCache] = None,
+                                     model_name: str = MODEL_NAME,
+                                     precision: str = "float32"):
     """
     Calculates word-level semantic dissimilarity values for a text file using UmBERTo.
     Semantic dissimilarity measures how semantically "unexpected" a word is given its preceding context.
@@ -21,6 +159,16 @@ def calculate_semantic_dissimilarity(filepath: str, output_dir:str):
     Parameters:
     filepath (str): Path to the input .txt file.
     output_dir (str): Root directory where output subfolders will be created.
+    window_size (int): Number of preceding tokens in the context window (default 20).
+    batch_size (int, optional): Maximum number of 512-token chunks per forward pass
+        (default: all chunks in a single padded pass).
+    n_layers (int): Number of last hidden layers averaged into the token embeddings (default 4).
+    cache (FeatureCache, optional): On-disk cache of per-token hidden states. When given, the
+        transformer forward pass is only run for texts that are not cached yet, so changing
+        `window_size` or `n_layers` does not require re-encoding the text.
+    model_name (str): Encoder model (Hugging Face name or local directory).
+    precision (str): 'float32', or 'int8' / 'bfloat16' for faster CPU inference (see
+        `nlp_pipeline.quantization`).
     
     Outputs:
         - A CSV file containing word-level semantic dissimilarity values:
@@ -29,95 +177,49 @@ def calculate_semantic_dissimilarity(filepath: str, output_dir:str):
 
     Notes:
         - The function uses Hugging Face `AutoTokenizer` and `AutoModel` (UmBERTo) and takes
-        the last hidden layer as token embeddings.
-        - Aggregation from token-level to word-level is handled by `reconstruct_words' from utils.py
+        the average of the last `n_layers` hidden layers as token embeddings. Both are loaded once
+        per process (see `nlp_pipeline.models`).
+        - Aggregation from token-level to word-level is handled by `reconstruct_word_arrays' from utils.py
+        - Overlapping chunks are stitched into one token sequence (see `encode_chunks`), so context
+          windows crossing a chunk boundary use the previous chunk's embeddings.
 
         - Logging messages indicate which file is being processed and where the resulting CSV is saved.
     """
     
     logging.info(f"Processing file: {filepath}")
     
-    model_name = "Musixmatch/umberto-commoncrawl-cased-v1"
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModel.from_pretrained(model_name, output_hidden_states=True)
-
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-    model.eval() #set the model to evalutation mode (no dropout, etc.)
+    tokenizer = get_tokenizer(model_name, REVISION)
 
     with open(filepath, "r", encoding="utf-8") as f:
         text = f.read().replace("\n", " ").replace("\r", " ")
 
-    #tokenize text with max_length of chunck of 512 tokens 
-    encodings = tokenizer(
-        text,
-        return_tensors="pt",
-        truncation=True,
-        padding=True,
-        max_length=512,
-        stride=128,
-        return_overflowing_tokens=True,
-        return_offsets_mapping=True,
-        add_special_tokens=False
-    )
-
-    all_tokens = []
-    all_dissimilarities = []
-    seen_offsets = set() #for overlap tokens
-
-    # process each chunck of tokens
-    for i in range(len(encodings["input_ids"])):
-        #extract toknes IDs and attention mask for the corrent chunk
-        input_ids = encodings["input_ids"][i].unsqueeze(0).to(device)
-        attention_mask = encodings["attention_mask"][i].unsqueeze(0).to(device) #important for padding
-        offsets = encodings["offset_mapping"][i] 
-
-        #get embeddings from the model without computing the gradient
-        with torch.no_grad():
-            outputs = model(input_ids, attention_mask=attention_mask)
-            hidden_states_list = outputs.hidden_states
-            last4 = hidden_states_list[-4:]
-            hidden_states = torch.stack(last4, dim=0).mean(dim=0)[0]
-
-
-        chunk_tokens = tokenizer.convert_ids_to_tokens(input_ids[0].tolist())
-
-        dissimilarities = []
-
-        for t in range(hidden_states.size(0)):
-            if attention_mask[0, t] == 0:
-                continue
-
-            start_char, end_char = offsets[t].tolist()
-
-            #removing duplicates from overlap
-            if (start_char, end_char) in seen_offsets:
-                continue
-            seen_offsets.add((start_char, end_char))
-
-            #no dissimilarity for the first token 
-            if t == 0:
-                all_tokens.append(chunk_tokens[t])
-                all_dissimilarities.append(float("nan"))
-                continue
-
-             
-            start = max(0, t - 20) #window size of 20
-            context = hidden_states[start:t].mean(dim=0, keepdim=True) #Mean embedding of context window
-            token_vec = hidden_states[t].unsqueeze(0)
-           
-            #compute cosine similarity between current token and its context
-            sim = F.cosine_similarity(token_vec, context, dim=-1)
-           
-            # semantic dissimilarity = 1-similarity
-            dissim = (1.0 - sim).item()
-            dissimilarities.append(dissim)
-
-            all_tokens.append(chunk_tokens[t])
-            all_dissimilarities.append(dissim)
+    settings = CHUNK_SETTINGS if precision == "float32" else {**CHUNK_SETTINGS, "precision": precision}
+    key = cache_key(text, model_name, REVISION, settings)
+    entry = cache.get(key) if cache is not None else None
+
+    if entry is not None:
+        #only the selected layers are read from the memory-mapped file
+        all_tokens = entry["tokens"]
+        embeddings = torch.from_numpy(np.array(entry["hidden_states"][-n_layers:], dtype=np.float32)).mean(dim=0)
+    else:
+        model = get_model(model_name, "encoder", REVISION, precision=precision) #shared model, in evaluation mode
+        device = model.device
+
+        with trace_item(filepath):
+            all_tokens, offsets, hidden_states = encode_chunks(text, tokenizer, model, device, batch_size=batch_size)
+        if cache is not None:
+            cache.put(key,
+                      {"hidden_states": hidden_states.numpy(), "offsets": offsets.numpy()},
+                      all_tokens,
+                      {"model": model_name, "revision": REVISION, "precision": precision, "file": filepath})
+        embeddings = hidden_states[-n_layers:].mean(dim=0)
+
+    all_dissimilarities = windowed_dissimilarity(embeddings, window_size).numpy()
     
     # Aggregate token-level scores into word-level ones 
-    words, values = reconstruct_words(all_tokens, all_dissimilarities, tokenizer, agg="mean")    
+    with stage("word_reconstruction", item=filepath, tokens=len(all_tokens)) as s:
+        words, values = reconstruct_word_arrays(all_tokens, all_dissimilarities, tokenizer, agg="mean")
+        s.add(words=len(words))
 
 
     df = pd.DataFrame({
@@ -0,0 +1,568 @@
+import re
+import json
+import time
+import asyncio
+import logging
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+from nlp_pipeline.alignment import align_words
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.utils import reconstruct_word_arrays
+from nlp_pipeline import semantic_dissimilarity as dissimilarity
+from nlp_pipeline import surprisal
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+HOST = "127.0.0.1"
+PORT = 8765
+LATENCY_BUDGET = 0.100   # s, from the arrival of the text completing a word to its emission
+ENCODER_LOOKAHEAD = None # right-context tokens before a token is encoded (None: its whole offline chunk)
+
+
+class IncrementalLM:
+    """
+    Next-token statistics of a causal language model for a token stream, one piece at a time.
+
+    The key/value cache is kept between pieces, so every token is encoded once. The cache is
+    restarted exactly where `surprisal.iter_next_token_logits` restarts it on the whole text
+    (at the start of the first `stride` block that would not fit in `max_length`, primed with
+    the last `context_length` tokens), so every token sees the same context as offline.
+
+    Parameters:
+        model: Hugging Face causal language model, in evaluation mode.
+        context_length, stride, max_length, top_k: As in `surprisal.calculate_surprisal_entropy`.
+
+    Notes:
+        - The schedule is identical to the offline one when `max_length - context_length` is a
+          multiple of `stride` (as with the defaults), since the offline window then always
+          restarts when the cache is full, whatever the size of the last block.
+    """
+
+    def __init__(self, model, context_length: int = surprisal.CONTEXT_LENGTH, stride: int = surprisal.STRIDE,
+                 max_length: Optional[int] = None, top_k: int = surprisal.TOP_K):
+        self.model = model
+        self.context_length = context_length
+        self.stride = stride
+        self.max_length = max_length or model.config.n_positions
+        self.top_k = top_k
+        self.ids: List[int] = []
+        self.past = None
+        self.cache_len = 0
+        self.prev_logits = None
+
+    def feed(self, new_ids: List[int]) -> Dict[str, np.ndarray]:
+        """
+        Feeds the next tokens and returns their statistics (see `surprisal.next_token_stats`);
+        the first token of the stream has no prediction (NaN).
+        """
+
+        import torch
+
+        out = {name: np.full(len(new_ids), np.nan) for name in surprisal.STAT_AGGREGATION}
+        device = self.model.device
+        done = 0
+        with torch.no_grad():
+            while done < len(new_ids):
+                pos = len(self.ids)
+                #stop every piece at the next block boundary of the offline schedule
+                size = min(len(new_ids) - done, self.stride - pos % self.stride)
+                if pos % self.stride == 0 and self.cache_len + self.stride > self.max_length:
+                    self.past, self.cache_len = None, 0
+                    if self.context_length > 0:
+                        prefix = torch.tensor([self.ids[pos - self.context_length:pos]], device=device)
+                        self.past = self.model(prefix, use_cache=True).past_key_values
+                        self.cache_len = self.context_length
+
+                piece = new_ids[done:done + size]
+                outputs = self.model(torch.tensor([piece], device=device), past_key_values=self.past, use_cache=True)
+                self.past = outputs.past_key_values
+                self.cache_len += size
+                logits = outputs.logits[0]
+
+                #logits[k] predicts the token after piece[k]; the first token uses the previous piece
+                first = 0 if self.prev_logits is not None else 1
+                predictions = logits[:-1] if self.prev_logits is None else torch.cat([self.prev_logits, logits[:-1]])
+                if len(predictions):
+                    targets = torch.tensor(piece[first:], device=device)
+                    stats = surprisal.next_token_stats(predictions, targets, self.top_k)
+                    for name, values in stats.items():
+                        out[name][done + first:done + size] = values.cpu().numpy()
+                self.prev_logits = logits[-1:]
+                self.ids.extend(piece)
+                done += size
+        return out
+
+
+class IncrementalEncoder:
+    """
+    Semantic dissimilarity of an encoder model for a token stream, one piece at a time.
+
+    Every token is encoded within the same chunk as offline (`semantic_dissimilarity.encode_chunks`:
+    `max_length`-token chunks overlapping by `stride` tokens, each token taken from the first
+    chunk that contains it), with the tokens of that chunk that have arrived so far. A token is
+    held until its chunk is complete, or until `lookahead` tokens after it have arrived, and each
+    step re-encodes the chunks of the tokens it releases. Each released token is compared with the
+    mean embedding of the `window_size` tokens before it, as in
+    `semantic_dissimilarity.windowed_dissimilarity`.
+
+    Parameters:
+        model: Hugging Face encoder model loaded with `output_hidden_states=True`.
+        window_size, n_layers: As in `semantic_dissimilarity.calculate_semantic_dissimilarity`.
+        max_length, stride: Chunk geometry (default: `semantic_dissimilarity.CHUNK_SETTINGS`).
+        lookahead (int, optional): Right-context tokens after which a token is released even if
+            its chunk is not complete (default None: wait for the whole chunk).
+
+    Notes:
+        - With `lookahead=None` (or once the stream ends), every token sees exactly the context it
+          has offline, so the values equal the offline ones. The first tokens of a chunk then wait
+          for up to `max_length - 1` tokens; a smaller `lookahead` trades this delay for embeddings
+          that differ from the offline ones (fewer tokens to the right).
+    """
+
+    def __init__(self, model, window_size: int = dissimilarity.WINDOW_SIZE, n_layers: int = dissimilarity.N_LAYERS,
+                 max_length: int = dissimilarity.CHUNK_SETTINGS["max_length"],
+                 stride: int = dissimilarity.CHUNK_SETTINGS["stride"], lookahead: Optional[int] = ENCODER_LOOKAHEAD):
+        self.model = model
+        self.window_size = window_size
+        self.n_layers = n_layers
+        self.max_length = max_length
+        self.step = max_length - stride
+        self.lookahead = lookahead
+        self.ids: List[int] = []      # tokens from the start of the chunk of the first held token on
+        self.keep: List[bool] = []
+        self.offset = 0               # position of ids[0] in the stream
+        self.released = 0             # tokens released so far
+        self.embeddings: deque = deque(maxlen=window_size)
+
+    def _chunk(self, position: int) -> int:
+        #first offline chunk that contains the token
+        return 0 if position < self.max_length else -(-(position - self.max_length + 1) // self.step)
+
+    def feed(self, new_ids: List[int], keep: Optional[List[bool]] = None, final: bool = False) -> np.ndarray:
+        """
+        Feeds the next tokens and returns the dissimilarity of the tokens released by them (in
+        stream order, possibly fewer or more than `new_ids`); the first token of the stream is NaN.
+
+        Parameters:
+            new_ids (List[int]): Next token ids.
+            keep (List[bool], optional): False for tokens that `encode_chunks` drops from its
+                output (same character offsets as the token before): they are encoded, but
+                neither scored (NaN) nor part of the context windows.
+            final (bool): End of the stream: every token is released.
+        """
+
+        import torch
+
+        self.ids.extend(new_ids)
+        self.keep.extend(keep if keep is not None else [True] * len(new_ids))
+        n = self.offset + len(self.ids)
+        end = self.released
+        while end < n:
+            ready = self._chunk(end) * self.step + self.max_length
+            if self.lookahead is not None:
+                ready = min(ready, end + 1 + self.lookahead)
+            if not final and n < ready:
+                break
+            end += 1
+
+        out = np.full(end - self.released, np.nan)
+        with torch.no_grad():
+            position = self.released
+            while position < end:
+                start = self._chunk(position) * self.step
+                stop = min(start + self.max_length, n)
+                last = min(end, stop)
+                input_ids = torch.tensor([self.ids[start - self.offset:stop - self.offset]], device=self.model.device)
+                states = self.model(input_ids).hidden_states
+                #as offline: float32 layer mean, double precision dissimilarity
+                h = torch.stack(states[-self.n_layers:]).float().mean(0)[0, position - start:last - start]
+                for k, e in enumerate(h.double().cpu().numpy()):
+                    if not self.keep[position + k - self.offset]:
+                        continue
+                    if self.embeddings:
+                        context = np.mean(self.embeddings, axis=0)
+                        cos = e @ context / max(np.linalg.norm(e) * np.linalg.norm(context), 1e-12)
+                        out[position + k - self.released] = 1.0 - cos
+                    self.embeddings.append(e)
+                position = last
+
+        #drop the tokens before the chunk of the next held token
+        self.released = end
+        start = self._chunk(end) * self.step
+        del self.ids[:start - self.offset], self.keep[:start - self.offset]
+        self.offset = start
+        return out
+
+
+class StreamSession:
+    """
+    Word-level surprisal, entropy and semantic dissimilarity of a text that arrives in pieces.
+
+    Text is committed up to the last whitespace, so a word is complete as soon as the whitespace
+    after it arrives. Each committed segment starts at a whitespace boundary, so it is tokenized
+    exactly as within the whole text; its words are reconstructed with `reconstruct_word_arrays`
+    and the offline aggregation (`surprisal.STAT_AGGREGATION`, mean dissimilarity). The words of a
+    segment are emitted once the encoder has released all of its tokens (see `IncrementalEncoder`),
+    and their latency includes that wait.
+
+    Parameters:
+        lm_tokenizer, lm: Causal language model and tokenizer (default: `surprisal.MODEL_NAME`).
+        encoder_tokenizer, encoder: Encoder model and tokenizer (default:
+            `semantic_dissimilarity.MODEL_NAME`). With `encoder=False`, no dissimilarity.
+        latency_budget (float): Words emitted later than this after the text that completed
+            them arrived are flagged 'late'.
+        lookahead (int, optional): See `IncrementalEncoder` (default: exact offline values).
+        **kwargs: Passed to `IncrementalLM` (context_length, stride, max_length, top_k).
+    """
+
+    def __init__(self, lm_tokenizer=None, lm=None, encoder_tokenizer=None, encoder=None,
+                 latency_budget: float = LATENCY_BUDGET, lookahead: Optional[int] = ENCODER_LOOKAHEAD, **kwargs):
+        self.lm_tokenizer = lm_tokenizer or get_tokenizer(surprisal.MODEL_NAME, surprisal.REVISION)
+        self.lm = IncrementalLM(lm or get_model(surprisal.MODEL_NAME, "causal", surprisal.REVISION), **kwargs)
+        if encoder is False:
+            self.encoder = None
+        else:
+            self.encoder_tokenizer = encoder_tokenizer or get_tokenizer(dissimilarity.MODEL_NAME, dissimilarity.REVISION)
+            self.encoder = IncrementalEncoder(encoder or get_model(dissimilarity.MODEL_NAME, "encoder", dissimilarity.REVISION),
+                                              lookahead=lookahead)
+        self.latency_budget = latency_budget
+        self.top_k = self.lm.top_k
+        self.pending = ""
+        self.held: deque = deque()   # segments waiting for the encoder
+        self.released: List[float] = []
+        self.n_words = 0
+        self.latencies: List[float] = []
+
+    def _segment_words(self, segment: str, arrival: float):
+        lm_ids = self.lm_tokenizer(segment, add_special_tokens=False)["input_ids"]
+        stats = self.lm.feed(lm_ids)
+        tokens = self.lm_tokenizer.convert_ids_to_tokens(lm_ids)
+        words, values = reconstruct_word_arrays(tokens, stats, self.lm_tokenizer, agg=surprisal.STAT_AGGREGATION)
+        rows = [{"word": w, **{(f"top{self.top_k}_mass" if k == "topk_mass" else k): float(v[i]) for k, v in values.items()}}
+                for i, w in enumerate(words)]
+        if self.encoder is None:
+            self.held.append({"rows": rows, "arrival": arrival, "n_tokens": 0})
+            return
+
+        encoding = self.encoder_tokenizer(segment, add_special_tokens=False, return_offsets_mapping=True)
+        enc_ids, offsets = encoding["input_ids"], [tuple(o) for o in encoding["offset_mapping"]]
+        #tokens with the offsets of the token before are dropped, as by `encode_chunks`
+        keep = [k == 0 or offsets[k] != offsets[k - 1] for k in range(len(offsets))]
+        self.held.append({"rows": rows, "arrival": arrival, "n_tokens": len(enc_ids), "keep": keep,
+                          "tokens": self.encoder_tokenizer.convert_ids_to_tokens(enc_ids)})
+        self.released.extend(self.encoder.feed(enc_ids, keep))
+
+    def _release(self, final: bool) -> List[tuple]:
+        #the held segments whose encoder tokens have all been released, with their dissimilarity
+        if self.encoder is not None and final:
+            self.released.extend(self.encoder.feed([], final=True))
+        out = []
+        while self.held and len(self.released) >= self.held[0]["n_tokens"]:
+            segment = self.held.popleft()
+            rows, n = segment["rows"], segment["n_tokens"]
+            if self.encoder is not None:
+                diss, self.released = np.asarray(self.released[:n]), self.released[n:]
+                tokens = [t for t, k in zip(segment["tokens"], segment["keep"]) if k]
+                enc_words, enc_values = reconstruct_word_arrays(tokens, diss[segment["keep"]], self.encoder_tokenizer, agg="mean")
+                words = [row["word"] for row in rows]
+                #both tokenizations usually give the same words; otherwise map them by alignment
+                index = np.arange(len(words)) if list(enc_words) == words else \
+                    align_words(list(enc_words), words, band=max(8, abs(len(words) - len(enc_words)) + 8))[0]
+                for row, k in zip(rows, index):
+                    row["semantic_dissimilarity"] = float(enc_values[k]) if k >= 0 else float("nan")
+            out.append((rows, segment["arrival"]))
+        return out
+
+    def feed(self, text: str, arrival: Optional[float] = None, final: bool = False) -> List[dict]:
+        """
+        Adds text and returns the words that are ready (all remaining words with `final`).
+
+        Parameters:
+            text (str): Next piece of the transcript.
+            arrival (float, optional): `time.perf_counter()` when the text arrived (default: now).
+            final (bool): End of the stream: the last word is complete too.
+
+        Returns:
+            List[dict]: One dict per word: 'index', 'word', 'surprisal', 'entropy', 'rank',
+            'top<k>_mass', 'semantic_dissimilarity', 'latency' (s, from the arrival of the text
+            that completed the word) and 'late'.
+        """
+
+        arrival = time.perf_counter() if arrival is None else arrival
+        self.pending += text.replace("\n", " ").replace("\r", " ")
+        if final:
+            cut = len(self.pending.rstrip())
+        else:
+            #commit up to the whitespace run before the last (possibly unfinished) word
+            last = re.search(r"\s+\S*\Z", self.pending)
+            cut = last.start() if last else 0
+        segment, self.pending = self.pending[:cut], self.pending[cut:]
+        if segment.strip():
+            self._segment_words(segment, arrival)
+        else:
+            self.pending = segment + self.pending
+
+        out = []
+        now = time.perf_counter()
+        for rows, completed in self._release(final):
+            latency = now - completed
+            for row in rows:
+                row.update(index=self.n_words, latency=latency, late=latency > self.latency_budget)
+                self.n_words += 1
+            self.latencies.extend([latency] * len(rows))
+            out.extend(rows)
+        return out
+
+    def latency_report(self) -> Dict[str, float]:
+        """
+        Per-word latency so far: 'n_words', 'p50_ms', 'p99_ms', 'max_ms' and 'late' (words over budget).
+        """
+
+        lat = np.asarray(self.latencies) * 1000
+        if not len(lat):
+            return {"n_words": 0, "p50_ms": float("nan"), "p99_ms": float("nan"), "max_ms": float("nan"), "late": 0}
+        return {"n_words": int(len(lat)), "p50_ms": float(np.percentile(lat, 50)), "p99_ms": float(np.percentile(lat, 99)),
+                "max_ms": float(lat.max()), "late": int((lat > self.latency_budget * 1000).sum())}
+
+
+class StreamServer:
+    """
+    Local asyncio server of `StreamSession`s, speaking newline-delimited JSON over TCP.
+
+    Requests: {"type": "text", "session": id, "text": ...}, {"type": "flush", "session": id},
+    {"type": "stats", "session": id}, {"type": "close", "session": id}.
+    Responses: {"type": "words", "session": id, "words": [...]} as words are completed,
+    {"type": "flushed", ...}, {"type": "stats", ...}, {"type": "closed", ...}, {"type": "error", ...}
+    (a session whose processing fails is dropped with an error carrying its id).
+
+    All model calls run in one worker thread (the models are shared by the sessions). Text
+    that arrives while a session is busy is processed together in its next step, so a burst
+    of small pieces does not build up a queue of model calls. The latency of the words of such a
+    step is measured from the earliest piece in it that could complete a word, so it includes
+    the queueing delay (and errs on the long side for words completed by later pieces).
+
+    Parameters:
+        session_factory (callable, optional): Creates a `StreamSession` (default: the
+            default models, loaded once).
+        latency_budget (float): See `StreamSession`.
+    """
+
+    def __init__(self, session_factory=None, latency_budget: float = LATENCY_BUDGET):
+        self.session_factory = session_factory or (lambda: StreamSession(latency_budget=latency_budget))
+        self.sessions: Dict[str, StreamSession] = {}
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.workers: Dict[str, asyncio.Task] = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def _session_worker(self, session_id: str, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        queue = self.queues[session_id]
+        try:
+            while True:
+                items = [await queue.get()]
+                while not queue.empty():
+                    items.append(queue.get_nowait())
+                text = "".join(item["text"] for item in items if item["type"] == "text")
+                final = any(item["type"] in ("flush", "close") for item in items)
+                #latency runs from the earliest piece that can complete a word (whitespace, flush or close),
+                #so the time the pieces of a step waited in the queue is counted
+                completing = [item["arrival"] for item in items if item["type"] != "text" or re.search(r"\s", item["text"])]
+                arrival = min(completing or [item["arrival"] for item in items])
+                if session_id not in self.sessions:
+                    self.sessions[session_id] = await loop.run_in_executor(self.executor, self.session_factory)
+                session = self.sessions[session_id]
+                words = await loop.run_in_executor(self.executor, session.feed, text, arrival, final)
+                if words:
+                    await self._send(writer, {"type": "words", "session": session_id, "words": words})
+                for item in items:
+                    if item["type"] == "flush":
+                        await self._send(writer, {"type": "flushed", "session": session_id})
+                    elif item["type"] == "close":
+                        await self._send(writer, {"type": "closed", "session": session_id, **session.latency_report()})
+                        self.sessions.pop(session_id, None)
+                        self.queues.pop(session_id, None)
+                        self.workers.pop(session_id, None)
+                        return
+        except Exception as e:
+            #report the failure instead of leaving the client waiting for "flushed" or "closed"
+            logging.exception(f"Session {session_id} failed")
+            self.sessions.pop(session_id, None)
+            self.queues.pop(session_id, None)
+            self.workers.pop(session_id, None)
+            try:
+                await self._send(writer, {"type": "error", "session": session_id, "message": f"session failed: {e!r}"})
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, message: dict):
+        writer.write((json.dumps(message) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        opened = set()
+        try:
+            while line := await reader.readline():
+                arrival = time.perf_counter()
+                try:
+                    message = json.loads(line)
+                    session_id = str(message["session"])
+                    kind = message["type"]
+                except (ValueError, KeyError) as e:
+                    await self._send(writer, {"type": "error", "message": f"invalid request: {e!r}"})
+                    continue
+                if kind == "stats":
+                    report = self.sessions[session_id].latency_report() if session_id in self.sessions else {}
+                    await self._send(writer, {"type": "stats", "session": session_id, **report})
+                    continue
+                if kind not in ("text", "flush", "close"):
+                    await self._send(writer, {"type": "error", "message": f"unknown request type {kind!r}"})
+                    continue
+                if session_id not in self.queues:
+                    self.queues[session_id] = asyncio.Queue()
+                    self.workers[session_id] = asyncio.create_task(self._session_worker(session_id, writer))
+                    opened.add(session_id)
+                await self.queues[session_id].put({"type": kind, "text": message.get("text", ""), "arrival": arrival})
+        except (asyncio.CancelledError, ConnectionResetError):
+            #server shut down or client gone: drop its sessions
+            pass
+        finally:
+            for session_id in opened:
+                task = self.workers.pop(session_id, None)
+                if task is not None:
+                    task.cancel()
+                self.sessions.pop(session_id, None)
+                self.queues.pop(session_id, None)
+            if not writer.is_closing():
+                writer.close()
+
+    async def serve(self, host: str = HOST, port: int = PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        logging.info(f"Streaming features on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def run_server(host: str = HOST, port: int = PORT, latency_budget: float = LATENCY_BUDGET):
+    """
+    Loads the default models once and serves sessions until interrupted.
+    """
+
+    server = StreamServer(latency_budget=latency_budget)
+    server.sessions["_warmup"] = server.session_factory()   # load the models before the first client
+    server.sessions["_warmup"].feed("Pronto.", final=True)
+    server.sessions.pop("_warmup")
+    asyncio.run(server.serve(host, port))
+
+
+class StreamClient:
+    """
+    Asyncio client of `StreamServer` for one session.
+
+    Example:
+        client = await StreamClient.connect("story1")
+        await client.send("C'era una volta ")
+        async for word in client.words():   # words as they are completed
+            ...
+        report = await client.close()        # emits the last word; latency report
+    """
+
+    def __init__(self, session: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.session = session
+        self.reader = reader
+        self.writer = writer
+        self._words: asyncio.Queue = asyncio.Queue()
+        self._replies: Dict[str, asyncio.Future] = {}
+        self._reader_task = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, session: str, host: str = HOST, port: int = PORT) -> "StreamClient":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(session, reader, writer)
+
+    async def _read(self):
+        while line := await self.reader.readline():
+            message = json.loads(line)
+            if message["type"] == "words":
+                for word in message["words"]:
+                    self._words.put_nowait(word)
+            elif message["type"] in self._replies:
+                self._replies.pop(message["type"]).set_result(message)
+            elif message["type"] == "error":
+                logging.error(f"Stream server: {message['message']}")
+                if message.get("session") == self.session:
+                    self._fail(RuntimeError(message["message"]))
+        self._fail(ConnectionError("connection to the stream server closed"))
+        self._words.put_nowait(None)
+
+    def _fail(self, error: Exception):
+        #the pending requests will not get their reply
+        for future in self._replies.values():
+            if not future.done():
+                future.set_exception(error)
+        self._replies.clear()
+
+    async def _request(self, kind: str, reply: Optional[str] = None, **fields) -> Optional[dict]:
+        future = None
+        if reply is not None:
+            future = asyncio.get_running_loop().create_future()
+            self._replies[reply] = future
+        self.writer.write((json.dumps({"type": kind, "session": self.session, **fields}) + "\n").encode("utf-8"))
+        await self.writer.drain()
+        return await future if future is not None else None
+
+    async def send(self, text: str):
+        """
+        Sends the next piece of text (returns without waiting for the words).
+        """
+
+        await self._request("text", text=text)
+
+    async def flush(self):
+        """
+        Marks the end of the text so far: the last word is emitted. Waits until it is.
+
+        Raises:
+            RuntimeError: If the server failed to process the session.
+        """
+
+        await self._request("flush", "flushed")
+
+    async def stats(self) -> dict:
+        return await self._request("stats", "stats")
+
+    async def words(self) -> AsyncIterator[dict]:
+        """
+        Yields the words received so far, then waits for more (ends when the connection closes).
+        """
+
+        while (word := await self._words.get()) is not None:
+            yield word
+
+    def received(self) -> List[dict]:
+        """
+        The words received so far, without waiting.
+        """
+
+        out = []
+        while not self._words.empty():
+            word = self._words.get_nowait()
+            if word is None:
+                break
+            out.append(word)
+        return out
+
+    async def close(self) -> dict:
+        """
+        Ends the session (the last word is emitted) and returns its latency report.
+
+        Raises:
+            RuntimeError: If the server failed to process the session.
+        """
+
+        report = await self._request("close", "closed")
+        self.writer.close()
+        return report
@@ -1,14 +1,168 @@
 import os
 import torch
 import math
+import numpy as np
 import pandas as pd
 import logging
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from nlp_pipeline.utils import reconstruct_words
+from typing import Dict, Iterator, Optional, Tuple
+from nlp_pipeline.cache import FeatureCache, cache_key
+from nlp_pipeline.instrumentation import stage
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.utils import reconstruct_word_arrays
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
-def calculate_surprisal_entropy(filepath: str, output_dir: str):
+CONTEXT_LENGTH = 512  # minimum number of preceding tokens each token is conditioned on
+STRIDE = 256          # number of new tokens fed to the model per forward step
+TOP_K = 10            # number of most probable next tokens summed in the top-k mass
+
+MODEL_NAME = "GroNLP/gpt2-small-italian"
+REVISION = "main"
+
+# word-level aggregation of each next-token statistic (see `reconstruct_word_arrays`)
+STAT_AGGREGATION = {"surprisal": "sum", "entropy": "first", "rank": "first", "topk_mass": "first"}
+
+
+def iter_next_token_logits(model,
+                           input_ids: torch.Tensor,
+                           context_length: int = CONTEXT_LENGTH,
+                           stride: int = STRIDE,
+                           max_length: Optional[int] = None) -> Iterator[Tuple[int, torch.Tensor]]:
+    """
+    Runs a causal language model over a token sequence of arbitrary length with a strided
+    sliding window, carrying `past_key_values` forward between steps.
+
+    The sequence is fed in blocks of `stride` tokens. Inside a window the key/value cache of
+    the previous blocks is reused, so each token is encoded only once. When the next block
+    would exceed `max_length` positions, a new window is started whose cache is primed with
+    the last `context_length` tokens; this prefix is the only part that is ever encoded twice
+    (GPT-2 uses absolute position embeddings, so cached keys cannot be shifted to new positions).
+    The total cost is therefore linear in the length of the sequence.
+
+    Parameters:
+        model: Hugging Face causal language model (e.g. GPT-2), already in evaluation mode.
+        input_ids (torch.Tensor): Token ids of shape (1, n_tokens), on the model device.
+        context_length (int): Minimum number of preceding tokens every token is conditioned on
+            (tokens closer than this to the start of the text see all available context).
+        stride (int): Number of new tokens fed to the model per forward step.
+        max_length (int, optional): Maximum number of positions per window.
+            Defaults to the model's `n_positions`.
+
+    Yields:
+        Tuple[int, torch.Tensor]:
+            - Index of the first token predicted by the block.
+            - Logits of shape (1, n, vocab_size), where row k holds the next-token
+              distribution for token `start + k`.
+
+    Notes:
+        - The first token of the sequence has no prediction and is never yielded.
+        - Requires `context_length + stride <= max_length`.
+    """
+
+    if max_length is None:
+        max_length = model.config.n_positions
+    if not 0 <= context_length < max_length:
+        raise ValueError("context_length must be >= 0 and smaller than max_length")
+    if not 1 <= stride <= max_length - context_length:
+        raise ValueError("stride must be between 1 and max_length - context_length")
+
+    n_tokens = input_ids.size(-1)
+    past = None
+    cache_len = 0
+    prev_logits = None  # distribution for the first token of the next block
+    pos = 0
+
+    with torch.no_grad():
+        while pos < n_tokens:
+            block = input_ids[:, pos:pos + stride]
+
+            #window full: restart the cache from the last `context_length` tokens
+            if cache_len + block.size(-1) > max_length:
+                past = None
+                cache_len = 0
+                if context_length > 0:
+                    prefix = input_ids[:, pos - context_length:pos]
+                    past = model(prefix, use_cache=True).past_key_values
+                    cache_len = context_length
+
+            outputs = model(block, past_key_values=past, use_cache=True)
+            past = outputs.past_key_values
+            cache_len += block.size(-1)
+            logits = outputs.logits
+
+            #logits[:, k] predicts token pos + k + 1
+            if prev_logits is None:
+                if logits.size(1) > 1:
+                    yield pos + 1, logits[:, :-1]
+            else:
+                yield pos, torch.cat([prev_logits, logits[:, :-1]], dim=1)
+            prev_logits = logits[:, -1:]
+            pos += block.size(-1)
+
+
+def next_token_stats(logits: torch.Tensor, targets: torch.Tensor, top_k: int = TOP_K) -> Dict[str, torch.Tensor]:
+    """
+    Computes next-token statistics for a block of predictions from a single log-softmax pass.
+
+    Parameters:
+        logits (torch.Tensor): Logits of shape (n, vocab_size); row k is the distribution for targets[k].
+        targets (torch.Tensor): Ids of the tokens that actually occur, shape (n,).
+        top_k (int): Number of most probable tokens summed in `topk_mass`.
+
+    Returns:
+        Dict[str, torch.Tensor]: Tensors of shape (n,) with
+            - 'surprisal': negative log2 probability of the target token (bits).
+            - 'entropy': entropy of the full next-token distribution (bits).
+            - 'rank': 1-based rank of the target token in the distribution.
+            - 'topk_mass': probability mass of the `top_k` most probable tokens.
+    """
+
+    log_probs = torch.log_softmax(logits.float(), dim=-1)
+    probs = log_probs.exp()
+    target_log_prob = log_probs.gather(-1, targets.unsqueeze(-1))
+
+    return {
+        "surprisal": -target_log_prob.squeeze(-1) / math.log(2),
+        "entropy": -torch.special.xlogy(probs, probs).sum(dim=-1) / math.log(2),
+        "rank": (log_probs > target_log_prob).sum(dim=-1).float() + 1,
+        "topk_mass": probs.topk(min(top_k, probs.size(-1)), dim=-1).values.sum(dim=-1),
+    }
+
+
+def token_stats(model,
+                input_ids: torch.Tensor,
+                context_length: int = CONTEXT_LENGTH,
+                stride: int = STRIDE,
+                max_length: Optional[int] = None,
+                top_k: int = TOP_K) -> torch.Tensor:
+    """
+    Next-token statistics of every token of a sequence (see `iter_next_token_logits` and
+    `next_token_stats`).
+
+    Returns:
+        torch.Tensor: (len(STAT_AGGREGATION), n_tokens) statistics on the CPU, in the order of
+        `STAT_AGGREGATION`; the first token has no prediction and stays NaN.
+    """
+
+    stats = torch.full((len(STAT_AGGREGATION), input_ids.size(-1)), float("nan"))
+
+    #compute all statistics for a whole window block at once, with one transfer per block
+    for start, logits in iter_next_token_logits(model, input_ids, context_length, stride, max_length):
+        targets = input_ids[0, start:start + logits.size(1)]
+        block_stats = next_token_stats(logits[0], targets, top_k)
+        stats[:, start:start + targets.size(0)] = torch.stack([block_stats[name] for name in STAT_AGGREGATION]).cpu()
+    return stats
+
+
+def calculate_surprisal_entropy(filepath: str,
+                                output_dir: str,
+                                context_length: int = CONTEXT_LENGTH,
+                                stride: int = STRIDE,
+                                max_length: Optional[int] = None,
+                                top_k: int = TOP_K,
+                                cache: Optional[FeatureCache] = None,
+                                model_name: str = MODEL_NAME,
+                                precision: str = "float32"):
     """
     Calculates token-level surprisal and entropy values for a text file using GroNLP/gpt2-small-italian-
 
@@ -18,16 +172,34 @@ def calculate_surprisal_entropy(filepath: str, output_dir: str):
     Parameters:
         filepath (str): Path to the input .txt file.
         output_dir (str): Root directory where output subfolders will be created.
+        context_length (int): Minimum number of preceding tokens each token is conditioned on.
+        stride (int): Number of new tokens fed to the model per forward step.
+        max_length (int, optional): Window size in positions (default: the model's `n_positions`).
+        top_k (int): Number of most probable next tokens summed in the top-k probability mass.
+        cache (FeatureCache, optional): On-disk cache of the token-level statistics. When given,
+            the model is only run for texts that are not cached yet, so the word-level
+            aggregation can be changed without re-running inference.
+        model_name (str): Causal language model (Hugging Face name or local directory).
+        precision (str): 'float32', or 'int8' / 'bfloat16' for faster CPU inference (see
+            `nlp_pipeline.quantization`; its effect on the statistics is measured by
+            `validate_precision`).
 
     Outputs:
-        - A CSV file containing word-level surprisal values in bits:
-          columns include the word and its surprisal score.
+        - A CSV file containing word-level next-token statistics:
+          columns include the word, its surprisal and the entropy of the next-token
+          distribution at word onset (both in bits), the rank of the word's first token
+          and the top-k probability mass.
           
     Notes:
         - The function uses the Hugging Face `AutoTokenizer` and `AutoModelForCausalLM`
-          to tokenize the text and compute log-probabilities.
+          to tokenize the text and compute log-probabilities. Both are loaded once per process
+          (see `nlp_pipeline.models`).
         - Surprisal is computed as the negative log2 probability of each token,
           aggregated at the word level thanks to the function 'reconstructed_words' from utils.py.
+        - All statistics come from the same log-softmax pass (see `next_token_stats`);
+          their word-level aggregation is defined in `STAT_AGGREGATION`.
+        - Texts longer than the model's position limit are processed with a strided sliding
+          window (see `iter_next_token_logits`), so the cost grows linearly with the text length.
         - Output filenames are automatically derived from the input filename.
         - Logging messages indicate which file is being processed and where the
           resulting CSV is saved.
@@ -36,52 +208,48 @@ def calculate_surprisal_entropy(filepath: str, output_dir: str):
     logging.info(f"Processing file: {filepath}")
 
    
-    tokenizer = AutoTokenizer.from_pretrained("GroNLP/gpt2-small-italian")
-    model = AutoModelForCausalLM.from_pretrained("GroNLP/gpt2-small-italian")
-    
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-   
-   #set model to evaluation mode (disables dropiut, etc.)
-    model.eval()
+    tokenizer = get_tokenizer(model_name, REVISION)
 
     with open(filepath, "r", encoding="utf-8") as infile:
         text = infile.read().replace("\n", " ").replace("\r", " ")
-   
-   #tokenize the text without adding special tokens 
-    inputs = tokenizer(text, return_tensors="pt", add_special_tokens=False)
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    input_ids = inputs["input_ids"]
-
-    #compute model output
-    with torch.no_grad(): #disable gradient computation 
-        outputs = model(**inputs)
-        logits = outputs.logits
-
-    #convert logits (unnormalized log probabilities) using log-softmax across the vocabulary
-    log_probs = torch.log_softmax(logits, dim=-1)    
-    tokens = tokenizer.convert_ids_to_tokens(input_ids[0])
-
-    #initialize a list to store surprisal values (one per token) 
-    values_surprisal = [float("nan")] * len(tokens)
-    values_entropy = [float("nan")] * len(tokens)
-    
-    #compute surprisal for each token based on its log-probability
-    for i in range(1, len(tokens)):
-        token_id = int(input_ids[0, i].item())
-        if (i - 1) >= log_probs.shape[1]:
-            values_surprisal[i] = float("nan")
-            continue
-        log_prob = float(log_probs[0, i - 1, token_id].item())
-        
-        #compute surprisal in bits
-        surprisal = -log_prob / math.log(2)
-        values_surprisal[i] = surprisal
-
-
-    #reconstruct words from subtokens and aggregate surprisal values per word
-    words, word_surprisal = reconstruct_words(tokens, values_surprisal, tokenizer, agg="sum")
-    df = pd.DataFrame({"word": words, "surprisal": word_surprisal})
+
+    settings = {"context_length": context_length, "stride": stride, "max_length": max_length,
+                "top_k": top_k, "add_special_tokens": False}
+    if precision != "float32":
+        settings["precision"] = precision  # float32 keys are unchanged
+    key = cache_key(text, model_name, REVISION, settings)
+    entry = cache.get(key) if cache is not None else None
+
+    if entry is not None:
+        tokens = entry["tokens"]
+        stats = torch.from_numpy(np.array(entry["stats"]))
+    else:
+        #shared model, already in evaluation mode (disables dropiut, etc.)
+        model = get_model(model_name, "causal", REVISION, precision=precision)
+        device = model.device
+
+        #tokenize the text without adding special tokens 
+        with stage("tokenization", item=filepath, chars=len(text)) as s:
+            inputs = tokenizer(text, return_tensors="pt", add_special_tokens=False)
+            input_ids = inputs["input_ids"].to(device)
+            tokens = tokenizer.convert_ids_to_tokens(input_ids[0])
+            s.add(tokens=len(tokens))
+
+        with stage("model_forward", item=filepath, tokens=len(tokens)):
+            stats = token_stats(model, input_ids, context_length, stride, max_length, top_k)
+
+        if cache is not None:
+            cache.put(key, {"stats": stats.numpy(), "input_ids": input_ids[0].cpu().numpy()}, tokens,
+                      {"model": model_name, "revision": REVISION, "precision": precision, "file": filepath,
+                       "stats": list(STAT_AGGREGATION)})
+
+    #reconstruct words from subtokens and aggregate all statistics per word in one call
+    token_values = {name: stats[j].numpy() for j, name in enumerate(STAT_AGGREGATION)}
+    with stage("word_reconstruction", item=filepath, tokens=len(tokens)) as s:
+        words, word_values = reconstruct_word_arrays(tokens, token_values, tokenizer, agg=STAT_AGGREGATION)
+        s.add(words=len(words))
+    df = pd.DataFrame({"word": words, **word_values})
+    df = df.rename(columns={"topk_mass": f"top{top_k}_mass"})
     
     name_base = os.path.splitext(os.path.basename(filepath))[0]
     file_output_dir = os.path.join (output_dir, name_base)
@@ -0,0 +1,265 @@
+import os
+import logging
+import torch
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from nlp_pipeline import semantic_dissimilarity as dissimilarity
+from nlp_pipeline import surprisal
+from nlp_pipeline.alignment import story_events
+from nlp_pipeline.cache import FeatureCache, cache_key
+from nlp_pipeline.instrumentation import stage, trace_item
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.utils import AGGREGATIONS, normalize_text, reconstruct_word_arrays
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+#parameters
+MODELS = {"gpt2": (surprisal.MODEL_NAME, "causal"),
+          "umberto": (dissimilarity.MODEL_NAME, "encoder")}  # label -> (model name or directory, kind)
+LAYERS = (dissimilarity.N_LAYERS,)    # layer selections: n (mean of the last n layers) or a tuple of layer indices
+WINDOWS = (dissimilarity.WINDOW_SIZE,)
+# word-level aggregation of each token-level feature when no aggregation grid is given
+DEFAULT_AGGREGATION = {**surprisal.STAT_AGGREGATION, "semantic_dissimilarity": "mean"}
+PANDAS_AGGREGATION = {"product": "prod"}  # names of the aggregations in pandas, where they differ
+
+LayerSelection = Union[int, Tuple[int, ...]]
+
+
+def read_text(filepath: str, normalize: bool = True) -> str:
+    """
+    Reads a story as one line (as the feature scripts do), optionally with `normalize_text`
+    (NFC, ASCII apostrophes), so that every model sees exactly the same string.
+    """
+
+    with open(filepath, "r", encoding="utf-8") as f:
+        text = f.read().replace("\n", " ").replace("\r", " ")
+    return normalize_text(text) if normalize else text
+
+
+def layers_label(layers: LayerSelection) -> str:
+    """
+    Column label of a layer selection: 'last4' for the last 4 layers, 'L8-10-12' for layers 8, 10, 12.
+    """
+
+    if isinstance(layers, (int, np.integer)):
+        return f"last{int(layers)}"
+    return "L" + "-".join(str(int(i)) for i in layers)
+
+
+def select_layers(hidden_states: torch.Tensor, layers: LayerSelection) -> torch.Tensor:
+    """
+    Token embeddings of a layer selection: the mean of the selected hidden layers.
+
+    Parameters:
+        hidden_states (torch.Tensor): (n_layers + 1, n_tokens, hidden_size) hidden states
+            (index 0 is the embedding layer, see `encode_chunks`).
+        layers (int or Tuple[int, ...]): n (the last n layers, as `N_LAYERS`) or layer indices.
+
+    Returns:
+        torch.Tensor: (n_tokens, hidden_size) embeddings.
+    """
+
+    n_states = hidden_states.shape[0]
+    if isinstance(layers, (int, np.integer)):
+        if not 1 <= layers <= n_states:
+            raise ValueError(f"cannot average the last {layers} layers of {n_states} hidden states")
+        return hidden_states[-int(layers):].mean(dim=0)
+    indices = [int(i) for i in layers]
+    if not indices or any(not -n_states <= i < n_states for i in indices):
+        raise ValueError(f"layer indices {indices} out of range for {n_states} hidden states")
+    return hidden_states[indices].mean(dim=0)
+
+
+def _encoder_states(text: str, model_name: str, tokenizer, cache: Optional[FeatureCache],
+                    precision: str, batch_size: Optional[int], filepath: str) -> Tuple[List[str], torch.Tensor]:
+    #tokens and hidden states of every layer, from the cache of `calculate_semantic_dissimilarity` when possible
+    settings = dissimilarity.CHUNK_SETTINGS if precision == "float32" else {**dissimilarity.CHUNK_SETTINGS,
+                                                                           "precision": precision}
+    key = cache_key(text, model_name, dissimilarity.REVISION, settings)
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None:
+        return entry["tokens"], torch.from_numpy(np.array(entry["hidden_states"], dtype=np.float32))
+
+    model = get_model(model_name, "encoder", dissimilarity.REVISION, precision=precision)
+    with trace_item(filepath):
+        tokens, offsets, hidden_states = dissimilarity.encode_chunks(text, tokenizer, model, model.device, batch_size)
+    if cache is not None:
+        cache.put(key, {"hidden_states": hidden_states.numpy(), "offsets": offsets.numpy()}, tokens,
+                  {"model": model_name, "revision": dissimilarity.REVISION, "precision": precision, "file": filepath})
+    return tokens, hidden_states
+
+
+def _causal_stats(text: str, model_name: str, tokenizer, cache: Optional[FeatureCache],
+                  precision: str, lm_kwargs: dict, filepath: str) -> Tuple[List[str], torch.Tensor]:
+    #tokens and next-token statistics, from the cache of `calculate_surprisal_entropy` when possible
+    settings = {"context_length": lm_kwargs["context_length"], "stride": lm_kwargs["stride"],
+                "max_length": lm_kwargs["max_length"], "top_k": lm_kwargs["top_k"], "add_special_tokens": False}
+    if precision != "float32":
+        settings["precision"] = precision
+    key = cache_key(text, model_name, surprisal.REVISION, settings)
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None:
+        return entry["tokens"], torch.from_numpy(np.array(entry["stats"]))
+
+    model = get_model(model_name, "causal", surprisal.REVISION, precision=precision)
+    with stage("tokenization", item=filepath, chars=len(text)) as s:
+        input_ids = tokenizer(text, return_tensors="pt", add_special_tokens=False)["input_ids"].to(model.device)
+        tokens = tokenizer.convert_ids_to_tokens(input_ids[0])
+        s.add(tokens=len(tokens))
+    with stage("model_forward", item=filepath, tokens=len(tokens)):
+        stats = surprisal.token_stats(model, input_ids, **lm_kwargs)
+    if cache is not None:
+        cache.put(key, {"stats": stats.numpy(), "input_ids": input_ids[0].cpu().numpy()}, tokens,
+                  {"model": model_name, "revision": surprisal.REVISION, "precision": precision, "file": filepath,
+                   "stats": list(surprisal.STAT_AGGREGATION)})
+    return tokens, stats
+
+
+def _check_grid(models: Dict[str, Tuple[str, str]], layers: Sequence[LayerSelection], windows: Sequence[int],
+                aggregations: Optional[Sequence[str]], stats: Sequence[str]):
+    if not models:
+        raise ValueError("at least one model is required")
+    if any(kind not in {"causal", "encoder"} for _, kind in models.values()):
+        raise ValueError("model kinds must be 'causal' or 'encoder'")
+    if any(isinstance(w, bool) or not isinstance(w, (int, np.integer)) or w < 1 for w in windows):
+        raise ValueError("window sizes must be positive integers")
+    if not layers or any(not isinstance(l, (int, np.integer)) and not len(l) for l in layers):
+        raise ValueError("layer selections must be a number of last layers or a non-empty tuple of indices")
+    if aggregations is not None and (not aggregations or any(a not in AGGREGATIONS for a in aggregations)):
+        raise ValueError("aggregations must be among 'mean', 'sum', 'product' and 'first'")
+    if any(s not in surprisal.STAT_AGGREGATION for s in stats):
+        raise ValueError(f"stats must be among {list(surprisal.STAT_AGGREGATION)}")
+
+
+def sweep(text_files: Sequence[str],
+          models: Optional[Dict[str, Tuple[str, str]]] = None,
+          layers: Sequence[LayerSelection] = LAYERS,
+          windows: Sequence[int] = WINDOWS,
+          aggregations: Optional[Sequence[str]] = None,
+          stats: Optional[Sequence[str]] = None,
+          cache: Optional[FeatureCache] = None,
+          precision: str = "float32",
+          batch_size: Optional[int] = None,
+          lm_kwargs: Optional[dict] = None,
+          normalize: bool = True,
+          out_path: Optional[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Computes a grid of word-level feature variants, with a single forward pass per model and story.
+
+    Every story is read and normalized once and given to all models. Each encoder yields the
+    hidden states of all its layers in one pass (see `encode_chunks`), from which the semantic
+    dissimilarity of every layer selection x window size x word aggregation is derived; each
+    causal language model yields its next-token statistics in one pass (see `token_stats`),
+    aggregated to words with every aggregation. The words of every model are then aligned onto
+    those of the first model (see `alignment.story_events`) into one wide table.
+
+    Parameters:
+        text_files (Sequence[str]): Story .txt files.
+        models (dict, optional): label -> (model name or directory, 'causal' or 'encoder');
+            default `MODELS` (GroNLP GPT-2 and UmBERTo). Several models of a kind can be compared.
+        layers (Sequence): Layer selections of the encoders: n (mean of the last n hidden
+            layers, default 4) or a tuple of layer indices (0 is the embedding layer).
+        windows (Sequence[int]): Context window sizes of the dissimilarity, in tokens.
+        aggregations (Sequence[str], optional): Word-level aggregations ('mean', 'sum', 'product',
+            'first'), applied to every feature; default one per feature (`DEFAULT_AGGREGATION`).
+        stats (Sequence[str], optional): Next-token statistics of the causal models
+            (default: all of `surprisal.STAT_AGGREGATION`).
+        cache (FeatureCache, optional): Cache shared with `calculate_surprisal_entropy` and
+            `calculate_semantic_dissimilarity`: texts they have already encoded are not re-run.
+            The entries are keyed on the text as tokenized, and the feature scripts do not
+            normalize it: with `normalize=True`, a story that `normalize_text` changes (e.g.
+            typographic apostrophes) does not reuse their entries.
+        precision (str): 'float32', 'int8' or 'bfloat16' (see `nlp_pipeline.quantization`).
+        batch_size (int, optional): Maximum number of 512-token chunks per encoder forward pass.
+        lm_kwargs (dict, optional): `token_stats` options (context_length, stride, max_length, top_k).
+        normalize (bool): Apply `normalize_text` to the stories before tokenization.
+        out_path (str, optional): CSV of the wide table.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]:
+            - Wide table: 'story', 'word_index', 'word' (words of the first model), then one
+              column per model x feature x grid point, e.g. 'umberto_semantic_dissimilarity_last4_w20_mean'
+              or 'gpt2_surprisal_sum' (NaN for words another model does not cover).
+            - Grid: one row per feature column, with 'column', 'model', 'model_name', 'feature',
+              'layers', 'window' and 'aggregation', to select or group the columns.
+
+    Notes:
+        - The cost is one forward pass per model and story whatever the size of the grid; the
+          grid itself only adds layer averages, one cumulative sum per layer selection (see
+          `windowed_dissimilarities`) and one word reconstruction per model and story.
+        - The layer/window grid applies to the encoders; the causal models contribute their
+          next-token statistics (surprisal, entropy, rank, top-k mass).
+        - With the default aggregations and `normalize=False`, the columns equal the outputs
+          of the two feature scripts, and their cache entries are reused.
+    """
+
+    models = dict(models or MODELS)
+    stats = list(stats or surprisal.STAT_AGGREGATION)
+    layers, windows = list(layers), [int(w) for w in windows]
+    _check_grid(models, layers, windows, aggregations, stats)
+    lm_kwargs = {"context_length": surprisal.CONTEXT_LENGTH, "stride": surprisal.STRIDE,
+                 "max_length": None, "top_k": surprisal.TOP_K, **(lm_kwargs or {})}
+    top_k_name = f"top{lm_kwargs['top_k']}_mass"
+
+    tables, grid = [], {}
+    for filepath in text_files:
+        story = os.path.splitext(os.path.basename(filepath))[0]
+        logging.info(f"Processing file: {filepath}")
+        text = read_text(filepath, normalize)
+
+        model_tables = {}
+        for label, (model_name, kind) in models.items():
+            revision = surprisal.REVISION if kind == "causal" else dissimilarity.REVISION
+            tokenizer = get_tokenizer(model_name, revision)
+            columns, methods = {}, {}
+
+            def add(feature, values, aggregation, layer_selection=None, window=None):
+                name = "_".join([label, feature] + ([layers_label(layer_selection), f"w{window}"]
+                                                    if window is not None else []) + [aggregation])
+                columns[name], methods[name] = values, aggregation
+                grid[name] = {"column": name, "model": label, "model_name": model_name, "feature": feature,
+                              "layers": layers_label(layer_selection) if layer_selection is not None else None,
+                              "window": window, "aggregation": aggregation}
+
+            if kind == "encoder":
+                tokens, hidden_states = _encoder_states(text, model_name, tokenizer, cache, precision,
+                                                        batch_size, filepath)
+                with stage("feature_grid", item=filepath, tokens=len(tokens),
+                           variants=len(layers) * len(windows)):
+                    for layer_selection in layers:
+                        embeddings = select_layers(hidden_states, layer_selection)
+                        values = dissimilarity.windowed_dissimilarities(embeddings, windows).numpy()
+                        for window, window_values in zip(windows, values):
+                            for aggregation in aggregations or [DEFAULT_AGGREGATION["semantic_dissimilarity"]]:
+                                add("semantic_dissimilarity", window_values, aggregation, layer_selection, window)
+            else:
+                tokens, token_stats = _causal_stats(text, model_name, tokenizer, cache, precision,
+                                                    lm_kwargs, filepath)
+                for j, stat in enumerate(surprisal.STAT_AGGREGATION):
+                    if stat in stats:
+                        for aggregation in aggregations or [DEFAULT_AGGREGATION[stat]]:
+                            add(top_k_name if stat == "topk_mass" else stat, token_stats[j].numpy(), aggregation)
+
+            #one reconstruction per model: the word boundaries are shared by all grid points
+            with stage("word_reconstruction", item=filepath, tokens=len(tokens)) as s:
+                words, word_values = reconstruct_word_arrays(tokens, columns, tokenizer, agg=methods)
+                s.add(words=len(words))
+            model_tables[label] = (pd.DataFrame({"word": words, **word_values}), methods)
+
+        #align the words of the other models onto those of the first one
+        (reference, _), *others = model_tables.values()
+        features = {label: (table, "word") for label, (table, _) in list(model_tables.items())[1:]}
+        agg = {name: PANDAS_AGGREGATION.get(method, method)
+               for _, methods in others for name, method in methods.items()}
+        events, _ = story_events(reference, features, story, word_column="word", agg=agg)
+        tables.append(events)
+
+    table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    grid = pd.DataFrame(list(grid.values()),
+                        columns=["column", "model", "model_name", "feature", "layers", "window", "aggregation"])
+    logging.info(f"Sweep: {len(text_files)} stories, {len(models)} models, {len(grid)} feature columns")
+    if out_path:
+        table.to_csv(out_path, index=False)
+        logging.info(f"Saved CSV: {out_path}")
+    return table, grid
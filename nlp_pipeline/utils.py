@@ -1,10 +1,46 @@
-import torch
+import os
 import unicodedata
 import string
-from typing import List, Tuple
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+PUNCT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "unicode_punct.txt")
+
+
+def build_punctuation_table(path: str = PUNCT_FILE) -> Set[str]:
+    """
+    Scans all Unicode code points for punctuation (category 'P*') and writes them to `path`.
+
+    The scan takes seconds, so it is run once to (re)generate the packaged table, e.g. after a
+    Python upgrade with a newer Unicode database; importing this module only reads the file.
+
+    Returns:
+        Set[str]: The punctuation characters.
+    """
+
+    punct = {chr(i) for i in range(0x110000) if unicodedata.category(chr(i)).startswith("P")}
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"unicodedata {unicodedata.unidata_version}\n")
+        f.write("".join(sorted(punct)))
+    return punct
+
+
+def load_punctuation_table(path: str = PUNCT_FILE) -> Set[str]:
+    """
+    Reads the packaged table of Unicode punctuation characters (first line: Unicode version).
+    Falls back to scanning all code points when the file is missing.
+    """
+
+    if not os.path.exists(path):
+        return build_punctuation_table(path)
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        f.readline()
+        return set(f.read())
+
 
 APOSTROPHE_VARIANTS = {"'", "\u2019", "\u2018", "\u02BC", "\uFF07"}  
-UNICODE_PUNCT = {chr(i) for i in range(0x110000) if unicodedata.category(chr(i)).startswith("P")}
+APOSTROPHE_TABLE = str.maketrans({v: "'" for v in APOSTROPHE_VARIANTS if v != "'"})
+UNICODE_PUNCT = load_punctuation_table()
 STRIP_CHARS = "".join(UNICODE_PUNCT - APOSTROPHE_VARIANTS)
 
 def normalize_text(text: str) -> str:
@@ -30,16 +66,186 @@ def normalize_text(text: str) -> str:
     
     if not isinstance(text, str):
         text = str(text)
-    s = unicodedata.normalize("NFC", text)
-    for v in APOSTROPHE_VARIANTS:
-        if v!= "'":
-            s = s.replace(v, "'")
-    return s
+    if text.isascii():
+        return text  # already NFC, and the only ASCII apostrophe is (')
+    return unicodedata.normalize("NFC", text).translate(APOSTROPHE_TABLE)
+
+AGGREGATIONS = {"mean", "sum", "product", "first"}
+MARKERS = ("▁", "Ġ") # '_' for SentencePiece, 'Ġ' for BPE
+
+
+def word_boundaries(tokens: Sequence[str]) -> Tuple[np.ndarray, List[List[str]], np.ndarray]:
+    """
+    Computes the subword-token spans of the words in a token sequence.
+
+    Parameters:
+        tokens (Sequence[str]): Subword tokens as produced by the tokenizer.
+
+    Returns:
+        Tuple[np.ndarray, List[List[str]], np.ndarray]:
+            - Token spans of shape (n_words, 2): word k covers tokens [start, end).
+            - The normalized pieces of each word (marker removed), ready for
+              `tokenizer.convert_tokens_to_string`.
+            - Boolean mask of lone apostrophes, whose value is kept unaggregated.
+
+    Notes:
+        - A token starting with a marker ('▁' or 'Ġ') opens a new word; a bare marker token
+          belongs to no word.
+        - A bare apostrophe token closes the current word (e.g. "l'" + "uomo"); without a
+          current word it forms a word of its own.
+    """
+
+    spans: List[Tuple[int, int]] = []
+    pieces: List[List[str]] = []
+    lone: List[bool] = []
+    current: List[str] = []
+    start = 0
+
+    for i, tok_raw in enumerate(tokens):
+        tok = normalize_text(tok_raw)
+
+        # marker at the beginning of token (both markers are single characters)
+        if tok.startswith(MARKERS):
+            if current:
+                spans.append((start, i))
+                pieces.append(current)
+                lone.append(False)
+            body = tok[1:]
+            current = [body] if body else []
+            start = i
+        elif tok == "'":
+            if current:
+                current[-1] = current[-1] + "'"
+                spans.append((start, i + 1))
+                pieces.append(current)
+                lone.append(False)
+                current = []
+            else:
+                spans.append((i, i + 1))
+                pieces.append(["'"])
+                lone.append(True)
+        else:
+            if not current:
+                start = i
+            current.append(tok)
+
+    if current:
+        spans.append((start, len(tokens)))
+        pieces.append(current)
+        lone.append(False)
+
+    return np.asarray(spans, dtype=np.int64).reshape(-1, 2), pieces, np.asarray(lone, dtype=bool)
+
+
+def _segment_reduce(values: np.ndarray, spans: np.ndarray, lone: np.ndarray, method: str) -> np.ndarray:
+    """
+    Aggregates token values over word spans with NumPy segment reductions.
+
+    Values are rounded to float32 (like the token-level features) and reduced in float64; NaNs
+    are ignored (mean/sum) or treated as 1.0 (product). Lone apostrophes keep their raw value.
+    """
+
+    lengths = spans[:, 1] - spans[:, 0]
+    seg_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    # token indices of all words, concatenated (spans may leave gaps between words)
+    take = np.arange(lengths.sum()) - np.repeat(seg_starts - spans[:, 0], lengths)
+    vals = values[take].astype(np.float32).astype(np.float64)
+    nan = np.isnan(vals)
+
+    if method == "mean":
+        total = np.add.reduceat(np.where(nan, 0.0, vals), seg_starts)
+        count = np.add.reduceat((~nan).astype(np.float64), seg_starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = total / count
+    elif method == "sum":
+        out = np.add.reduceat(np.where(nan, 0.0, vals), seg_starts)
+    elif method == "first":
+        out = vals[seg_starts]
+    else:  # product
+        out = np.multiply.reduceat(np.where(nan, 1.0, vals), seg_starts)
+
+    out[lone] = values[spans[lone, 0]]
+    return out
+
+
+def reconstruct_word_arrays(tokens: Sequence[str],
+                            values: Union[Sequence[float], np.ndarray, Dict[str, Sequence[float]]],
+                            tokenizer=None,
+                            agg: Union[str, Dict[str, str]] = "mean",
+                            text: Optional[str] = None,
+                            offsets: Optional[np.ndarray] = None,
+                            return_spans: bool = False):
+    """
+    Array-based version of `reconstruct_words`: reconstructs words from subword tokens and
+    aggregates token-level values with NumPy segment reductions (`np.ufunc.reduceat`).
+
+    Parameters:
+        tokens (Sequence[str]): Subword tokens as produced by the tokenizer.
+        values (array-like or Dict[str, array-like]): Token-level values, or a dict of them
+            (one per feature) to aggregate several features in one call.
+        tokenizer: Hugging Face tokenizer used to decode subword tokens back into strings.
+            Not needed when `text` and `offsets` are given.
+        agg (str or Dict[str, str], optional): 'mean', 'sum', 'product' or 'first',
+            or one method per feature. Default is 'mean'.
+        text (str, optional): Text the tokens were produced from.
+        offsets (np.ndarray, optional): Character offsets of the tokens, shape (n_tokens, 2)
+            (e.g. the tokenizer's `offset_mapping`). With `text`, word strings are sliced from
+            the text instead of being decoded token by token.
+        return_spans (bool): Also return the token span of each word.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray or Dict[str, np.ndarray]] (+ spans if `return_spans`):
+            - Array of reconstructed words (dtype object).
+            - Array of aggregated values (float64), or a dict of arrays for dict input.
+            - Token spans of shape (n_words, 2), if requested.
+
+    Notes:
+        - With the tokenizer (default), the words are identical to those of the original
+          token-by-token implementation (float32 torch reductions), and so are the values of
+          single-token words and 'first'. Multi-token means, sums and products are accumulated
+          in float64, so they differ from the float32 results by float32 rounding only
+          (relative 1e-6, see tests/test_reconstruct_words.py).
+        - Words are cleaned of Unicode punctuation (except apostrophes) and empty words are
+          dropped, exactly as in `reconstruct_words`.
+    """
+
+    single = not isinstance(values, dict)
+    columns = {"value": values} if single else values
+    aggs = agg if isinstance(agg, dict) else {name: agg for name in columns}
+    if set(aggs) != set(columns):
+        raise ValueError("agg must define one aggregation method per feature")
+    if any(a not in AGGREGATIONS for a in aggs.values()):
+        raise ValueError("agg must be 'mean', 'sum', 'product' or 'first'")
+
+    spans, pieces, lone = word_boundaries(tokens)
+
+    if text is not None and offsets is not None:
+        offsets = np.asarray(offsets)
+        words = [normalize_text(text[offsets[s, 0]:offsets[e - 1, 1]]).strip() for s, e in spans]
+    else:
+        words = ["'" if is_lone else tokenizer.convert_tokens_to_string(p).strip()
+                 for p, is_lone in zip(pieces, lone)]
+
+    #clean punctuation and drop empty words
+    cleaned = [w.strip(STRIP_CHARS) for w in words]
+    keep = np.fromiter((bool(w) for w in cleaned), dtype=bool, count=len(cleaned))
+    spans, lone = spans[keep], lone[keep]
+    out_words = np.asarray([w for w, k in zip(cleaned, keep) if k], dtype=object)
+
+    if len(spans):
+        out_values = {name: _segment_reduce(np.asarray(vals, dtype=np.float64), spans, lone, aggs[name])
+                      for name, vals in columns.items()}
+    else:
+        out_values = {name: np.empty(0) for name in columns}
+
+    result = (out_words, out_values["value"] if single else out_values)
+    return result + (spans,) if return_spans else result
+
 
 def reconstruct_words(tokens: List[str],
-                      values: List[float],
+                      values: Union[List[float], Dict[str, List[float]]],
                       tokenizer,
-                      agg: str = "mean") -> Tuple[List[str], List[float]]:
+                      agg: Union[str, Dict[str, str]] = "mean"):
     """
     Reconstructs words and aggregates token-level values (e.g., surprisal or dissimilarity)
     at the word level.
@@ -49,13 +255,16 @@ def reconstruct_words(tokens: List[str],
 
     Parameters:
         tokens (List[str]): List of subword tokens as produced by the tokenizer.
-        values (List[float]): List of token-level numeric values (e.g., surprisal or similarity).
+        values (List[float] or Dict[str, List[float]]): List of token-level numeric values
+            (e.g., surprisal or similarity), or a dict of such lists (one per feature) to
+            aggregate several features in a single call.
         tokenizer: Hugging Face tokenizer used to decode subword tokens back into strings.
-        agg (str, optional): Aggregation method for token-level values within a word.
-            Supported: 'mean', 'sum' or 'product'. Default is 'mean'.
+        agg (str or Dict[str, str], optional): Aggregation method for token-level values within a word.
+            Supported: 'mean', 'sum', 'product' or 'first'. Default is 'mean'.
+            When `values` is a dict, a dict with one method per feature can be given.
 
     Returns:
-        Tuple[List[str], List[float]]:
+        Tuple[List[str], List[float]] (or Tuple[List[str], Dict[str, List[float]]] for dict input):
             - A list of reconstructed words.
             - A list of aggregated numeric values corresponding to each word.
 
@@ -63,90 +272,14 @@ def reconstruct_words(tokens: List[str],
         - Supports both SentencePiece-style ('▁') and BPE-style ('Ġ') subword markers.
         - Apostrophes (') are handled to correctly merge contractions (e.g., "l'" + "uomo").
         - Unicode punctuation is removed except for apostrophes.
-        - Uses `torch.nanmean` or `torch.nansum` to handle missing (NaN) values robustly.
+        - NaN values are ignored by 'mean' and 'sum' and treated as 1.0 by 'product'.
+        - 'first' keeps the value of the first subword token (e.g. next-token entropy at word onset).
         - The punctuation set is defined globally (`STRIP_CHARS`) using all Unicode characters
           with category starting with 'P', ensuring language-independent cleanup.
+        - This is a list-returning wrapper around `reconstruct_word_arrays`.
     """
-   
-    if agg not in {"mean", "sum", "product"}:
-        raise ValueError("agg must be 'mean', 'sum' or 'product'")
-
-    markers = ("▁", "Ġ") # '_' for SentencePiece, 'Ġ' for BPE
-    words: List[str] = []
-    agg_values: List[float] = []
-    current_tokens: List[str] = []
-    current_vals: List[float] = []
-    
-    def _aggregate_from_vals(vals: List[float]) -> float:
-        t = torch.tensor(vals, dtype=torch.float32)
-        if agg == "mean":
-            return float(torch.nanmean(t))
-        elif agg == "sum":
-            return float(torch.nansum(t))
-        else:  # product
-            t_nonan = torch.nan_to_num(t, nan=1.0)  # NaN -> 1.0 
-            return float(torch.prod(t_nonan))
-
-    for tok_raw, val in zip(tokens, values):
-        tok = normalize_text(tok_raw)
-
-        # marker at the beginning of token
-        starts_with_marker = False
-        marker = None
-        for m in markers:
-            if tok.startswith(m):
-                starts_with_marker = True
-                marker = m
-                break
-
-        if starts_with_marker:
-            if current_tokens:
-                word = tokenizer.convert_tokens_to_string(current_tokens).strip()
-                if word:
-                    agg_val = _aggregate_from_vals(current_vals)
-                    words.append(word)
-                    agg_values.append(agg_val)
-
-
-            tok_without_marker = tok[len(marker):]
-            current_tokens = []
-            current_vals = []
-            if tok_without_marker:
-                current_tokens = [tok_without_marker]
-                current_vals = [float(val)]
-
-        elif tok == "'":
-            if current_tokens:
-                current_tokens[-1] = current_tokens[-1] + "'"
-                current_vals.append(float(val))
-                word = tokenizer.convert_tokens_to_string(current_tokens).strip()
-                if word:
-                    agg_val = _aggregate_from_vals(current_vals)
-                    words.append(word)
-                    agg_values.append(agg_val)
-                current_tokens = []
-                current_vals = []
-            else:
-                words.append("'")
-                agg_values.append(float(val))
-        else:
-            current_tokens.append(tok)
-            current_vals.append(float(val))
-
-    if current_tokens:
-        word = tokenizer.convert_tokens_to_string(current_tokens).strip()
-        if word:
-            agg_val = _aggregate_from_vals(current_vals)
-            words.append(word)
-            agg_values.append(agg_val)
-
-    cleaned_words: List[str] = []
-    cleaned_vals: List[float] = []
-    
-    for w, v in zip(words, agg_values):
-        w_clean = w.strip(STRIP_CHARS)
-        if w_clean:
-            cleaned_words.append(w_clean)
-            cleaned_vals.append(v)
 
-    return cleaned_words, cleaned_vals
+    words, values = reconstruct_word_arrays(tokens, values, tokenizer, agg)
+    if isinstance(values, dict):
+        return words.tolist(), {name: v.tolist() for name, v in values.items()}
+    return words.tolist(), values.tolist()
@@ -1,52 +1,60 @@
-import numpy as np
+import os
+import sys
 import pandas as pd
+from rendering import load_bounds, render_predictors, save_predictors
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # nlp_pipeline
+from nlp_pipeline.alignment import story_events
 
 #parameters
 FS = 100                  # target sampling rate (Hz)
 AUDIO_FS = 44100          # original audio sampling rate (Hz)
-DURATION_S = 3 * 60 + 43  # total duration of the stimulus (s)
-
-CSV_FEATURES = "path_to_feature_file.csv"
-XLSX_BOUNDS = "path_to_first_and_last_words.xlsx"
-
-FEATURE_COLUMN = "feature_name"   # e.g., surprisal, entropy, frequency, etc.
+DURATION_S = 3 * 60 + 43  # total duration of the stimulus (s), or one per story: {"story_1": ..., ...}
+
+# forced-aligner words of every story (one row per spoken word, with BEGIN/END)
+ONSET_FILES = {
+    "story_1": "path_to_onset_file_1.csv",
+}
+ONSET_WORD_COLUMN = "word"
+
+# feature files of every story: source -> (CSV pattern, word column, feature columns (all if empty), read options)
+FEATURE_FILES = {
+    "frequency": ("path_to_frequency_{story}.csv", "tokens_no_punct", ["Zipf_freq"], {"sep": ";", "decimal": ","}),
+    "surprisal": ("path_to_surprisal_{story}.csv", "word", [], {}),
+    "dissimilarity": ("path_to_dissimilarity_{story}.csv", "word", [], {}),
+}
+XLSX_BOUNDS = "path_to_first_and_last_words_{story}.xlsx"   # one file per story
+
+FEATURE_COLUMNS = ["feature_name"]   # e.g., surprisal, entropy, frequency, etc.
 ONSET_COLUMN = "BEGIN"
+COLLISION = "sum"                    # words in the same 10 ms bin: 'sum', 'mean' or 'first'
 
 START_ROW = 0    # row index for first word
 END_ROW = 1      # row index for last word
 
-OUTPUT_FILE = "output_predictor.csv"
-
-#load feature data 
-
-df = pd.read_csv(CSV_FEATURES)     # if needed: sep=";"
-onsets_audio = df[ONSET_COLUMN].to_numpy(dtype=float)
-feature = df[FEATURE_COLUMN].to_numpy(dtype=float)
-
-#load first_last word excel file 
-bounds = pd.read_excel(XLSX_BOUNDS)
-start_first = float(bounds.loc[START_ROW, "BEGIN"])
-end_last = float(bounds.loc[END_ROW, "END"])
-
-#empty predicotor
-N = int(round(DURATION_S * FS))
-predictor = np.zeros(N, dtype=float)
-
-# Convert onsets from AUDIO_FS to FS (0-based)
-idx = np.floor(onsets_audio / AUDIO_FS * FS).astype(int)
-valid = (idx >= 0) & (idx < N)
-
-predictor[idx[valid]] = feature[valid]
-
-cut_begin = int(np.floor(start_first / AUDIO_FS * FS))
-cut_end = int(np.ceil(end_last / AUDIO_FS * FS))
+OUTPUT_DIR = "output_predictors"
 
-cut_begin = max(0, cut_begin)
-cut_end = min(N, cut_end)
+#align the features of every story onto its spoken words (event table, see nlp_pipeline/alignment.py)
+events, mismatches = [], []
+for story, onset_path in ONSET_FILES.items():
+    features = {}
+    for source, (pattern, word_column, columns, options) in FEATURE_FILES.items():
+        table = pd.read_csv(pattern.format(story=story), **options)
+        features[source] = (table[[word_column] + columns] if columns else table, word_column)
+    story_df, report = story_events(pd.read_csv(onset_path), features, story, word_column=ONSET_WORD_COLUMN)
+    events.append(story_df)
+    mismatches.append(report)
+df = pd.concat(events, ignore_index=True)
 
-predictor_cut = predictor[cut_begin:cut_end]
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+pd.concat(mismatches, ignore_index=True).to_csv(os.path.join(OUTPUT_DIR, "mismatches.csv"), index=False)
 
-#save file
-np.savetxt(OUTPUT_FILE, predictor_cut, delimiter=",")
+#load first_last word excel file (one per story)
+bounds = {story: load_bounds(XLSX_BOUNDS.format(story=story), START_ROW, END_ROW) for story in ONSET_FILES}
 
+#render all features (and stories) at once, cropped between the first and the last word
+predictors = render_predictors(df, FEATURE_COLUMNS, DURATION_S, bounds=bounds, story_column="story",
+                               onset_column=ONSET_COLUMN, collision=COLLISION, fs=FS, audio_fs=AUDIO_FS)
 
+#save files
+save_predictors(predictors, FEATURE_COLUMNS, OUTPUT_DIR)
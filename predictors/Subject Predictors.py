@@ -1,6 +1,5 @@
-import numpy as np
 import pandas as pd
-import pickle
+from trial_store import TrialStore
 
 #parameters
 FS = 100                      # Hz
@@ -9,34 +8,29 @@ TRIAL_LEN = TRIAL_SEC * FS    # samples per trial
 NUM_TRIALS = 15
 TRIALS_PER_STORY = 3
 
-PRED_FILES = [
-    "path_to_predictor_1.csv",
-    "path_to_predictor_2.csv",
-    "path_to_predictor_3.csv",
-    "path_to_predictor_4.csv",
-    "path_to_predictor_5.csv",
-]
+SUBJECT = "SUBJECTID"
+PREDICTOR = "PREDICTOR"      # e.g. "wo_gauss", "Freq", "Surp", "Diss" (the file keys of mTRF/runner.py)
 
-OUT_PKL = "trials_SUBJECTID_PREDICTOR.pkl"
+# story predictors in the order the subject listed them (story name -> CSV)
+PRED_FILES = {
+    "story_1": "path_to_predictor_1.csv",
+    "story_2": "path_to_predictor_2.csv",
+    "story_3": "path_to_predictor_3.csv",
+    "story_4": "path_to_predictor_4.csv",
+    "story_5": "path_to_predictor_5.csv",
+}
 
-max_story_len = TRIALS_PER_STORY * TRIAL_LEN
-chunks = []
+STORE_DIR = "trial_store"    # shared by all subjects and predictors
 
-for path in PRED_FILES:
+store = TrialStore(STORE_DIR, fs=FS, trial_len=TRIAL_LEN)
+
+for story, path in PRED_FILES.items():
     # works whether the CSV has header or not (common when saved via np.savetxt)
     x = pd.read_csv(path, header=None).to_numpy().ravel()
-    chunks.append(x[:max_story_len])
-
-pred_total = np.concatenate(chunks) if chunks else np.array([], dtype=float)
-
-#creation trials
-total_needed = NUM_TRIALS * TRIAL_LEN
-padded = np.zeros(total_needed, dtype=float)
-n_copy = min(len(pred_total), total_needed)
-padded[:n_copy] = pred_total[:n_copy]
+    store.add_story(PREDICTOR, story, x)  # stored once, whichever subject adds it first
 
-trials_array = padded.reshape(NUM_TRIALS, TRIAL_LEN)  # shape: (NUM_TRIALS, TRIAL_LEN)
+#trial layout of the subject: stories truncated to TRIALS_PER_STORY trials, zero-padded to NUM_TRIALS
+store.add_subject(SUBJECT, list(PRED_FILES), n_trials=NUM_TRIALS, trials_per_story=TRIALS_PER_STORY)
+store.save()
 
-#save pickle
-with open(OUT_PKL, "wb") as f:
-    pickle.dump({"trials": trials_array, "fs": FS}, f)
+trials_array = store.trials(SUBJECT, PREDICTOR)  # shape: (NUM_TRIALS, TRIAL_LEN)
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Sequence, Tuple, Union
+from rendering import AUDIO_FS, FS, ONSET_COLUMN, bin_values, crop_bins, onset_bins
+
+DIRECT_MAX_TAPS = 64  # longer kernels are convolved via FFT
+
+
+def gaussian_kernel(sigma: float = 1.0, radius: int = 3, normalize: str = "max") -> np.ndarray:
+    """
+    Gaussian bump over ± `radius` bins (sigma in bins), scaled to a peak of 1 ('max', as in
+    the original word-onset predictor) or to unit area ('sum').
+    """
+
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(x ** 2) / (2 * sigma ** 2))
+    return kernel / (kernel.max() if normalize == "max" else kernel.sum())
+
+
+def boxcar_kernel(radius: int = 3) -> np.ndarray:
+    """
+    Boxcar of ones over ± `radius` bins.
+    """
+
+    return np.ones(2 * radius + 1)
+
+
+def gamma_kernel(shape: float = 2.0, scale: float = 2.0, length: int = 20) -> np.ndarray:
+    """
+    Causal gamma-shaped response (shape, scale in bins) over `length` bins after the onset,
+    peak-normalized. The kernel is left-padded with zeros so that its centre is the onset.
+    """
+
+    t = np.arange(length, dtype=float)
+    kernel = t ** (shape - 1) * np.exp(-t / scale)
+    kernel /= kernel.max()
+    return np.concatenate([np.zeros(length - 1), kernel])
+
+
+def kernel_bank(kernels: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Stacks kernels of different lengths into a (kernel x taps) matrix with a common centre.
+
+    The centre (onset) of a kernel of length L is tap L // 2.
+    """
+
+    length = max(len(k) for k in kernels)
+    length += 1 - length % 2  # odd, so every centre can be aligned
+    bank = np.zeros((len(kernels), length))
+    for i, k in enumerate(kernels):
+        start = length // 2 - len(k) // 2
+        bank[i, start:start + len(k)] = k
+    return bank
+
+
+def convolve_valid(padded: np.ndarray, bank: np.ndarray, method: str = "auto") -> np.ndarray:
+    """
+    'valid' convolution of (..., time) signals with every kernel of a (kernel x taps) bank.
+
+    Returns:
+        np.ndarray: (kernel, ..., time - taps + 1).
+    """
+
+    taps = bank.shape[1]
+    n_out = padded.shape[-1] - taps + 1
+    if method == "auto":
+        method = "direct" if taps <= DIRECT_MAX_TAPS else "fft"
+
+    if method == "direct":
+        #one shifted multiply-add per tap, for all kernels and signals at once
+        out = np.zeros((len(bank),) + padded.shape[:-1] + (n_out,))
+        for j in range(taps):
+            shifted = padded[..., taps - 1 - j:taps - 1 - j + n_out]
+            out += bank[:, j].reshape((-1,) + (1,) * padded.ndim) * shifted
+        return out
+    if method == "fft":
+        n_fft = 1 << int(np.ceil(np.log2(padded.shape[-1] + taps - 1)))
+        spectrum = np.fft.rfft(padded, n_fft)[None] * np.fft.rfft(bank, n_fft).reshape(
+            (len(bank),) + (1,) * (padded.ndim - 1) + (-1,))
+        return np.fft.irfft(spectrum, n_fft)[..., taps - 1:taps - 1 + n_out]
+    raise ValueError("method must be 'auto', 'direct' or 'fft'")
+
+
+def kernel_predictors(events: pd.DataFrame,
+                      kernels: Union[np.ndarray, Sequence[np.ndarray]],
+                      duration_s: Union[float, Dict[str, float]],
+                      value_columns: Optional[Sequence[str]] = None,
+                      bounds: Optional[Dict[str, Tuple[float, float]]] = None,
+                      story_column: Optional[str] = None,
+                      onset_column: str = ONSET_COLUMN,
+                      method: str = "auto",
+                      fs: float = FS,
+                      audio_fs: float = AUDIO_FS) -> Dict[str, np.ndarray]:
+    """
+    Builds smoothed predictors by convolving impulse trains with kernels, for many stories,
+    kernels and value weights in one call.
+
+    Each word puts an impulse (1, or its value in each of `value_columns`) at its onset bin;
+    impulses in the same bin add up. The impulse train is convolved with every kernel
+    (centred on the onset) and cropped between the first and the last word of the story.
+
+    Parameters:
+        events (pd.DataFrame): One row per word, with onsets (audio samples) and, optionally,
+            value columns and a story column.
+        kernels (np.ndarray or Sequence[np.ndarray]): One kernel or several (e.g. a SIGMA sweep);
+            see `gaussian_kernel`, `boxcar_kernel`, `gamma_kernel`, or any custom array.
+        duration_s (float or dict): Duration of the stimulus in seconds, or one per story.
+        value_columns (Sequence[str], optional): Weight impulses by these features (one
+            predictor per column). Default: unit impulses (word onsets).
+        bounds (dict, optional): story -> (BEGIN of the first word, END of the last word) in
+            audio samples. Without bounds the predictors are not cropped.
+        story_column (str, optional): Column with the story of each word.
+        onset_column (str): Column with the word onsets (default 'BEGIN').
+        method (str): 'direct', 'fft' or 'auto' (FFT for kernels longer than 64 taps).
+        fs (float): Target sampling rate (Hz).
+        audio_fs (float): Sampling rate of the onsets (Hz).
+
+    Returns:
+        Dict[str, np.ndarray]: story -> (kernel x value x time) array.
+
+    Notes:
+        - Kernel tails are cut at the edges of the stimulus, and words just outside the stimulus
+          still contribute their tails inside it, exactly as the original per-tap loop did.
+    """
+
+    bank = kernel_bank([kernels] if isinstance(kernels, np.ndarray) and kernels.ndim == 1 else list(kernels))
+    taps = bank.shape[1]
+    pad = taps // 2  # equal on both sides (odd bank)
+
+    stories = events[story_column].astype(str).to_numpy() if story_column else np.full(len(events), "")
+    names = list(dict.fromkeys(stories))
+    if isinstance(duration_s, dict):
+        sizes = np.array([int(round(duration_s[s] * fs)) for s in names])
+    else:
+        sizes = np.full(len(names), int(round(duration_s * fs)))
+
+    #padded stories end to end: one 'valid' convolution never mixes neighbouring stories
+    offsets = np.concatenate([[0], np.cumsum(sizes + 2 * pad)])
+    story_idx = pd.Index(names).get_indexer(stories)
+    bins = onset_bins(events[onset_column].to_numpy(), fs, audio_fs)
+    valid = (bins >= -pad) & (bins < sizes[story_idx] + pad)
+
+    if value_columns is None:
+        values = np.ones((1, len(events)))
+    else:
+        values = events[list(value_columns)].to_numpy(dtype=float).T
+    impulses = bin_values(bins[valid] + pad + offsets[story_idx[valid]], values[:, valid], int(offsets[-1]), "sum")
+    smoothed = convolve_valid(impulses, bank, method)
+
+    out = {}
+    for i, story in enumerate(names):
+        begin, end = 0, int(sizes[i])
+        if bounds is not None:
+            begin, end = crop_bins(bounds[story], end, fs, audio_fs)
+        out[story] = smoothed[..., offsets[i] + begin:offsets[i] + end]
+    return out
@@ -0,0 +1,162 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)  # nlp_pipeline, for the instrumentation hooks
+from nlp_pipeline.instrumentation import stage
+
+#parameters
+FS = 100                  # target sampling rate (Hz)
+AUDIO_FS = 44100          # original audio sampling rate (Hz)
+ONSET_COLUMN = "BEGIN"
+
+COLLISIONS = {"sum", "mean", "first", "last"}
+
+
+def load_bounds(path: str, start_row: int = 0, end_row: int = 1) -> Tuple[float, float]:
+    """
+    Reads the first/last word file of a story.
+
+    Returns:
+        Tuple[float, float]: BEGIN of the first word and END of the last word (audio samples).
+    """
+
+    bounds = pd.read_excel(path)
+    return float(bounds.loc[start_row, "BEGIN"]), float(bounds.loc[end_row, "END"])
+
+
+def onset_bins(onsets_audio: np.ndarray, fs: float = FS, audio_fs: float = AUDIO_FS) -> np.ndarray:
+    """
+    Converts onsets from audio samples to (0-based) bins at the target sampling rate.
+    """
+
+    return np.floor(np.asarray(onsets_audio, dtype=float) / audio_fs * fs).astype(np.int64)
+
+
+def crop_bins(bounds: Tuple[float, float], n_samples: int, fs: float = FS, audio_fs: float = AUDIO_FS) -> Tuple[int, int]:
+    """
+    Converts (first word BEGIN, last word END) from audio samples to a [begin, end) bin range.
+    """
+
+    cut_begin = max(0, int(np.floor(bounds[0] / audio_fs * fs)))
+    cut_end = min(n_samples, int(np.ceil(bounds[1] / audio_fs * fs)))
+    return cut_begin, cut_end
+
+
+def bin_values(bins: np.ndarray, values: np.ndarray, size: int, collision: str) -> np.ndarray:
+    """
+    Places the values of a (feature x event) matrix at their (event) bins in a (feature x size)
+    matrix, combining events that fall in the same bin according to `collision`.
+
+    NaN values are ignored (a bin with only NaN values stays 0).
+    """
+
+    n_features = values.shape[0]
+    finite = np.isfinite(values)
+    #one flat index per (feature, bin), so all features are reduced in a single call
+    keys = (np.arange(n_features)[:, None] * size + bins[None, :])
+
+    if collision in {"sum", "mean"}:
+        out = np.bincount(keys[finite], weights=values[finite], minlength=n_features * size)
+        if collision == "mean":
+            counts = np.bincount(keys[finite], minlength=n_features * size)
+            np.divide(out, counts, out=out, where=counts > 0)
+    else:
+        keys, values = keys[finite], values[finite]  # feature-major, events in order
+        if collision == "last":
+            keys, values = keys[::-1], values[::-1]
+        unique, first = np.unique(keys, return_index=True)
+        out = np.zeros(n_features * size)
+        out[unique] = values[first]
+    return out.reshape(n_features, size)
+
+
+def render_predictors(events: pd.DataFrame,
+                      feature_columns: Sequence[str],
+                      duration_s: Union[float, Dict[str, float]],
+                      bounds: Optional[Dict[str, Tuple[float, float]]] = None,
+                      story_column: Optional[str] = None,
+                      onset_column: str = ONSET_COLUMN,
+                      collision: str = "sum",
+                      fs: float = FS,
+                      audio_fs: float = AUDIO_FS) -> Dict[str, np.ndarray]:
+    """
+    Renders impulse predictors for many features and stories in one vectorized pass.
+
+    Each word contributes its feature value at the bin of its onset. Words whose onset falls
+    outside the stimulus are dropped. Each predictor is then cropped to the interval between
+    the first and the last word of its story.
+
+    Parameters:
+        events (pd.DataFrame): One row per word, with the onset (audio samples), the feature
+            columns and, for several stories, a story column.
+        feature_columns (Sequence[str]): Features to render (e.g. ['surprisal', 'entropy']).
+        duration_s (float or dict): Duration of the stimulus in seconds, or one per story.
+        bounds (dict, optional): story -> (BEGIN of the first word, END of the last word) in
+            audio samples (see `load_bounds`). Without bounds the predictors are not cropped.
+        story_column (str, optional): Column with the story of each word. If None, all rows
+            belong to a single story named ''.
+        onset_column (str): Column with the word onsets (default 'BEGIN').
+        collision (str): How words falling in the same bin are combined: 'sum' (default),
+            'mean', 'first' or 'last' (the last word overwrites, as the original script did).
+        fs (float): Target sampling rate (Hz).
+        audio_fs (float): Sampling rate of the onsets (Hz).
+
+    Returns:
+        Dict[str, np.ndarray]: story -> (feature x time) matrix, rows in `feature_columns` order.
+
+    Notes:
+        - NaN feature values (e.g. words missing from the lexicon) are skipped.
+    """
+
+    if collision not in COLLISIONS:
+        raise ValueError(f"collision must be one of {sorted(COLLISIONS)}")
+
+    stories = events[story_column].astype(str).to_numpy() if story_column else np.full(len(events), "")
+    names = list(dict.fromkeys(stories))
+    if isinstance(duration_s, dict):
+        sizes = np.array([int(round(duration_s[s] * fs)) for s in names])
+    else:
+        sizes = np.full(len(names), int(round(duration_s * fs)))
+
+    #lay all stories end to end on one time axis
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    story_idx = pd.Index(names).get_indexer(stories)
+    bins = onset_bins(events[onset_column].to_numpy(), fs, audio_fs)
+    valid = (bins >= 0) & (bins < sizes[story_idx])
+
+    values = events[list(feature_columns)].to_numpy(dtype=float).T
+    with stage("predictor_rendering", item=",".join(names), words=int(valid.sum()),
+               samples=int(offsets[-1]) * len(feature_columns)):
+        rendered = bin_values(bins[valid] + offsets[story_idx[valid]], values[:, valid], int(offsets[-1]), collision)
+
+    out = {}
+    for i, story in enumerate(names):
+        begin, end = 0, int(sizes[i])
+        if bounds is not None:
+            begin, end = crop_bins(bounds[story], end, fs, audio_fs)
+        out[story] = rendered[:, offsets[i] + begin:offsets[i] + end]
+    return out
+
+
+def save_predictors(rendered: Dict[str, np.ndarray], feature_columns: Sequence[str], output_dir: str,
+                    pattern: str = "{story}_{feature}.csv") -> Dict[Tuple[str, str], str]:
+    """
+    Saves each rendered predictor as a single-column CSV (the format of the original script).
+
+    Returns:
+        Dict[Tuple[str, str], str]: (story, feature) -> path.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for story, matrix in rendered.items():
+        for feature, predictor in zip(feature_columns, matrix):
+            path = os.path.join(output_dir, pattern.format(story=story, feature=feature))
+            np.savetxt(path, predictor, delimiter=",")
+            paths[story, feature] = path
+    return paths
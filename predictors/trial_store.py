@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import hashlib
+import contextlib
+import numpy as np
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)  # nlp_pipeline, for the instrumentation hooks
+from nlp_pipeline.instrumentation import stage
+
+#parameters
+FS = 100                      # Hz
+TRIAL_SEC = 60                # seconds per trial
+TRIAL_LEN = TRIAL_SEC * FS    # samples per trial
+NUM_TRIALS = 15
+TRIALS_PER_STORY = 3
+
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+
+
+class TrialStore:
+    """
+    Trial tensors of every subject and predictor, without duplicated data.
+
+    Each unique story predictor is stored once, appended to one flat binary file per predictor
+    (`<predictor>.bin`) that is memory-mapped for reading. A subject is only a list of stories;
+    its (n_trials x trial_len) layout is derived as (story, offset, length) segments: each story
+    truncated to `trials_per_story` trials, stories concatenated, then zero-padded or truncated
+    to `n_trials` trials (as the per-subject pickles were built).
+
+    Several processes (e.g. one `Subject Predictors.py` run per subject) can add to the same
+    store: every change is made under an exclusive lock of the store, on the index as it is on
+    disk, and written at once.
+
+    Parameters:
+        root (str): Directory of the store (created if needed).
+        fs (int): Sampling rate of the predictors (Hz).
+        trial_len (int): Samples per trial.
+        dtype (str): Storage dtype ('float64', or 'float32' to halve the size).
+    """
+
+    def __init__(self, root: str, fs: int = FS, trial_len: int = TRIAL_LEN, dtype: str = "float64"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index = self._read_index() or {"fs": fs, "trial_len": trial_len, "dtype": dtype,
+                                            "predictors": {}, "subjects": {}}
+        self.fs = self.index["fs"]
+        self.trial_len = self.index["trial_len"]
+        self.dtype = np.dtype(self.index["dtype"])
+        self._maps = {}
+
+    def _read_index(self) -> Optional[dict]:
+        index_path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        #exclusive lock of the store (none where fcntl is unavailable): the entries written by
+        #other processes are merged in first, and the index is written back when the block succeeds
+        with open(os.path.join(self.root, LOCK_FILE), "w") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                disk = self._read_index()
+                if disk is not None:
+                    for predictor, stories in disk["predictors"].items():
+                        self.index["predictors"][predictor] = {**stories, **self.index["predictors"].get(predictor, {})}
+                    self.index["subjects"] = {**disk["subjects"], **self.index["subjects"]}
+                    self._maps.clear()  # the flat files may have grown
+                yield
+                path = os.path.join(self.root, INDEX_FILE)
+                with open(path + ".tmp", "w", encoding="utf-8") as out:
+                    json.dump(self.index, out, indent=1)
+                os.replace(path + ".tmp", path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save(self):
+        """
+        Writes the index (atomically), merged with the entries other processes have written.
+        `add_story` and `add_subject` already save their changes.
+        """
+
+        with self._locked():
+            pass
+
+    def _bin_path(self, predictor: str) -> str:
+        return os.path.join(self.root, f"{predictor}.bin")
+
+    def add_story(self, predictor: str, story: str, values: np.ndarray) -> Tuple[int, int]:
+        """
+        Stores the predictor of a story, unless identical data is already stored.
+
+        Returns:
+            Tuple[int, int]: (offset, length) of the story in the predictor's flat file.
+        """
+
+        values = np.ascontiguousarray(values, dtype=self.dtype).ravel()
+        digest = hashlib.sha256(values.tobytes()).hexdigest()
+        with self._locked():
+            stories = self.index["predictors"].setdefault(predictor, {})
+            if story in stories and stories[story]["sha256"] == digest:
+                return stories[story]["offset"], stories[story]["length"]
+            same = next((s for s in stories.values() if s["sha256"] == digest), None)
+            if same is not None:
+                offset = same["offset"]
+            else:
+                path = self._bin_path(predictor)
+                offset = os.path.getsize(path) // self.dtype.itemsize if os.path.exists(path) else 0
+                with open(path, "ab") as f:
+                    f.write(values.tobytes())
+                self._maps.pop(predictor, None)
+            stories[story] = {"offset": offset, "length": len(values), "sha256": digest}
+        return offset, len(values)
+
+    def add_subject(self, subject: str, stories: Sequence[str],
+                    n_trials: int = NUM_TRIALS, trials_per_story: int = TRIALS_PER_STORY):
+        """
+        Records the story order of a subject (the same layout applies to every predictor).
+        """
+
+        with self._locked():
+            self.index["subjects"][str(subject)] = {"stories": list(stories), "n_trials": n_trials,
+                                                    "trials_per_story": trials_per_story}
+
+    def _flat(self, predictor: str) -> np.memmap:
+        if predictor not in self._maps:
+            self._maps[predictor] = np.memmap(self._bin_path(predictor), dtype=self.dtype, mode="r")
+        return self._maps[predictor]
+
+    def story(self, predictor: str, story: str) -> np.ndarray:
+        """
+        Returns the predictor of a story as a read-only view of the memory map.
+        """
+
+        entry = self.index["predictors"][predictor][story]
+        return self._flat(predictor)[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def segments(self, subject: str, predictor: str) -> List[Tuple[Optional[str], int, int]]:
+        """
+        Trial layout of a subject as (story, start in story, length) segments along the
+        concatenated trial axis; story None marks zero padding.
+        """
+
+        layout = self.index["subjects"][str(subject)]
+        total = layout["n_trials"] * self.trial_len
+        max_story_len = layout["trials_per_story"] * self.trial_len
+        segments, filled = [], 0
+        for story in layout["stories"]:
+            if filled == total:
+                break
+            length = min(self.index["predictors"][predictor][story]["length"], max_story_len, total - filled)
+            segments.append((story, 0, length))
+            filled += length
+        if filled < total:
+            segments.append((None, 0, total - filled))
+        return segments
+
+    def iter_trials(self, subject: str, predictor: str) -> Iterator[np.ndarray]:
+        """
+        Yields the trials of a subject one by one: views of the memory map when a trial lies
+        within one story, small assembled copies when it spans a story boundary or padding.
+        """
+
+        segments = self.segments(subject, predictor)
+        pos = 0  # position on the concatenated trial axis
+        starts = np.cumsum([0] + [length for _, _, length in segments])
+        n_trials = self.index["subjects"][str(subject)]["n_trials"]
+        for _ in range(n_trials):
+            end = pos + self.trial_len
+            i = int(np.searchsorted(starts, pos, side="right") - 1)
+            story, start, length = segments[i]
+            if story is not None and end <= starts[i + 1]:
+                a = start + pos - starts[i]
+                yield self.story(predictor, story)[a:a + self.trial_len]
+            else:
+                yield self._assemble(segments, starts, pos, end, predictor)
+            pos = end
+
+    def _assemble(self, segments, starts, pos, end, predictor) -> np.ndarray:
+        out = np.zeros(end - pos, dtype=self.dtype)
+        for (story, start, length), s0 in zip(segments, starts[:-1]):
+            lo, hi = max(pos, s0), min(end, s0 + length)
+            if story is not None and lo < hi:
+                out[lo - pos:hi - pos] = self.story(predictor, story)[start + lo - s0:start + hi - s0]
+        return out
+
+    def trials(self, subject: str, predictor: str) -> np.ndarray:
+        """
+        Returns the (n_trials x trial_len) tensor of a subject and predictor.
+
+        When the subject's trials are one contiguous run of the flat file (a single story, or
+        stories that were added in this order and fill whole trials), this is a zero-copy view;
+        otherwise the trials are copied into a new array.
+        """
+
+        layout = self.index["subjects"][str(subject)]
+        with stage("trial_assembly", item=f"{subject}/{predictor}", samples=layout["n_trials"] * self.trial_len):
+            segments = self.segments(subject, predictor)
+            flat = self._flat(predictor)
+            if all(story is not None for story, _, _ in segments):
+                entries = [self.index["predictors"][predictor][story] for story, _, _ in segments]
+                contiguous = all(entries[k + 1]["offset"] == entries[k]["offset"] + segments[k][2]
+                                 for k in range(len(entries) - 1))
+                if contiguous:
+                    begin = entries[0]["offset"]
+                    return flat[begin:begin + layout["n_trials"] * self.trial_len].reshape(-1, self.trial_len)
+            return np.stack(list(self.iter_trials(subject, predictor)))
+
+    def nbytes(self) -> int:
+        """
+        Total size of the stored predictor data in bytes.
+        """
+
+        return sum(os.path.getsize(self._bin_path(p)) for p in self.index["predictors"]
+                   if os.path.exists(self._bin_path(p)))
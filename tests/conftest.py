@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+#the repository root (nlp_pipeline package) and the script folders, which import their siblings directly
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("", "predictors", "mTRF", "Analysis"):
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope="session")
+def tiny_models(tmp_path_factory):
+    """
+    Directories of the tiny random GPT-2 and RoBERTa of benchmarks/synthetic.py, built offline.
+    """
+
+    pytest.importorskip("transformers")
+    pytest.importorskip("tokenizers")
+    from benchmarks.synthetic import italian_text, tiny_models
+    texts = [italian_text(2000, seed=seed) for seed in range(3)]
+    return tiny_models(str(tmp_path_factory.mktemp("models")), texts)
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from nlp_pipeline.alignment import align_words, story_events
+
+
+def test_align_words_merges_and_splits():
+    index, report = align_words(["l'uomo", "va", "del", "la", "casa"], ["l'", "uomo", "va", "della", "casa"])
+    np.testing.assert_array_equal(index, [0, 0, 1, 2, 4])
+    assert list(report["operation"]) == ["merge", "split"]
+
+
+def test_align_words_without_words():
+    index, report = align_words(["a", "b"], [])
+    assert len(index) == 0
+    assert list(report["operation"]) == ["missing", "missing"]
+    assert list(report["reference_index"]) == [0, 1]
+
+    index, report = align_words([], ["a"])
+    np.testing.assert_array_equal(index, [-1])
+    assert list(report["operation"]) == ["extra"]
+
+
+def test_story_events_with_empty_feature_table():
+    onsets = pd.DataFrame({"word": ["a", "b"], "BEGIN": [0, 100], "END": [90, 200]})
+    events, report = story_events(onsets, {"surprisal": (pd.DataFrame({"word": [], "surprisal": []}), "word")}, "s")
+    assert list(events["word"]) == ["a", "b"]
+    assert events["surprisal"].isna().all()
+    assert list(report["source"]) == ["surprisal", "surprisal"]
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from feature_store import FeatureStore, collinearity, correlation_matrix, join_features
+
+COLUMNS = ["Zipf_freq", "surprisal", "entropy"]
+CHUNK_ROWS = 7
+
+
+@pytest.fixture()
+def tables():
+    rng = np.random.default_rng(1)
+    out = {}
+    for story, n in (("story_1", 40), ("story_2", 25), ("story_3", 33)):
+        freq = rng.normal(4, 1, n)
+        df = pd.DataFrame({"Zipf_freq": freq, "surprisal": 10 - freq + rng.normal(0, 1, n),
+                           "entropy": rng.gamma(2.0, size=n)})
+        df.loc[rng.choice(n, 3, replace=False), "surprisal"] = np.nan
+        out[story] = df
+    out["story_3"] = out["story_3"].drop(columns="entropy")  # NaN for this story in the store
+    return out
+
+
+@pytest.fixture()
+def store(tmp_path, tables):
+    store = FeatureStore(str(tmp_path / "features"))
+    for story, df in tables.items():
+        store.add_story(story, df)
+    return store
+
+
+def _complete(tables) -> pd.DataFrame:
+    return pd.concat(list(tables.values()), ignore_index=True)[COLUMNS].dropna()
+
+
+@pytest.mark.parametrize("method", ["pearson", "spearman"])
+def test_correlation_matches_pandas(store, tables, method):
+    r = correlation_matrix(store, COLUMNS, method=method, chunk_rows=CHUNK_ROWS)
+    expected = _complete(tables).corr(method=method)
+    np.testing.assert_allclose(r.to_numpy(), expected.to_numpy(), rtol=0, atol=1e-14)
+
+
+@pytest.mark.parametrize("method", ["pearson", "spearman"])
+def test_collinearity_matches_pandas(store, tables, method):
+    out = collinearity(store, COLUMNS, method=method, n_boot=20, chunk_rows=CHUNK_ROWS)
+    expected = _complete(tables).corr(method=method).to_numpy()
+    np.testing.assert_allclose(out["r"].to_numpy(), expected, rtol=0, atol=1e-14)
+    np.testing.assert_allclose(out["vif"]["vif"].to_numpy(), np.diag(np.linalg.inv(expected)), rtol=1e-12)
+
+
+def _weighted_correlation(X: np.ndarray, w: np.ndarray) -> np.ndarray:
+    #centred two-pass estimate
+    centred = X - np.average(X, axis=0, weights=w)
+    cov = (centred * w[:, None]).T @ centred
+    sd = np.sqrt(np.diag(cov))
+    return cov / np.outer(sd, sd)
+
+
+def test_story_bootstrap_matches_weighted_correlations(store, tables):
+    n_boot, seed = 50, 9   # every replicate weights at least one story with complete words
+    out = collinearity(store, COLUMNS, n_boot=n_boot, unit="story", seed=seed, chunk_rows=CHUNK_ROWS)
+
+    #each replicate: the complete words, weighted by the Poisson count of their story
+    weights = np.random.default_rng(seed).poisson(1.0, size=(n_boot, len(tables)))
+    frames = [df.reindex(columns=COLUMNS).assign(code=k) for k, df in enumerate(tables.values())]
+    words = pd.concat(frames, ignore_index=True).dropna()
+    X, codes = words[COLUMNS].to_numpy(), words["code"].to_numpy()
+    assert (weights[:, np.unique(codes)].sum(1) > 0).all()
+    r_boot = np.stack([_weighted_correlation(X, w[codes]) for w in weights])
+    np.testing.assert_allclose(out["r_low"].to_numpy(), np.quantile(r_boot, 0.025, axis=0), rtol=0, atol=1e-12)
+    np.testing.assert_allclose(out["r_high"].to_numpy(), np.quantile(r_boot, 0.975, axis=0), rtol=0, atol=1e-12)
+
+
+def test_store_round_trip(store, tables):
+    reopened = FeatureStore(store.root)
+    assert reopened.stories == list(tables)
+    frame = reopened.frame("story_3")
+    np.testing.assert_array_equal(frame["Zipf_freq"].to_numpy(), tables["story_3"]["Zipf_freq"].to_numpy())
+    assert frame["entropy"].isna().all()
+
+
+def test_join_features_aligns_sources_onto_onset_words():
+    onsets = pd.DataFrame({"word": ["L'uomo", "va", "della", "casa."], "BEGIN": [0, 10, 20, 30], "END": [9, 19, 29, 39]})
+    lm = pd.DataFrame({"word": ["L'", "uomo", "va", "della", "casa."], "surprisal": [1.0, 2.0, 3.0, 4.0, 5.0]})
+    stanza = pd.DataFrame({"tokens_no_punct": ["l'uomo", "va", "di", "la", "casa"], "Zipf_freq": [3.0, 6.0, 7.0, 7.0, 5.0]})
+    keyed = pd.DataFrame({"word_index": [3, 0], "onset_rate": [0.5, 0.25]})
+    joined, report = join_features(onsets, {"lm": (lm, "word"), "stanza": (stanza, "tokens_no_punct"),
+                                            "rate": (keyed, None)}, "story")
+
+    assert list(joined.index) == [0, 1, 2, 3]
+    np.testing.assert_array_equal(joined["surprisal"], [3.0, 3.0, 4.0, 5.0])  # merged LM words are summed
+    np.testing.assert_array_equal(joined["onset_rate"], [0.25, np.nan, np.nan, 0.5])
+    assert joined.loc[2, "Zipf_freq"] == 7.0
+    assert set(report["source"]) <= {"lm", "stanza"}
+
+
+def test_join_features_rejects_bad_word_indices():
+    onsets = pd.DataFrame({"word": ["a", "b"], "BEGIN": [0, 10], "END": [9, 19]})
+    with pytest.raises(ValueError, match="word indices"):
+        join_features(onsets, {"rate": (pd.DataFrame({"word_index": [0, 0], "x": [1.0, 2.0]}), None)}, "story")
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from scipy.stats import t as t_dist
+from group_stats import group_test, sensor_time_edges, sign_flips
+
+N_SUBJECTS, N_SENSORS, N_TIMES = 8, 6, 7
+SENSOR_PAIRS = np.array([[0, 1], [1, 2], [2, 3], [3, 4], [4, 5], [0, 5], [1, 4]])
+
+
+def _clusters(mask: np.ndarray, neighbours) -> list:
+    #connected components of the points in mask, by depth-first search
+    seen, clusters = set(), []
+    for start in np.flatnonzero(mask):
+        if start in seen:
+            continue
+        stack, cluster = [start], []
+        seen.add(start)
+        while stack:
+            i = stack.pop()
+            cluster.append(i)
+            for j in neighbours[i]:
+                if mask[j] and j not in seen:
+                    seen.add(j)
+                    stack.append(j)
+        clusters.append(cluster)
+    return clusters
+
+
+def reference_tfce(t: np.ndarray, neighbours, step: float, E: float = 0.5, H: float = 2.0) -> np.ndarray:
+    #one map, one threshold at a time
+    out = np.zeros(len(t))
+    for sign in (1, -1):
+        x = sign * t
+        for h in np.arange(step, max(x.max(), 0) + step / 2, step):
+            for cluster in _clusters(x >= h, neighbours):
+                out[cluster] += sign * len(cluster) ** E * h ** H * step
+    return out
+
+
+def reference_cluster_mass(t: np.ndarray, neighbours, threshold: float) -> np.ndarray:
+    out = np.zeros(len(t))
+    for sign in (1, -1):
+        for cluster in _clusters(sign * t > threshold, neighbours):
+            out[cluster] = t[cluster].sum()
+    return out
+
+
+def reference_test(data: dict, method: str, n_perm: int, step: float = 0.1) -> dict:
+    #one permutation, one predictor and one map at a time
+    edges = sensor_time_edges(SENSOR_PAIRS, N_SENSORS, N_TIMES)
+    neighbours = [[] for _ in range(N_SENSORS * N_TIMES)]
+    for a, b in edges:
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    threshold = float(t_dist.ppf(0.975, N_SUBJECTS - 1))
+    flips = sign_flips(N_SUBJECTS, n_perm)
+
+    results = {}
+    for name, x in data.items():
+        x = x.reshape(N_SUBJECTS, -1)
+        stats = []
+        for flip in flips:
+            y = flip[:, None] * x
+            t = y.mean(0) / (y.std(0, ddof=1) / np.sqrt(N_SUBJECTS))
+            if method == "tfce":
+                stats.append(reference_tfce(t, neighbours, step))
+            else:
+                stats.append(reference_cluster_mass(t, neighbours, threshold))
+        null = np.array([np.abs(s).max() for s in stats])
+        p = np.array([np.mean(null >= abs(v) - 1e-12) for v in stats[0]])
+        results[name] = {"stat": stats[0], "p": p, "null": null}
+    return results
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(3)
+    shape = (N_SUBJECTS, N_SENSORS, N_TIMES)
+    effect = np.zeros(shape[1:])
+    effect[1:4, 2:5] = 1.0
+    return {"a": rng.normal(size=shape) + effect, "b": rng.normal(size=shape), "c": rng.normal(size=shape) - effect}
+
+
+@pytest.mark.parametrize("method", ["tfce", "cluster"])
+@pytest.mark.parametrize("n_perm", [2 ** N_SUBJECTS, 100])
+def test_group_test_matches_reference(data, method, n_perm):
+    out = group_test(data, SENSOR_PAIRS, method=method, n_perm=n_perm, batch_size=32, n_workers=1)
+    reference = reference_test(data, method, n_perm)
+    for name in data:
+        np.testing.assert_allclose(out[name]["stat"].ravel(), reference[name]["stat"], rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(out[name]["null"], reference[name]["null"], rtol=1e-9)
+        np.testing.assert_allclose(out[name]["p"].ravel(), reference[name]["p"], rtol=0, atol=1e-12)
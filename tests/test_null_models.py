@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from null_models import _null_stats, _replace, circular_shifts, null_contributions, random_shifts, shuffled_values
+from ridge import LAMBDAS, fit_models, lags, trial_stats
+
+FS = 100
+TSTART, TSTOP = -0.05, 0.1
+N_TRIALS, N_CHANNELS, N_TIMES = 6, 3, 300
+N_NULL = 5
+MIN_SHIFT = 0.5
+SEED = 4
+
+
+@pytest.fixture(scope="module")
+def subject():
+    rng = np.random.default_rng(0)
+    x = np.zeros((2, N_TRIALS, N_TIMES))
+    onsets = rng.random((2, N_TRIALS, N_TIMES)) < 0.05
+    x[onsets] = rng.gamma(2.0, size=onsets.sum())
+    eeg = rng.normal(size=(N_TRIALS, N_CHANNELS, N_TIMES))
+    eeg += 0.5 * np.roll(x[0], 3, axis=-1)[:, None] + 0.2 * np.roll(x[1], 5, axis=-1)[:, None]
+    return eeg, {"freq": x[0], "surp": x[1]}
+
+
+def test_circular_shifts_match_roll(subject):
+    _, predictors = subject
+    x = predictors["freq"]
+    shifts = random_shifts(3, N_TRIALS, N_TIMES, 10, seed=1)
+    shifted = circular_shifts(x, shifts)
+    for k in range(len(shifts)):
+        for i in range(N_TRIALS):
+            np.testing.assert_allclose(shifted[k, i], np.roll(x[i], shifts[k, i]), rtol=0, atol=1e-12)
+
+
+def test_null_stats_match_explicit_predictors(subject):
+    eeg, predictors = subject
+    x = np.stack(list(predictors.values()))
+    lag_samples = lags(TSTART, TSTOP, FS)
+    stats = trial_stats(eeg, x, lag_samples)
+    null_x = shuffled_values(x[1], 3, seed=2)
+    batch = _null_stats(stats, eeg, x, null_x, 1, lag_samples)
+    for k in range(len(null_x)):
+        explicit = trial_stats(eeg, np.stack([x[0], null_x[k]]), lag_samples)
+        replaced = _replace(stats, batch, k, 1, len(lag_samples))
+        for name in explicit:
+            np.testing.assert_allclose(replaced[name], explicit[name], rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("method", ["shift", "shuffle"])
+def test_nulls_match_explicit_refits(subject, method):
+    eeg, predictors = subject
+    names = list(predictors)
+    kwargs = dict(tstart=TSTART, tstop=TSTOP, fs=FS, n_folds=3, lambdas=LAMBDAS)
+    out = null_contributions(eeg, predictors, method=method, n_null=N_NULL, min_shift=MIN_SHIFT,
+                             batch_size=N_NULL, seed=SEED, **kwargs)
+
+    lag_samples = lags(TSTART, TSTOP, FS)
+    for j, key in enumerate(names):
+        p = names.index(key)
+        x = np.stack([predictors[k] for k in names])
+        if method == "shift":
+            shifts = random_shifts(N_NULL, N_TRIALS, N_TIMES, int(round(MIN_SHIFT * FS)), SEED + j)
+            null_x = np.stack([[np.roll(x[p, i], shifts[k, i]) for i in range(N_TRIALS)] for k in range(N_NULL)])
+        else:
+            null_x = shuffled_values(x[p], N_NULL, (SEED + j) * 100003)
+        reduced = fit_models(trial_stats(eeg, x, lag_samples), {"": [q for q in range(len(names)) if q != p]},
+                             len(lag_samples), kwargs["n_folds"], kwargs["lambdas"])[""]
+        z_reduced = np.arctanh(np.mean(reduced["r"]))
+        null = []
+        for k in range(N_NULL):
+            refit = x.copy()
+            refit[p] = null_x[k]
+            full = fit_models(trial_stats(eeg, refit, lag_samples), {"": list(range(len(names)))},
+                              len(lag_samples), kwargs["n_folds"], kwargs["lambdas"])[""]
+            null.append(np.arctanh(np.mean(full["r"])) - z_reduced)
+        np.testing.assert_allclose(out[key]["null"], null, rtol=0, atol=1e-12)
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+import torch
+from typing import List, Tuple
+from nlp_pipeline.utils import STRIP_CHARS, normalize_text, reconstruct_word_arrays, reconstruct_words
+
+MARKERS = ("▁", "Ġ")
+
+
+class JoinTokenizer:
+    """
+    Minimal tokenizer: subword pieces (markers already removed) are joined as they are.
+    """
+
+    def convert_tokens_to_string(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+def baseline_reconstruct_words(tokens: List[str], values: List[float], tokenizer,
+                               agg: str = "mean") -> Tuple[List[str], List[float]]:
+    #the original token-by-token implementation (float32 torch reductions), kept as the reference
+    def aggregate(vals):
+        t = torch.tensor(vals, dtype=torch.float32)
+        if agg == "mean":
+            return float(torch.nanmean(t))
+        if agg == "sum":
+            return float(torch.nansum(t))
+        return float(torch.prod(torch.nan_to_num(t, nan=1.0)))
+
+    words, agg_values, current_tokens, current_vals = [], [], [], []
+
+    def close():
+        word = tokenizer.convert_tokens_to_string(current_tokens).strip()
+        if word:
+            words.append(word)
+            agg_values.append(aggregate(current_vals))
+
+    for tok_raw, val in zip(tokens, values):
+        tok = normalize_text(tok_raw)
+        marker = next((m for m in MARKERS if tok.startswith(m)), None)
+        if marker is not None:
+            if current_tokens:
+                close()
+            body = tok[len(marker):]
+            current_tokens, current_vals = ([body], [float(val)]) if body else ([], [])
+        elif tok == "'":
+            if current_tokens:
+                current_tokens[-1] = current_tokens[-1] + "'"
+                current_vals.append(float(val))
+                close()
+                current_tokens, current_vals = [], []
+            else:
+                words.append("'")
+                agg_values.append(float(val))
+        else:
+            current_tokens.append(tok)
+            current_vals.append(float(val))
+    if current_tokens:
+        close()
+
+    cleaned = [(w.strip(STRIP_CHARS), v) for w, v in zip(words, agg_values)]
+    return [w for w, _ in cleaned if w], [v for w, v in cleaned if w]
+
+
+def random_tokens(n: int, marker: str, seed: int) -> Tuple[List[str], np.ndarray]:
+    #words of 1-8 subword pieces, with elisions, bare markers, punctuation and typographic apostrophes
+    rng = np.random.default_rng(seed)
+    pieces = ["ca", "sa", "do", "mi", "là", "nt", "ez", "zo", "è", "ri"]
+    tokens = []
+    while len(tokens) < n:
+        r = rng.random()
+        if r < 0.05:
+            tokens += [marker + "l", "'"] if rng.random() < 0.5 else [marker + "l", "’"]
+        elif r < 0.08:
+            tokens.append("'")
+        elif r < 0.12:
+            tokens += [marker, "«"]
+        elif r < 0.16:
+            tokens.append(marker + rng.choice([",", ".", "!"]))
+        else:
+            tokens.append(marker + rng.choice(pieces))
+            tokens += list(rng.choice(pieces, size=rng.integers(0, 8)))
+            if rng.random() < 0.1:
+                tokens.append(".")
+    values = rng.gamma(2.0, 3.0, len(tokens))
+    values[rng.random(len(tokens)) < 0.03] = np.nan
+    return tokens, values
+
+
+@pytest.mark.parametrize("marker", MARKERS)
+@pytest.mark.parametrize("agg", ["mean", "sum", "product"])
+def test_matches_baseline(marker, agg):
+    tokens, values = random_tokens(5000, marker, seed=len(agg))
+    tokenizer = JoinTokenizer()
+    ref_words, ref_values = baseline_reconstruct_words(tokens, values.tolist(), tokenizer, agg)
+
+    words, out = reconstruct_word_arrays(tokens, values, tokenizer, agg=agg)
+    assert words.tolist() == ref_words
+    ref_values = np.asarray(ref_values)
+    #float64 accumulation vs float32: equal up to float32 rounding
+    np.testing.assert_allclose(out, ref_values, rtol=1e-6, atol=0, equal_nan=True)
+
+    #single-token words (and lone apostrophes) are exactly the same
+    _, _, spans = reconstruct_word_arrays(tokens, values, tokenizer, agg=agg, return_spans=True)
+    single = (spans[:, 1] - spans[:, 0]) == 1
+    np.testing.assert_array_equal(out[single], ref_values[single])
+
+    #list wrapper
+    list_words, list_values = reconstruct_words(tokens, values.tolist(), tokenizer, agg=agg)
+    assert list_words == ref_words
+    np.testing.assert_array_equal(np.asarray(list_values), out)
+
+
+def test_dict_input_matches_single_calls():
+    tokens, values = random_tokens(2000, "Ġ", seed=7)
+    tokenizer = JoinTokenizer()
+    aggs = {"surprisal": "sum", "entropy": "first", "dissimilarity": "mean"}
+    words, out = reconstruct_word_arrays(tokens, {name: values for name in aggs}, tokenizer, agg=aggs)
+    for name, agg in aggs.items():
+        single_words, single = reconstruct_word_arrays(tokens, values, tokenizer, agg=agg)
+        assert single_words.tolist() == words.tolist()
+        np.testing.assert_array_equal(out[name], single)
+
+
+def test_empty():
+    words, values = reconstruct_word_arrays([], [], JoinTokenizer())
+    assert len(words) == 0 and len(values) == 0
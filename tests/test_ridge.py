@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from ridge import fit_subject, fold_ids, lagged_design, lags
+
+FS = 100
+TSTART, TSTOP = -0.03, 0.05
+N_TRIALS, N_CHANNELS, N_TIMES = 6, 3, 250
+N_FOLDS = 3
+LAMBDA = 0.1
+
+
+@pytest.fixture(scope="module")
+def subject():
+    rng = np.random.default_rng(3)
+    predictors = {"freq": rng.normal(size=(N_TRIALS, N_TIMES)), "surp": rng.gamma(2.0, size=(N_TRIALS, N_TIMES)),
+                  "diss": rng.normal(size=(N_TRIALS, N_TIMES))}
+    eeg = rng.normal(size=(N_TRIALS, N_CHANNELS, N_TIMES))
+    eeg += 0.5 * np.roll(predictors["freq"], 2, axis=-1)[:, None] + 0.3 * np.roll(predictors["surp"], 4, axis=-1)[:, None]
+    return eeg, predictors
+
+
+def _ridge(X, Y, lam):
+    #standardized columns, penalty relative to the mean eigenvalue (trace / dimension) of the covariance
+    mean_x, mean_y = X.mean(0), Y.mean(0)
+    scale = np.sqrt(((X - mean_x) ** 2).sum(0))
+    Xs = (X - mean_x) / scale
+    A = Xs.T @ Xs
+    W = np.linalg.solve(A + lam * np.trace(A) / len(A) * np.eye(len(A)), Xs.T @ (Y - mean_y))
+    return W / scale[:, None], mean_x
+
+
+def test_fit_matches_direct_ridge(subject):
+    eeg, predictors = subject
+    lag_samples = lags(TSTART, TSTOP, FS)
+    x = np.stack(list(predictors.values()))
+    designs = [lagged_design(x[:, i], lag_samples) for i in range(N_TRIALS)]
+    responses = [eeg[i].T for i in range(N_TRIALS)]
+    out = fit_subject(eeg, predictors, {"": list(predictors)}, TSTART, TSTOP, FS, N_FOLDS, np.array([LAMBDA]))[""]
+
+    #weights: one fit on all trials
+    W, _ = _ridge(np.concatenate(designs), np.concatenate(responses), LAMBDA)
+    h = W.reshape(len(predictors), len(lag_samples), N_CHANNELS).transpose(0, 2, 1)
+    np.testing.assert_allclose(out["h"], h, rtol=1e-8, atol=1e-12)
+
+    #accuracy: the predictions of every held-out fold, pooled
+    folds = fold_ids(N_TRIALS, N_FOLDS)
+    predicted, observed = [], []
+    for fold in range(N_FOLDS):
+        train, test = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+        W, mean_x = _ridge(np.concatenate([designs[i] for i in train]), np.concatenate([responses[i] for i in train]), LAMBDA)
+        predicted += [(designs[i] - mean_x) @ W for i in test]
+        observed += [responses[i] for i in test]
+    predicted, observed = np.concatenate(predicted), np.concatenate(observed)
+    r = [np.corrcoef(predicted[:, c], observed[:, c])[0, 1] for c in range(N_CHANNELS)]
+    np.testing.assert_allclose(out["r"], r, rtol=0, atol=1e-10)
+
+
+def test_reduced_models_match_sub_block_fits(subject):
+    eeg, predictors = subject
+    kwargs = dict(tstart=TSTART, tstop=TSTOP, fs=FS, n_folds=N_FOLDS)
+    out = fit_subject(eeg, predictors, **kwargs)
+    for key in predictors:
+        rest = {k: v for k, v in predictors.items() if k != key}
+        reduced = fit_subject(eeg, rest, {"": list(rest)}, **kwargs)[""]
+        for name in ("r", "h", "r_grid", "lambda"):
+            np.testing.assert_allclose(out[f"_no{key}"][name], reduced[name], rtol=1e-9, atol=1e-12)
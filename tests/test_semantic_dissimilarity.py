@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import torch
+from benchmarks.synthetic import italian_text
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.semantic_dissimilarity import CHUNK_SETTINGS, N_LAYERS, encode_chunks, windowed_dissimilarities
+
+WINDOW_SIZES = [1, 5, 20]
+
+
+@pytest.fixture(scope="module")
+def encoded(tiny_models):
+    _, encoder_dir = tiny_models
+    tokenizer, model = get_tokenizer(encoder_dir), get_model(encoder_dir, "encoder")
+    text = italian_text(1200, seed=3)
+    return tokenizer, model, text, encode_chunks(text, tokenizer, model, model.device)
+
+
+def test_stitched_chunks_match_plain_tokenization(encoded):
+    tokenizer, model, text, (tokens, offsets, states) = encoded
+    plain = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    step = CHUNK_SETTINGS["max_length"] - CHUNK_SETTINGS["stride"]
+    assert len(plain["input_ids"]) > CHUNK_SETTINGS["max_length"] + 2 * step   # at least 3 overflow chunks
+
+    assert tokens == tokenizer.convert_ids_to_tokens(plain["input_ids"])
+    np.testing.assert_array_equal(offsets.numpy(), np.array(plain["offset_mapping"]))
+    assert states.shape[:2] == (model.config.num_hidden_layers + 1, len(tokens))
+
+    #every token comes from the first chunk that contains it
+    ids = torch.tensor([plain["input_ids"]])
+    with torch.no_grad():
+        for k, first in ((0, 0), (1, CHUNK_SETTINGS["max_length"]), (2, CHUNK_SETTINGS["max_length"] + step)):
+            chunk = torch.stack(model(ids[:, k * step:k * step + CHUNK_SETTINGS["max_length"]]).hidden_states)[:, 0]
+            np.testing.assert_allclose(states[:, first:first + step].numpy(), chunk[:, first - k * step:first - k * step + step].numpy(),
+                                       rtol=0, atol=1e-5)
+
+
+def test_chunk_batches_do_not_change_states(encoded):
+    tokenizer, model, text, (tokens, _, states) = encoded
+    tokens_1, _, states_1 = encode_chunks(text, tokenizer, model, model.device, batch_size=1)
+    assert tokens_1 == tokens
+    np.testing.assert_allclose(states_1.numpy(), states.numpy(), rtol=0, atol=1e-5)
+
+
+def test_windowed_dissimilarities_match_loop(encoded):
+    _, _, _, (_, _, states) = encoded
+    h = states[-N_LAYERS:].mean(dim=0).double().numpy()
+    out = windowed_dissimilarities(torch.from_numpy(h).float(), WINDOW_SIZES).numpy()
+    assert np.isnan(out[:, 0]).all()
+    for k, window_size in enumerate(WINDOW_SIZES):
+        expected = []
+        for t in range(1, len(h)):
+            context = h[max(0, t - window_size):t].mean(0)
+            expected.append(1 - h[t] @ context / (np.linalg.norm(h[t]) * np.linalg.norm(context)))
+        np.testing.assert_allclose(out[k, 1:], expected, rtol=0, atol=1e-5)
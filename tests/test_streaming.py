@@ -0,0 +1,88 @@
+import asyncio
+import numpy as np
+import pytest
+from benchmarks.synthetic import italian_text
+from nlp_pipeline import semantic_dissimilarity as dissimilarity
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.streaming import IncrementalEncoder, StreamClient, StreamServer, StreamSession
+
+N_WORDS = 700   # more than two 512-token chunks of the encoder
+SEED = 5
+
+
+@pytest.fixture(scope="module")
+def models(tiny_models):
+    lm_dir, encoder_dir = tiny_models
+    return (get_tokenizer(lm_dir), get_model(lm_dir, "causal"),
+            get_tokenizer(encoder_dir), get_model(encoder_dir, "encoder"))
+
+
+def _pieces(n, seed=SEED):
+    rng = np.random.default_rng(seed)
+    bounds = np.cumsum(rng.integers(1, 12, size=n))
+    return [(start, stop) for start, stop in zip(np.r_[0, bounds[:-1]], bounds) if start < n]
+
+
+def _stream(session, text):
+    rows = []
+    for start, stop in _pieces(len(text)):
+        rows.extend(session.feed(text[start:stop]))
+    return rows, rows + session.feed("", final=True)
+
+
+def test_encoder_matches_offline_chunks(models):
+    _, _, tokenizer, encoder = models
+    text = italian_text(N_WORDS, seed=SEED)
+    tokens, _, states = dissimilarity.encode_chunks(text, tokenizer, encoder, encoder.device)
+    expected = dissimilarity.windowed_dissimilarity(states[-dissimilarity.N_LAYERS:].mean(dim=0)).numpy()
+    ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+    assert tokenizer.convert_ids_to_tokens(ids) == tokens and len(ids) > 2 * 512
+
+    stream = IncrementalEncoder(encoder)
+    values = [stream.feed(ids[start:stop]) for start, stop in _pieces(len(ids))]
+    step = 512 - 128
+    assert sum(map(len, values)) == 512 + (len(ids) - 512) // step * step   # the tokens of the complete chunks
+    values = np.concatenate(values + [stream.feed([], final=True)])
+    np.testing.assert_allclose(values, expected, rtol=0, atol=1e-5)
+
+
+def test_stream_matches_whole_text(models):
+    #a session fed the whole text at once tokenizes and chunks it as offline
+    text = italian_text(N_WORDS, seed=SEED)
+    expected = StreamSession(*models).feed(text, final=True)
+    session = StreamSession(*models)
+    before_final, rows = _stream(session, text)
+    assert [row["word"] for row in rows] == [row["word"] for row in expected]
+    assert [row["index"] for row in rows] == list(range(len(rows)))
+    for column in ("surprisal", "semantic_dissimilarity"):
+        np.testing.assert_allclose([row[column] for row in rows], [row[column] for row in expected], rtol=0, atol=1e-4)
+    assert 0 < len(before_final) < len(rows)   # the words of complete chunks are not held to the end
+    assert session.latency_report()["n_words"] == len(rows)
+
+
+def test_lookahead_releases_words_early(models):
+    text = italian_text(200, seed=SEED)
+    session = StreamSession(*models, lookahead=8)
+    before_final, rows = _stream(session, text)
+    assert len(before_final) >= len(rows) - 10
+    #words wait for their right context: the latency includes the wait
+    latencies = sorted(row["latency"] for row in before_final)
+    assert latencies[-1] > latencies[0]
+
+
+def test_failing_session_reports_error():
+    def factory():
+        raise RuntimeError("no model")
+
+    async def run():
+        server = StreamServer(factory)
+        tcp = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        client = await StreamClient.connect("s", port=tcp.sockets[0].getsockname()[1])
+        await client.send("una volta ")
+        with pytest.raises(RuntimeError, match="no model"):
+            await asyncio.wait_for(client.flush(), 10)
+        client.writer.close()
+        tcp.close()
+        await tcp.wait_closed()
+
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import torch
+from benchmarks.synthetic import italian_text
+from nlp_pipeline.models import get_model, get_tokenizer
+from nlp_pipeline.surprisal import STAT_AGGREGATION, next_token_stats, token_stats
+
+TOP_K = 5
+
+
+@pytest.fixture(scope="module")
+def lm(tiny_models):
+    lm_dir, _ = tiny_models
+    tokenizer, model = get_tokenizer(lm_dir), get_model(lm_dir, "causal")
+    input_ids = tokenizer(italian_text(150, seed=2), return_tensors="pt", add_special_tokens=False)["input_ids"]
+    return model, input_ids
+
+
+def _strided(model, input_ids, context_length, stride, max_length):
+    #baseline: every block re-encodes its whole window from scratch, without a key/value cache
+    n_tokens = input_ids.size(-1)
+    logits, restarts, window = [], [], 0
+    with torch.no_grad():
+        for pos in range(0, n_tokens, stride):
+            stop = min(pos + stride, n_tokens)
+            if stop - window > max_length:
+                window = pos - context_length
+                restarts.append(pos)
+            logits.append(model(input_ids[:, window:stop]).logits[0, pos - window:])
+    logits = torch.cat(logits)
+    stats = next_token_stats(logits[:-1], input_ids[0, 1:], TOP_K)
+    out = torch.full((len(STAT_AGGREGATION), n_tokens), float("nan"))
+    out[:, 1:] = torch.stack([stats[name] for name in STAT_AGGREGATION])
+    return out, restarts
+
+
+@pytest.mark.parametrize("context_length, stride, max_length", [(24, 16, 64), (20, 16, 60), (0, 32, 64), (40, 1, 48)])
+def test_cached_windows_match_strided_recomputation(lm, context_length, stride, max_length):
+    model, input_ids = lm
+    expected, restarts = _strided(model, input_ids, context_length, stride, max_length)
+    assert len(restarts) >= 2
+
+    stats = token_stats(model, input_ids, context_length, stride, max_length, TOP_K)
+    assert torch.isnan(stats[:, 0]).all()
+    for k, name in enumerate(STAT_AGGREGATION):
+        tolerance = 0 if name == "rank" else 1e-4
+        np.testing.assert_allclose(stats[k, 1:].numpy(), expected[k, 1:].numpy(), rtol=0, atol=tolerance, err_msg=name)
+    #first token of every restarted window, predicted from the end of the previous window
+    np.testing.assert_allclose(stats[:, restarts].numpy(), expected[:, restarts].numpy(), rtol=0, atol=1e-4)
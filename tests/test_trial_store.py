@@ -0,0 +1,58 @@
+import multiprocessing
+import numpy as np
+import pytest
+import trial_store
+from trial_store import TrialStore
+
+TRIAL_LEN = 50
+STORIES = [f"story_{k}" for k in range(6)]
+
+
+def _story(predictor: str, story: str) -> np.ndarray:
+    seed = sum(map(ord, predictor + story))
+    return np.random.default_rng(seed).normal(size=TRIAL_LEN * (2 + seed % 3))
+
+
+def _add_subject(root: str, subject: int):
+    #one 'Subject Predictors.py' run: this subject's story order, every story added once per predictor
+    store = TrialStore(root, trial_len=TRIAL_LEN)
+    order = list(np.random.default_rng(subject).permutation(STORIES))
+    for predictor in ("freq", "surp"):
+        for story in order:
+            store.add_story(predictor, story, _story(predictor, story))
+    store.add_subject(str(subject), order, n_trials=8, trials_per_story=2)
+    store.save()
+
+
+def _expected(subject: int, predictor: str) -> np.ndarray:
+    order = np.random.default_rng(subject).permutation(STORIES)
+    x = np.concatenate([_story(predictor, s)[:2 * TRIAL_LEN] for s in order])[:8 * TRIAL_LEN]
+    return np.concatenate([x, np.zeros(8 * TRIAL_LEN - len(x))]).reshape(8, TRIAL_LEN)
+
+
+def test_trials_follow_the_story_order(tmp_path):
+    _add_subject(str(tmp_path), 1)
+    store = TrialStore(str(tmp_path))
+    np.testing.assert_array_equal(store.trials("1", "surp"), _expected(1, "surp"))
+
+
+@pytest.mark.skipif(trial_store.fcntl is None, reason="no file locking on this platform")
+def test_concurrent_writers_keep_every_story_and_subject(tmp_path):
+    subjects = list(range(8))
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_add_subject, args=(str(tmp_path), s)) for s in subjects]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert all(w.exitcode == 0 for w in workers)
+
+    store = TrialStore(str(tmp_path))
+    assert sorted(store.index["subjects"]) == sorted(map(str, subjects))
+    for predictor in ("freq", "surp"):
+        assert sorted(store.index["predictors"][predictor]) == STORIES
+        for s in subjects:
+            np.testing.assert_array_equal(store.trials(str(s), predictor), _expected(s, predictor))
+    #each story stored exactly once
+    total = sum(len(_story(p, s)) for p in ("freq", "surp") for s in STORIES)
+    assert store.nbytes() == total * 8